@@ -0,0 +1,285 @@
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Script and default (cpus, gpus) for each step a manifest row can run
+STEPS = {
+    "dorado": (os.path.join(REPO_DIR, "dorado", "dorado_run.py"), 8, 1),
+    "split": (os.path.join(REPO_DIR, "dorado", "bam_split.py"), 4, 0),
+    "filter": (os.path.join(REPO_DIR, "samtools", "samtools_filtering.py"), 4, 0),
+    "remora": (os.path.join(REPO_DIR, "remora_run_v2.py"), 8, 1),
+    "shell": (None, 1, 0),
+}
+
+# Data directories remora_run_v2.py reads relative to its working directory
+SHARED_DIRS = ["stationaryfiles", "reference_files"]
+
+class ManifestError(Exception):
+    pass
+
+class Run:
+    """One manifest row: a step, its arguments and the resources it holds while running"""
+    def __init__(self, name, step, args, workdir=None, cpus=None, gpus=None, depends=None):
+        if step not in STEPS:
+            raise ManifestError(f"{name}: unknown step {step}; use one of {', '.join(STEPS)}")
+        _, default_cpus, default_gpus = STEPS[step]
+        self.name = name
+        self.step = step
+        self.args = shlex.split(args) if isinstance(args, str) else [str(a) for a in (args or [])]
+        self.workdir = workdir or "."
+        self.cpus = int(cpus) if cpus not in (None, "") else default_cpus
+        self.gpus = int(gpus) if gpus not in (None, "") else default_gpus
+        if isinstance(depends, str):
+            depends = [d.strip() for d in depends.split(',') if d.strip()]
+        self.depends = list(depends or [])
+
+    def command(self):
+        if self.step == "shell":
+            return ["bash", "-c", " ".join(self.args)]
+        return [sys.executable, STEPS[self.step][0], *self.args]
+
+    def fingerprint(self):
+        """Changes when the row changes, so an edited row is run again after a restart"""
+        payload = json.dumps([self.step, self.args, os.path.abspath(self.workdir)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+def load_manifest(path):
+    """
+    Read runs from a TSV (columns: name, step, args, and optionally workdir,
+    cpus, gpus, depends) or a YAML list of mappings with the same keys.
+    """
+    if path.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise ManifestError("PyYAML is required for YAML manifests. Install it with 'pip install pyyaml' or use TSV.")
+        with open(path) as f:
+            rows = yaml.safe_load(f) or []
+    else:
+        with open(path, newline='') as f:
+            rows = [row for row in csv.DictReader(
+                (line for line in f if line.strip() and not line.startswith("#")), delimiter="\t"
+            )]
+    runs = []
+    for number, row in enumerate(rows, 1):
+        if "name" not in row or "step" not in row:
+            raise ManifestError(f"Manifest row {number} needs a name and a step")
+        runs.append(Run(str(row["name"]), row["step"], row.get("args"), row.get("workdir"),
+                        row.get("cpus"), row.get("gpus"), row.get("depends")))
+    names = [run.name for run in runs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ManifestError(f"Duplicate run names: {', '.join(sorted(duplicates))}")
+    for run in runs:
+        missing = [d for d in run.depends if d not in names]
+        if missing:
+            raise ManifestError(f"{run.name} depends on unknown runs: {', '.join(missing)}")
+    # Peel off rows whose dependencies are all peeled; what is left depends on a cycle
+    ordered = set()
+    remaining = list(runs)
+    while remaining:
+        ready = [run for run in remaining if all(d in ordered for d in run.depends)]
+        if not ready:
+            raise ManifestError(f"Dependency cycle among runs: {', '.join(run.name for run in remaining)}")
+        ordered.update(run.name for run in ready)
+        remaining = [run for run in remaining if run.name not in ordered]
+    return runs
+
+class StatusFile:
+    """JSON record of each run's state, rewritten after every change so a restart can resume"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_done(self, run):
+        entry = self.entries.get(run.name)
+        return entry is not None and entry["status"] == "done" and entry.get("fingerprint") == run.fingerprint()
+
+    def update(self, run, **fields):
+        with self.lock:
+            entry = self.entries.setdefault(run.name, {})
+            entry.update(fields, fingerprint=run.fingerprint())
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+class ResourcePool:
+    """CPU and GPU slots shared by every run; GPUs are handed out by ID"""
+    def __init__(self, cpus, gpu_ids):
+        self.free_cpus = cpus
+        self.free_gpus = list(gpu_ids)
+        self.total_cpus = cpus
+        self.total_gpus = len(gpu_ids)
+
+    def fits(self, run):
+        return run.cpus <= self.free_cpus and run.gpus <= len(self.free_gpus)
+
+    def acquire(self, run):
+        self.free_cpus -= run.cpus
+        gpus, self.free_gpus = self.free_gpus[:run.gpus], self.free_gpus[run.gpus:]
+        return gpus
+
+    def release(self, run, gpus):
+        self.free_cpus += run.cpus
+        self.free_gpus.extend(gpus)
+
+def default_cpus():
+    # LSF sets LSB_DJOB_NUMPROC to the cores of the allocation
+    return int(os.environ.get("LSB_DJOB_NUMPROC") or os.cpu_count() or 1)
+
+def default_gpu_ids():
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is None:
+        return ["0"]
+    return [g.strip() for g in visible.split(',') if g.strip()]
+
+def prepare_workdir(workdir):
+    """Create a run's working directory and link in the data directories remora_run_v2.py expects"""
+    os.makedirs(workdir, exist_ok=True)
+    for name in SHARED_DIRS:
+        link = os.path.join(workdir, name)
+        if not os.path.lexists(link) and os.path.abspath(workdir) != REPO_DIR:
+            os.symlink(os.path.join(REPO_DIR, name), link)
+
+class BatchRunner:
+    """
+    Run manifest rows as soon as their dependencies are done and their CPU/GPU
+    request fits, so cheap CPU steps of one run overlap GPU steps of another.
+    """
+    def __init__(self, runs, pool, status, log_dir):
+        self.runs = runs
+        self.pool = pool
+        self.status = status
+        self.log_dir = log_dir
+        self.state = {}
+        self.condition = threading.Condition()
+
+    def execute(self, run, gpus):
+        log_path = os.path.abspath(os.path.join(self.log_dir, f"{run.name}.log"))
+        env = os.environ.copy()
+        if run.gpus:
+            # Each run sees only its GPUs, so device 0 inside the run is its first GPU
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(gpus)
+        start = time.time()
+        return_code = -1
+        try:
+            self.status.update(run, status="running", started=datetime.datetime.now().isoformat(timespec="seconds"),
+                               gpus=gpus, log=log_path)
+            prepare_workdir(run.workdir)
+            with open(log_path, 'w') as log_out:
+                log_out.write(f"$ {shlex.join(run.command())}\n")
+                log_out.flush()
+                return_code = subprocess.run(run.command(), cwd=run.workdir, env=env,
+                                             stdout=log_out, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            print(f"[{run.name}] Failed to start: {e}")
+        finally:
+            state = "done" if return_code == 0 else "failed"
+            try:
+                self.status.update(run, status=state, return_code=return_code,
+                                   finished=datetime.datetime.now().isoformat(timespec="seconds"),
+                                   seconds=round(time.time() - start, 1))
+            finally:
+                # Always hand the slots back, or the scheduler would wait forever
+                with self.condition:
+                    self.state[run.name] = state
+                    self.pool.release(run, gpus)
+                    print(f"[{run.name}] {state} after {time.time() - start:.0f}s (log: {log_path})")
+                    self.condition.notify_all()
+
+    def run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        for run in self.runs:
+            if run.cpus > self.pool.total_cpus or run.gpus > self.pool.total_gpus:
+                raise ManifestError(
+                    f"{run.name} needs {run.cpus} CPUs and {run.gpus} GPUs but only "
+                    f"{self.pool.total_cpus} CPUs and {self.pool.total_gpus} GPUs are available"
+                )
+            if self.status.is_done(run):
+                self.state[run.name] = "done"
+                print(f"[{run.name}] Already done; skipping")
+        pending = [run for run in self.runs if run.name not in self.state]
+        threads = []
+        with self.condition:
+            while pending:
+                for run in list(pending):
+                    dep_states = [self.state.get(d) for d in run.depends]
+                    if any(s in ("failed", "blocked") for s in dep_states):
+                        self.state[run.name] = "blocked"
+                        self.status.update(run, status="blocked")
+                        print(f"[{run.name}] Blocked by a failed dependency")
+                        pending.remove(run)
+                    elif all(s == "done" for s in dep_states) and self.pool.fits(run):
+                        gpus = self.pool.acquire(run)
+                        self.state[run.name] = "running"
+                        pending.remove(run)
+                        print(f"[{run.name}] Starting {run.step} with {run.cpus} CPUs"
+                              f"{', GPUs ' + ','.join(gpus) if gpus else ''} in {run.workdir}")
+                        thread = threading.Thread(target=self.execute, args=(run, gpus))
+                        thread.start()
+                        threads.append(thread)
+                if pending and "running" not in self.state.values():
+                    # Nothing is running to free resources or finish a dependency, so the rest can never start
+                    for run in pending:
+                        self.state[run.name] = "blocked"
+                        self.status.update(run, status="blocked")
+                        print(f"[{run.name}] Blocked: its dependencies can never finish")
+                    pending = []
+                if pending:
+                    # Something finished: resources were freed or a dependency changed state
+                    self.condition.wait()
+        for thread in threads:
+            thread.join()
+        return self.state
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many dorado/filter/remora runs from a manifest in one allocation")
+    parser.add_argument("manifest", help="TSV or YAML manifest of runs")
+    parser.add_argument("--cpus", type=int, default=default_cpus(),
+                        help="CPU slots shared by all runs (default: LSB_DJOB_NUMPROC or all cores)")
+    parser.add_argument("--gpus", help="Comma-separated GPU IDs shared by all runs (default: CUDA_VISIBLE_DEVICES or 0)")
+    parser.add_argument("--status", default="batch_status.json", help="Run status file used to resume (default: batch_status.json)")
+    parser.add_argument("--log-dir", default="batch_logs", help="Directory for per-run logs (default: batch_logs)")
+    parser.add_argument("--rerun", nargs='+', default=[], help="Run these names again even if they are done")
+
+    args = parser.parse_args()
+
+    gpu_ids = [g.strip() for g in args.gpus.split(',') if g.strip()] if args.gpus is not None else default_gpu_ids()
+    try:
+        runs = load_manifest(args.manifest)
+        status = StatusFile(args.status)
+        for name in args.rerun:
+            status.entries.pop(name, None)
+        runner = BatchRunner(runs, ResourcePool(args.cpus, gpu_ids), status, args.log_dir)
+        print(f"Running {len(runs)} runs on {args.cpus} CPUs and GPUs {','.join(gpu_ids) or 'none'}")
+        state = runner.run()
+    except (ManifestError, OSError, ValueError) as e:
+        print(f"Batch failed: {e}")
+        sys.exit(1)
+
+    print("=== Batch summary ===")
+    for run in runs:
+        print(f"{run.name}: {state.get(run.name)}")
+    if any(s != "done" for s in state.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import bench_model
+
+# remora's default super batch: chunks each core dataset copies into RAM at a time
+REMORA_SUPER_BATCH = 100_000
+
+# Proportions of the seven-folder training set remora_run_v2.py weights 16 16 16 1 1 1 1
+DEFAULT_WEIGHTS = [16, 16, 16, 1, 1, 1, 1]
+
+def process_tree(pid):
+    """pid and every descendant, from /proc/<pid>/task/*/children"""
+    pids = [pid]
+    for current in pids:
+        task_dir = f"/proc/{current}/task"
+        try:
+            for tid in os.listdir(task_dir):
+                with open(os.path.join(task_dir, tid, "children")) as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+def memory_mb(pids):
+    """
+    Summed PSS of the processes in MB, split into anonymous, file-backed (libraries and
+    memory-mapped chunks) and shared-memory pages. PSS divides shared pages between the processes
+    mapping them, so buffers shared with the workers are not counted twice.
+    """
+    totals = {"Pss": 0, "Pss_Anon": 0, "Pss_File": 0, "Pss_Shmem": 0}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in totals:
+                        totals[key] += int(value.split()[0])
+        except OSError:
+            continue
+    return {
+        "total": totals["Pss"] / 1024,
+        "anon": totals["Pss_Anon"] / 1024,
+        "file": totals["Pss_File"] / 1024,
+        "shmem": totals["Pss_Shmem"] / 1024,
+    }
+
+def make_synthetic(out_dir, num_chunks, chunk_context, kmer_context_bases, weights, seed=0):
+    """
+    Write remora chunk folders of random chunks, can_*_chunks first then 8oxo*_chunks,
+    and a make_config-style config weighting them by weights. Returns the config path.
+    """
+    import numpy as np
+    from remora.data_chunks import CoreRemoraDataset, DatasetMetadata
+    from remora.refine_signal_map import SigMapRefiner
+
+    rng = np.random.default_rng(seed)
+    chunk_width = sum(chunk_context)
+    # About one base per ten signal points, as for R10 at 5 kHz
+    seq_len = max(1, chunk_width // 10)
+    config = []
+    num_can = (len(weights) + 1) // 2
+    for index, weight in enumerate(weights):
+        is_can = index < num_can
+        name = f"can_G{29 + index}_chunks" if is_can else f"8oxoG{29 + index}_chunks"
+        path = os.path.join(out_dir, name)
+        config.append({"path": os.path.abspath(path), "weight": weight})
+        if os.path.exists(os.path.join(path, "metadata.jsn")):
+            continue
+        os.makedirs(path, exist_ok=True)
+        dataset = CoreRemoraDataset(
+            path,
+            mode="w",
+            metadata=DatasetMetadata(
+                allocate_size=num_chunks,
+                max_seq_len=seq_len,
+                mod_bases=[] if is_can else ["o"],
+                mod_long_names=[] if is_can else ["8oxoG"],
+                motif_sequences=["TTAGGG"],
+                motif_offsets=[3],
+                extra_metadata_arrays={"modbase_label": ("int64", "Modified base label")},
+                chunk_context=chunk_context,
+                kmer_context_bases=kmer_context_bases,
+                sig_map_refiner=SigMapRefiner(),
+            ),
+        )
+        mapping = np.linspace(0, chunk_width, seq_len + 1).astype(np.int16)
+        for start in range(0, num_chunks, 10_000):
+            count = min(10_000, num_chunks - start)
+            dataset.write_batch({
+                "signal": rng.standard_normal((count, 1, chunk_width), dtype=np.float32),
+                "sequence": rng.integers(0, 4, (count, dataset.metadata.sequence_width), dtype=np.int8),
+                "sequence_to_signal_mapping": np.broadcast_to(mapping, (count, seq_len + 1)).copy(),
+                "sequence_lengths": np.full(count, seq_len, dtype=np.int16),
+                "modbase_label": np.full(count, 0 if is_can else 1, dtype=np.int64),
+            })
+        dataset.write_metadata()
+        dataset.close_memmaps()
+    config_path = os.path.join(out_dir, "train_dataset.jsn")
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    return config_path
+
+def remora_batches(config, batch_size, workers, chunk_context, release_every):
+    """Batches as remora model train loads them: super batches through a torch DataLoader"""
+    import torch
+    from remora.data_chunks import dataloader_worker_init, load_dataset
+
+    dataset = load_dataset(
+        config,
+        core_ds_kwargs={"override_metadata": {"chunk_context": chunk_context} if chunk_context else {}},
+        ds_kwargs={
+            "batch_size": batch_size,
+            "super_batch_size": REMORA_SUPER_BATCH,
+            "return_arrays": ["signal", "modbase_label", "enc_kmer"],
+        },
+        skip_hash=True,
+    )
+    loader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=None,
+        pin_memory=torch.cuda.is_available(),
+        num_workers=workers,
+        prefetch_factor=10 if workers else None,
+        persistent_workers=bool(workers),
+        worker_init_fn=dataloader_worker_init,
+    )
+    return iter(loader), None
+
+def mmap_batches(config, batch_size, workers, chunk_context, release_every, compact_kmers=False):
+    import chunk_loader
+
+    if release_every is None:
+        release_every = chunk_loader.RELEASE_EVERY
+    loader = chunk_loader.ChunkLoader(config, batch_size, num_workers=workers, chunk_context=chunk_context,
+                                      release_every=release_every, compact_kmers=compact_kmers)
+    return loader, loader.close
+
+def mmap_compact_batches(config, batch_size, workers, chunk_context, release_every):
+    """The mmap loader giving int8 k-mer base codes instead of one-hot channels"""
+    return mmap_batches(config, batch_size, workers, chunk_context, release_every, compact_kmers=True)
+
+LOADERS = {"remora": remora_batches, "mmap": mmap_batches, "mmap-compact": mmap_compact_batches}
+
+def bench_loader(name, config, settings, results):
+    """Time one loader in this process and put its result on the results queue"""
+    import torch
+
+    torch.set_num_threads(1)
+    chunk_context = (settings["chunk_context"], settings["chunk_context"]) if settings["chunk_context"] else None
+    # What this process holds before the loader exists, for comparison with the peaks
+    baseline = memory_mb([os.getpid()])
+    start = time.perf_counter()
+    batches, close = LOADERS[name](config, settings["batch_size"], settings["workers"], chunk_context,
+                                   settings["release_every"])
+    peak = {"total": 0.0, "anon": 0.0, "file": 0.0, "shmem": 0.0}
+    try:
+        sigs, labels, enc_kmers = next(batches)
+        first_batch_s = time.perf_counter() - start
+        for _ in range(settings["warmup"]):
+            next(batches)
+        timed_start = time.perf_counter()
+        for index in range(settings["batches"]):
+            sigs, labels, enc_kmers = next(batches)
+            if index % settings["sample_every"] == 0:
+                usage = memory_mb(process_tree(os.getpid()))
+                peak = {key: max(peak[key], usage[key]) for key in peak}
+        elapsed = time.perf_counter() - timed_start
+        shapes = [list(sigs.shape), list(labels.shape), list(enc_kmers.shape)]
+    finally:
+        if close is not None:
+            close()
+    results.put({
+        "loader": name,
+        **settings,
+        "first_batch_s": round(first_batch_s, 2),
+        "batches_per_sec": round(settings["batches"] / elapsed, 2),
+        "chunks_per_sec": round(settings["batches"] * settings["batch_size"] / elapsed, 1),
+        "baseline_pss_mb": round(baseline["total"], 1),
+        "peak_pss_mb": {key: round(value, 1) for key, value in peak.items()},
+        "batch_shapes": shapes,
+        "kmer_batch_mb": round(enc_kmers.numel() * enc_kmers.element_size() / 2 ** 20, 2),
+    })
+
+def run_isolated(name, config, settings):
+    """
+    Run one loader in a fresh process so memory is not inherited from the other.
+    Not a Pool: pool processes are daemons and may not start loader workers.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=bench_loader, args=(name, config, settings, results))
+    process.start()
+    result = None
+    while result is None and (process.is_alive() or not results.empty()):
+        try:
+            result = results.get(timeout=1)
+        except Exception:
+            continue
+    process.join()
+    if result is None:
+        raise RuntimeError(f"The {name} loader benchmark exited with code {process.exitcode}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training-batch loading from prepared chunk folders on the CPU")
+    data = parser.add_mutually_exclusive_group(required=True)
+    data.add_argument("--config", help="Dataset config from remora dataset make_config, e.g. train_dataset.jsn")
+    data.add_argument("--synthetic", metavar="DIR",
+                      help="Write random chunk folders and a config in DIR (kept for later runs) and benchmark those")
+    parser.add_argument("--synthetic-chunks", type=int, default=200_000,
+                        help="Chunks per synthetic folder (default: 200000)")
+    parser.add_argument("--weights", type=bench_model.parse_int_list, default=DEFAULT_WEIGHTS,
+                        help=f"Synthetic folder weights; can folders first (default: {','.join(map(str, DEFAULT_WEIGHTS))})")
+    parser.add_argument("--chunk-context", type=int, default=None,
+                        help="Chunk context on each side (default: as stored; synthetic folders use 50)")
+    parser.add_argument("--loaders", default="remora,mmap", help=f"Comma-separated loaders to compare: {', '.join(LOADERS)} (default: remora,mmap)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Chunks per batch (default: 1024)")
+    parser.add_argument("--workers", type=int, default=2, help="Loader worker processes, as remora uses (default: 2)")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed batches after the first (default: 5)")
+    parser.add_argument("--batches", type=int, default=100, help="Timed batches (default: 100)")
+    parser.add_argument("--sample-every", type=int, default=5, help="Batches between memory samples (default: 5)")
+    parser.add_argument("--release-every", type=int, default=None,
+                        help="Batches between unmapping chunk arrays in the mmap loader (default: chunk_loader's)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+
+    args = parser.parse_args()
+
+    loaders = [name.strip() for name in args.loaders.split(',') if name.strip()]
+    unknown = [name for name in loaders if name not in LOADERS]
+    if unknown:
+        parser.error(f"Unknown loaders: {', '.join(unknown)}; use {', '.join(LOADERS)}")
+    if args.batches < 1 or args.warmup < 0 or args.sample_every < 1:
+        parser.error("--batches and --sample-every must be at least 1 and --warmup at least 0")
+    if args.config and not os.path.exists(args.config):
+        parser.error(f"Dataset config not found: {args.config}")
+
+    config = args.config
+    if args.synthetic:
+        context = args.chunk_context or 50
+        print(f"Preparing synthetic chunk folders in {args.synthetic}", file=sys.stderr)
+        os.makedirs(args.synthetic, exist_ok=True)
+        config = make_synthetic(args.synthetic, args.synthetic_chunks, (context, context), (4, 4), args.weights)
+
+    settings = {
+        "batch_size": args.batch_size,
+        "workers": args.workers,
+        "warmup": args.warmup,
+        "batches": args.batches,
+        "sample_every": args.sample_every,
+        "chunk_context": args.chunk_context,
+        "release_every": args.release_every,
+    }
+    results = []
+    for name in loaders:
+        result = run_isolated(name, config, settings)
+        results.append(result)
+        print(f"{name}: {result['batches_per_sec']:.1f} batches/sec ({result['chunks_per_sec']:.0f} chunks/sec), "
+              f"first batch after {result['first_batch_s']:.1f}s, peak PSS {result['peak_pss_mb']['total']:.0f} MB "
+              f"({result['peak_pss_mb']['anon']:.0f} anon, {result['peak_pss_mb']['file']:.0f} file-backed, "
+              f"{result['peak_pss_mb']['shmem']:.0f} shared; {result['baseline_pss_mb']:.0f} before loading)", file=sys.stderr)
+
+    import torch
+
+    environment = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": bench_model.git_commit(),
+        "host": bench_model.platform.node(),
+        "cpu": bench_model.cpu_name(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "config": config,
+        "lsf_job_id": os.environ.get("LSB_JOBID"),
+    }
+    report = {"environment": environment, "results": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
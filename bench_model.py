@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import fuse_model
+
+# k-mer input forms: remora's float one-hot channels, or int8 base codes for models that take them
+INPUT_KINDS = ["onehot", "compact"]
+
+def parse_int_list(value):
+    return [int(x) for x in value.split(',') if x.strip()]
+
+def parse_str_list(value):
+    return [x.strip() for x in value.split(',') if x.strip()]
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def status_mb(field):
+    """A kB field of /proc/self/status (VmRSS, VmHWM) in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise OSError(f"No {field} in /proc/self/status")
+
+def reset_peak_rss():
+    """Restart the VmHWM peak from the current RSS (Linux 4.0+); False where that is not possible"""
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def bench_config(model_file, config, warmup, iterations, seed):
+    """Time network.forward for one configuration; runs in its own process"""
+    import torch
+
+    torch.set_num_threads(config["threads"])
+    torch.manual_seed(seed)
+    model = fuse_model.load_network_class(model_file)(
+        size=config["size"], kmer_len=config["kmer_len"], num_out=2
+    )
+    model.eval()
+    if hasattr(model, "fuse"):
+        model.fuse()
+    # Chunks are centred on the focus base, with chunk_context signal points either side
+    chunk_len = 2 * config["chunk_context"]
+    sigs, seqs = fuse_model.random_inputs(config["batch_size"], chunk_len, config["kmer_len"], seed)
+    if config["inputs"] == "compact":
+        # The same k-mers as base codes, as chunk_loader.kmer_bases gives them
+        seqs = seqs.reshape(config["batch_size"], config["kmer_len"], 4, chunk_len).argmax(2).to(torch.int8)
+    # Setting up inputs can peak above the forward passes (one-hot inputs are built from
+    # int64 bases), so the forward peak is measured from a reset high-water mark
+    setup_peak_rss = max_rss_mb()
+    if reset_peak_rss():
+        baseline_rss = status_mb("VmRSS")
+        forward_peak_rss = lambda: status_mb("VmHWM")
+    else:
+        baseline_rss = setup_peak_rss
+        forward_peak_rss = max_rss_mb
+
+    latencies = []
+    with torch.no_grad():
+        for iteration in range(warmup + iterations):
+            start = time.perf_counter()
+            model(sigs, seqs)
+            elapsed = time.perf_counter() - start
+            if iteration >= warmup:
+                latencies.append(elapsed)
+
+    latencies.sort()
+    forward_rss = forward_peak_rss() - baseline_rss
+    peak_rss = max(setup_peak_rss, max_rss_mb())
+    total = sum(latencies)
+    return {
+        **config,
+        "chunk_len": chunk_len,
+        "latency_ms": {
+            "mean": round(1000 * total / len(latencies), 3),
+            "p50": round(1000 * percentile(latencies, 50), 3),
+            "p90": round(1000 * percentile(latencies, 90), 3),
+            "p99": round(1000 * percentile(latencies, 99), 3),
+            "max": round(1000 * latencies[-1], 3),
+        },
+        "chunks_per_sec": round(iterations * config["batch_size"] / total, 1),
+        "seqs_input_mb": round(seqs.numel() * seqs.element_size() / 2 ** 20, 2),
+        "peak_rss_mb": round(peak_rss, 1),
+        "forward_rss_mb": round(forward_rss, 1),
+    }
+
+def run_isolated(model_file, config, warmup, iterations, seed):
+    """Run one configuration in a fresh process so peak RSS is not inherited from earlier ones"""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(bench_config, (model_file, config, warmup, iterations, seed))
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def cpu_name():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+def environment(model_file):
+    """What produced the numbers, so results from different commits and hosts can be told apart"""
+    import torch
+
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "model_file": model_file,
+        "model_sha256": file_sha256(model_file),
+        "host": platform.node(),
+        "cpu": cpu_name(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "lsf_job_id": os.environ.get("LSB_JOBID"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the remora model forward pass on the CPU")
+    parser.add_argument("--model", default=fuse_model.ORIGINAL_MODEL,
+                        help=f"Model architecture file (default: {fuse_model.ORIGINAL_MODEL})")
+    parser.add_argument("--batch-sizes", type=parse_int_list, default=[256, 1024],
+                        help="Comma-separated batch sizes (default: 256,1024)")
+    parser.add_argument("--chunk-contexts", type=parse_int_list, default=[25, 50],
+                        help="Comma-separated chunk contexts, as passed to remora_run_v2.py --chunk-context (default: 25,50)")
+    parser.add_argument("--sizes", type=parse_int_list, default=[64],
+                        help="Comma-separated model sizes (default: 64)")
+    parser.add_argument("--kmer-lens", type=parse_int_list, default=[9],
+                        help="Comma-separated k-mer lengths (default: 9)")
+    parser.add_argument("--inputs", type=parse_str_list, default=["onehot"],
+                        help="Comma-separated k-mer input forms: onehot, and compact for models that take int8 "
+                             "base codes such as stationaryfiles/ConvLSTM_w_ref_kmer.py (default: onehot)")
+    parser.add_argument("--threads", type=parse_int_list, default=[1, os.cpu_count() or 1],
+                        help="Comma-separated torch intra-op thread counts (default: 1 and all cores)")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed batches per configuration (default: 3)")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed batches per configuration (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for weights and inputs (default: 0)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+
+    args = parser.parse_args()
+
+    if args.iterations < 1 or args.warmup < 0:
+        parser.error("--iterations must be at least 1 and --warmup at least 0")
+    if not os.path.exists(args.model):
+        parser.error(f"Model file not found: {args.model}")
+    unknown = [kind for kind in args.inputs if kind not in INPUT_KINDS]
+    if unknown:
+        parser.error(f"Unknown inputs: {', '.join(unknown)}; use {', '.join(INPUT_KINDS)}")
+    if "compact" in args.inputs and not getattr(fuse_model.load_network_class(args.model), "_compact_kmers_possible", False):
+        parser.error(f"{args.model} does not take compact k-mer input")
+
+    configs = [
+        {"batch_size": b, "chunk_context": c, "size": s, "kmer_len": k, "threads": t, "inputs": i}
+        for b, c, s, k, t, i in itertools.product(
+            args.batch_sizes, args.chunk_contexts, args.sizes, args.kmer_lens, sorted(set(args.threads)), args.inputs
+        )
+    ]
+
+    results = []
+    for index, config in enumerate(configs, 1):
+        result = run_isolated(args.model, config, args.warmup, args.iterations, args.seed)
+        results.append(result)
+        print(f"[{index}/{len(configs)}] batch {config['batch_size']}, context {config['chunk_context']}, "
+              f"size {config['size']}, kmer_len {config['kmer_len']}, {config['threads']} thread(s), {config['inputs']}: "
+              f"{result['chunks_per_sec']:.0f} chunks/sec, p50 {result['latency_ms']['p50']:.1f} ms, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB (+{result['forward_rss_mb']:.0f} MB in forward), "
+              f"k-mer input {result['seqs_input_mb']:.1f} MB", file=sys.stderr)
+
+    report = {
+        "environment": environment(args.model),
+        "settings": {"warmup": args.warmup, "iterations": args.iterations, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import datetime
+from pathlib import Path
+
+# Files at or below this size are hashed by content, larger ones by size/mtime
+CONTENT_HASH_LIMIT = 1024 * 1024
+
+def fingerprint_path(path):
+    """Return a JSON-serialisable fingerprint of a file or directory"""
+    if path is None:
+        return None
+    path = Path(path)
+    if not path.exists():
+        return {"path": str(path), "missing": True}
+    if path.is_dir():
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = Path(root) / name
+                stat = file_path.stat()
+                entries.append([str(file_path.relative_to(path)), stat.st_size, stat.st_mtime_ns])
+        return {"path": str(path), "files": entries}
+    stat = path.stat()
+    if stat.st_size <= CONTENT_HASH_LIMIT:
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return {"path": str(path), "sha256": digest}
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def compute_key(params, files):
+    """Hash command parameters and input file fingerprints into a cache key"""
+    payload = {
+        "params": params,
+        "files": {name: fingerprint_path(path) for name, path in sorted(files.items())}
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def partial_path(output_path):
+    """Temporary location an output is written to before being renamed into place"""
+    return f"{output_path}.partial"
+
+def remove_path(path):
+    """Delete a file or directory if it exists"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def promote_partial(output_path):
+    """Atomically move a finished partial output to its final name"""
+    tmp_path = partial_path(output_path)
+    if os.path.lexists(output_path):
+        # Move the stale output aside first so the final name is never half-written
+        stale_path = f"{output_path}.stale"
+        remove_path(stale_path)
+        os.rename(output_path, stale_path)
+        os.rename(tmp_path, output_path)
+        remove_path(stale_path)
+    else:
+        os.rename(tmp_path, output_path)
+
+class ChunkManifest:
+    """JSON manifest mapping output directories to the key of the inputs that produced them"""
+    def __init__(self, path="chunk_manifest.json"):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def is_current(self, output_path, key):
+        """Whether output_path exists and was produced from inputs with this key"""
+        entry = self.entries.get(str(output_path))
+        return entry is not None and entry.get("key") == key and os.path.isdir(output_path)
+
+    def record(self, output_path, key, params=None):
+        """Store the key for a completed output and rewrite the manifest atomically"""
+        with self.lock:
+            self.entries[str(output_path)] = {
+                "key": key,
+                "params": params,
+                "completed": datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            }
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
@@ -0,0 +1,338 @@
+import queue
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from remora.data_chunks import load_dataset
+
+# Arrays returned for each batch, in the order remora model train unpacks them
+RETURN_ARRAYS = ["signal", "modbase_label", "enc_kmer"]
+
+# Batches between unmapping a dataset's arrays, so pages read for earlier batches leave RSS
+RELEASE_EVERY = 100
+
+# Seconds to wait for a worker to exit before terminating it
+JOIN_TIMEOUT = 5
+
+def open_dataset(config_path, chunk_context=None, kmer_context_bases=None, num_test_chunks=0):
+    """
+    Open the chunk folders of a make_config dataset config the way remora model train
+    does, without reading any chunks: arrays are memory-mapped and metadata
+    (label sets, contexts) is merged across folders.
+
+    Returns:
+        RemoraDataset: The training part when num_test_chunks are held out, else all chunks
+    """
+    override_metadata = {}
+    if chunk_context is not None:
+        override_metadata["chunk_context"] = tuple(chunk_context)
+    if kmer_context_bases is not None:
+        override_metadata["kmer_context_bases"] = tuple(kmer_context_bases)
+    dataset = load_dataset(
+        config_path,
+        core_ds_kwargs={"override_metadata": override_metadata},
+        ds_kwargs={"return_arrays": RETURN_ARRAYS},
+        # The config was hashed when training started; re-hashing in every worker reads every array
+        skip_hash=True,
+    )
+    if num_test_chunks:
+        dataset, _ = dataset.train_test_split(num_test_chunks)
+        for core in dataset.datasets:
+            core.set_return_arrays(RETURN_ARRAYS)
+    for core in dataset.datasets:
+        if core.filters is not None and core.filters.filter_columns:
+            raise ValueError(f"{core.data_path} has chunk filters, which the memory-mapped loader does not apply")
+    return dataset
+
+def batch_shapes(dataset, batch_size, compact_kmers=False):
+    """Shape and dtype of each returned array for a batch of batch_size chunks"""
+    chunk_width = sum(dataset.metadata.chunk_context)
+    kmer_len = dataset.metadata.kmer_len
+    return {
+        "signal": ((batch_size, 1, chunk_width), torch.float32),
+        "modbase_label": ((batch_size,), torch.int64),
+        "enc_kmer": ((batch_size, kmer_len, chunk_width), torch.int8) if compact_kmers
+        else ((batch_size, kmer_len * 4, chunk_width), torch.float32),
+    }
+
+def kmer_bases(before_context_bases, after_context_bases, seqs, seq_mappings, seq_lens):
+    """
+    Compact form of remora's encoded k-mers: the base code (0-3, or -1 for none)
+    at each k-mer position for each signal point, as an int8 (chunks, kmer_len, time)
+    array. One-hot encoding it gives exactly what compute_encoded_kmer_batch returns,
+    at a sixteenth of the size of its float32 kmer_len * 4 channels.
+    """
+    kmer_len = before_context_bases + after_context_bases + 1
+    num_chunks, mapping_width = seq_mappings.shape
+    width = int(seq_mappings[0, seq_lens[0]])
+    lens = seq_lens.astype(np.int64)
+    # The base covering each signal point is the last one starting at or before it:
+    # count base starts per point, then a running total over time gives its index
+    in_seq = np.arange(mapping_width) <= lens[:, None]
+    starts = np.clip(seq_mappings.astype(np.int64), 0, width)
+    num_starts = np.zeros((num_chunks, width + 1), dtype=np.int32)
+    np.add.at(num_starts, (np.nonzero(in_seq)[0], starts[in_seq]), 1)
+    base_index = np.cumsum(num_starts[:, :width], axis=1) - 1
+    seq_end = seq_mappings[np.arange(num_chunks), lens]
+    uncovered = (base_index < 0) | (np.arange(width) >= seq_end[:, None])
+    # Index into the flattened sequences, one k-mer position at a time
+    base_index = np.clip(base_index, 0, None) + np.arange(num_chunks)[:, None] * seqs.shape[1]
+    flat_seqs = seqs.reshape(-1)
+    codes = np.empty((num_chunks, kmer_len, width), dtype=np.int8)
+    for position in range(kmer_len):
+        codes[:, position] = flat_seqs[base_index + position]
+        codes[:, position][uncovered] = -1
+    return codes
+
+class WeightedChunkSampler:
+    """
+    Fill batches from memory-mapped chunk folders in the config's proportions.
+
+    Each batch takes a multinomial split of its chunks across folders, as remora
+    does, and reads only those chunks: the rows are gathered from the memory-mapped
+    arrays in file order, so no super batch is ever copied into RAM. Within a pass
+    over a folder every chunk is drawn once; with several workers, each draws from
+    its own share of the pass's permutation so they do not repeat each other.
+
+    Args:
+        dataset (RemoraDataset): From open_dataset
+        seed (int): Seed shared by all workers
+        worker_id (int): This worker's share of each permutation
+        num_workers (int): Number of workers drawing from the same dataset
+        release_every (int): Batches between unmapping the arrays
+        compact_kmers (bool): Give k-mers as kmer_bases codes instead of one-hot encoded
+    """
+    def __init__(self, dataset, seed=0, worker_id=0, num_workers=1, release_every=RELEASE_EVERY,
+                 compact_kmers=False):
+        self.dataset = dataset
+        self.compact_kmers = compact_kmers
+        self.props = np.asarray(dataset.props, dtype=float)
+        self.props = self.props / self.props.sum()
+        self.seed = seed
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.release_every = release_every
+        self.rng = np.random.default_rng([seed, worker_id])
+        self.orders = [None] * len(dataset.datasets)
+        self.cursors = [0] * len(dataset.datasets)
+        self.passes = [0] * len(dataset.datasets)
+        self.batches = 0
+
+    def next_rows(self, index, count):
+        """Absolute row numbers of the next count chunks of dataset index, in file order"""
+        core = self.dataset.datasets[index]
+        rows = []
+        while count > 0:
+            if self.orders[index] is None or self.cursors[index] >= len(self.orders[index]):
+                # Same permutation in every worker for this pass; each keeps every num_workers-th chunk
+                order = np.random.default_rng([self.seed, index, self.passes[index]]).permutation(core.size)
+                share = order[self.worker_id::self.num_workers]
+                self.orders[index] = share.astype(np.int32 if core.size < 2 ** 31 else np.int64)
+                self.cursors[index] = 0
+                self.passes[index] += 1
+                if not len(share):
+                    raise ValueError(f"{core.data_path} has fewer chunks than there are loader workers")
+            take = self.orders[index][self.cursors[index]:self.cursors[index] + count]
+            self.cursors[index] += len(take)
+            count -= len(take)
+            rows.append(take)
+        rows = np.sort(np.concatenate(rows))
+        return rows + core.metadata.dataset_start
+
+    def read_chunks(self, index, count):
+        """Arrays for count chunks of dataset index, after remora's label and context adjustments"""
+        core = self.dataset.datasets[index]
+        rows = self.next_rows(index, count)
+        # Fancy indexing a memmap copies just these rows
+        chunks = {name: getattr(core, name)[rows] for name in core.load_arrays}
+        if core.metadata.is_modbase_dataset and core.modbase_label_conv is not None:
+            chunks["modbase_label"] = core.modbase_label_conv[chunks["modbase_label"]]
+        chunks = core.trim_sb_chunk_context(core.trim_sb_kmer_context_bases(chunks))
+        if self.compact_kmers:
+            kmers = kmer_bases(*core.metadata.kmer_context_bases, chunks["sequence"],
+                               chunks["sequence_to_signal_mapping"], chunks["sequence_lengths"])
+            return chunks["signal"], chunks["modbase_label"], kmers
+        (_, enc_kmer), = core.extract_seq_output(
+            "enc_kmer", chunks["sequence"], chunks["sequence_to_signal_mapping"], chunks["sequence_lengths"]
+        )
+        return chunks["signal"], chunks["modbase_label"], enc_kmer
+
+    def fill(self, out):
+        """Write the next batch into out, a dict of numpy arrays shaped as batch_shapes gives"""
+        batch_size = len(out["modbase_label"])
+        start = 0
+        for index, count in enumerate(self.rng.multinomial(batch_size, self.props)):
+            if count == 0:
+                continue
+            signal, labels, enc_kmer = self.read_chunks(index, count)
+            out["signal"][start:start + count] = signal
+            out["modbase_label"][start:start + count] = labels
+            out["enc_kmer"][start:start + count] = enc_kmer
+            start += count
+        self.batches += 1
+        if self.release_every and self.batches % self.release_every == 0:
+            for core in self.dataset.datasets:
+                core.refresh_memmaps()
+
+def worker_main(config_path, options, worker_id, num_workers, slots, free_slots, ready_slots):
+    """Fill free slots with batches until given None; errors are passed back as text"""
+    try:
+        # Workers only read and encode chunks; torch threads would compete with each other
+        torch.set_num_threads(1)
+        dataset = open_dataset(config_path, options["chunk_context"], options["kmer_context_bases"],
+                               options["num_test_chunks"])
+        sampler = WeightedChunkSampler(dataset, options["seed"], worker_id, num_workers, options["release_every"],
+                                       options["compact_kmers"])
+        buffers = [{name: tensor.numpy() for name, tensor in slot.items()} for slot in slots]
+        while True:
+            slot = free_slots.get()
+            if slot is None:
+                break
+            sampler.fill(buffers[slot])
+            ready_slots.put(slot)
+    except Exception:
+        ready_slots.put(f"Loader worker {worker_id} failed:\n{traceback.format_exc()}")
+
+class ChunkLoader:
+    """
+    Endless training batches of (signal, labels, enc_kmers) tensors, as remora
+    model train's loader gives, read from memory-mapped chunk folders. With
+    compact_kmers, enc_kmers holds int8 kmer_bases codes for models that take
+    them, such as stationaryfiles/ConvLSTM_w_ref_kmer.py.
+
+    Worker processes fill a ring of shared batch buffers that are page-locked
+    when CUDA is available, so batches go to the GPU without an extra copy and
+    .to(device, non_blocking=True) can overlap the transfer with compute. A batch
+    is only valid until the next one is requested: its buffer is handed back to
+    the workers then.
+
+    Args:
+        config_path (str): Dataset config written by remora dataset make_config
+        batch_size (int): Chunks per batch
+        num_workers (int): Worker processes; 0 fills batches in this process
+        prefetch (int): Batches buffered ahead of the consumer
+        pin_memory (bool): Page-lock the buffers (default: when CUDA is available)
+        chunk_context, kmer_context_bases (tuple): Override the stored contexts, as in remora
+        num_test_chunks (int): Hold these out as remora does for validation
+        seed (int): Sampling seed
+        release_every (int): Batches between unmapping the arrays to keep RSS down
+        compact_kmers (bool): Give k-mers as int8 base codes instead of one-hot encoded
+    """
+    def __init__(self, config_path, batch_size, num_workers=2, prefetch=4, pin_memory=None, chunk_context=None,
+                 kmer_context_bases=None, num_test_chunks=0, seed=0, release_every=RELEASE_EVERY,
+                 compact_kmers=False):
+        self.config_path = config_path
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.options = {
+            "chunk_context": chunk_context,
+            "kmer_context_bases": kmer_context_bases,
+            "num_test_chunks": num_test_chunks,
+            "seed": seed,
+            "release_every": release_every,
+            "compact_kmers": compact_kmers,
+        }
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.dataset = open_dataset(config_path, chunk_context, kmer_context_bases, num_test_chunks)
+        self.metadata = self.dataset.metadata
+        shapes = batch_shapes(self.dataset, batch_size, compact_kmers)
+        num_slots = max(1, prefetch) + 1
+        self.slots = [
+            {name: torch.empty(shape, dtype=dtype).share_memory_() for name, (shape, dtype) in shapes.items()}
+            for _ in range(num_slots if num_workers else 1)
+        ]
+        self.registered = []
+        if self.pin_memory:
+            self.pin_slots()
+        self.current = None
+        self.processes = []
+        if num_workers:
+            self.start_workers(num_slots)
+        else:
+            self.sampler = WeightedChunkSampler(self.dataset, seed, release_every=release_every,
+                                                compact_kmers=compact_kmers)
+
+    def pin_slots(self):
+        """Page-lock the shared buffers in place, so workers write straight into pinned memory"""
+        cudart = torch.cuda.cudart()
+        for slot in self.slots:
+            for tensor in slot.values():
+                nbytes = tensor.numel() * tensor.element_size()
+                if cudart.cudaHostRegister(tensor.data_ptr(), nbytes, 0) != 0:
+                    raise RuntimeError("Could not page-lock the loader's batch buffers")
+                self.registered.append(tensor)
+
+    def start_workers(self, num_slots):
+        context = mp.get_context("spawn")
+        self.free_slots = context.Queue()
+        self.ready_slots = context.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        for worker_id in range(self.num_workers):
+            process = context.Process(
+                target=worker_main,
+                args=(self.config_path, self.options, worker_id, self.num_workers, self.slots,
+                      self.free_slots, self.ready_slots),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    def release_current(self):
+        if self.current is None:
+            return
+        if self.pin_memory:
+            # A non_blocking copy out of the buffer may still be in flight
+            torch.cuda.current_stream().synchronize()
+        if self.processes:
+            self.free_slots.put(self.current)
+        self.current = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.release_current()
+        if not self.processes:
+            self.sampler.fill({name: tensor.numpy() for name, tensor in self.slots[0].items()})
+            self.current = 0
+        else:
+            while True:
+                try:
+                    slot = self.ready_slots.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if not all(process.is_alive() for process in self.processes):
+                        raise RuntimeError("A chunk loader worker exited unexpectedly")
+            if isinstance(slot, str):
+                raise RuntimeError(slot)
+            self.current = slot
+        slot = self.slots[self.current]
+        return slot["signal"], slot["modbase_label"], slot["enc_kmer"]
+
+    def worker_pids(self):
+        return [process.pid for process in self.processes]
+
+    def close(self):
+        self.current = None
+        for _ in self.processes:
+            self.free_slots.put(None)
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.registered:
+            cudart = torch.cuda.cudart()
+            for tensor in self.registered:
+                cudart.cudaHostUnregister(tensor.data_ptr())
+            self.registered = []
+        for core in self.dataset.datasets:
+            core.close_memmaps()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
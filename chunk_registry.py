@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+import chunk_cache
+import chunk_stats
+
+DEFAULT_REGISTRY = "chunk_registry.json"
+
+# Prepared chunk folders of a registered source are kept under chunk_sets/<source>/
+CHUNK_SETS_DIR = "chunk_sets"
+
+def now():
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def dataset_name(source, path):
+    """Registry name of a chunk folder, e.g. Flongle_68/8oxoG35_chunks"""
+    return f"{source}/{os.path.basename(os.path.normpath(path))}"
+
+def g_type_of(path):
+    """G position in a chunk folder name such as 8oxoG35_chunks, or None (e.g. can_all_chunks)"""
+    match = re.search(r"(G\d+)_chunks$", os.path.basename(os.path.normpath(path)))
+    return match.group(1) if match else None
+
+class ChunkRegistry:
+    """
+    Versioned record of the prepared chunk folders that make up the training set.
+
+    Each entry keeps the folder's source run, G position, class, chunk and label
+    counts and the key of the inputs it was prepared from. The version goes up
+    whenever the set of folders changes, so a training config and the models
+    trained from it can be traced back to exactly the data they saw.
+    """
+    def __init__(self, path=DEFAULT_REGISTRY):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.version = 0
+        self.datasets = {}
+        self.history = []
+        self.models = []
+        self.changes = []
+        if self.path.exists():
+            with open(self.path) as f:
+                data = json.load(f)
+            self.version = data["version"]
+            self.datasets = data["datasets"]
+            self.history = data["history"]
+            self.models = data["models"]
+
+    def register(self, path, source, key, g_type=None):
+        """
+        Add or update the entry for a prepared chunk folder; only new or changed
+        folders are counted, so registering an unchanged folder costs nothing.
+
+        Returns:
+            bool: Whether the entry was added or changed
+        """
+        name = dataset_name(source, path)
+        with self.lock:
+            entry = self.datasets.get(name)
+            if entry is not None and entry["key"] == key and entry["path"] == str(path):
+                return False
+        start, end = chunk_stats.chunk_range(path)
+        labels = chunk_stats.label_counts(path, start, end)
+        with self.lock:
+            self.datasets[name] = {
+                "path": str(path),
+                "source": source,
+                "g_type": g_type if g_type is not None else g_type_of(path),
+                "class": chunk_stats.chunk_class(path),
+                "chunks": int(end - start),
+                "labels": labels,
+                "key": key,
+                "added": now(),
+            }
+            self.changes.append(("updated" if entry is not None else "added", name))
+        return True
+
+    def remove(self, name):
+        with self.lock:
+            if self.datasets.pop(name, None) is None:
+                raise ValueError(f"{name} is not in {self.path}")
+            self.changes.append(("removed", name))
+
+    def entries(self):
+        """Registered datasets in name order, canonical folders first as make_config lists them"""
+        return sorted(self.datasets.items(), key=lambda item: (item[1]["class"] != "can", item[0]))
+
+    def stats(self):
+        """Chunk counts in the form chunk_stats.balance_weights takes, without re-reading any folder"""
+        return [
+            {"path": entry["path"], "class": entry["class"], "chunks": entry["chunks"], "labels": entry["labels"]}
+            for _, entry in self.entries()
+        ]
+
+    def missing(self):
+        """Names of registered datasets whose folder no longer exists"""
+        return [name for name, entry in self.entries() if not os.path.isdir(entry["path"])]
+
+    def record_model(self, model_path):
+        """Remember a model trained on the current version, for --finetune-previous"""
+        with self.lock:
+            self.models.append({"version": self.version, "path": str(model_path), "trained": now()})
+        self.save()
+
+    def latest_model(self):
+        """Most recently recorded model that still exists, or None"""
+        for model in reversed(self.models):
+            if os.path.exists(model["path"]):
+                return model["path"]
+        return None
+
+    def save(self):
+        """Write the registry atomically, starting a new version if any dataset changed"""
+        with self.lock:
+            if self.changes:
+                self.version += 1
+                self.history.append({
+                    "version": self.version,
+                    "created": now(),
+                    "changes": [f"{change} {name}" for change, name in self.changes]
+                })
+                self.changes = []
+            data = {"version": self.version, "datasets": self.datasets, "history": self.history, "models": self.models}
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+def main():
+    parser = argparse.ArgumentParser(description="List and edit the versioned registry of prepared chunk datasets")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY, help=f"Registry file (default: {DEFAULT_REGISTRY})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="Show registered datasets, versions and models")
+
+    add_parser = subparsers.add_parser("add", help="Register chunk folders prepared before the registry existed")
+    add_parser.add_argument("source", help="Run the chunks came from, e.g. Minion_8")
+    add_parser.add_argument("chunk_dirs", nargs='+', help="Prepared chunk folders, e.g. can_G29_chunks 8oxoG29_chunks")
+
+    remove_parser = subparsers.add_parser("remove", help="Drop datasets from the training set (folders are kept)")
+    remove_parser.add_argument("names", nargs='+', help="Dataset names as shown by list, e.g. Minion_8/8oxoG29_chunks")
+
+    args = parser.parse_args()
+
+    registry = ChunkRegistry(args.registry)
+    try:
+        if args.command == "add":
+            for chunk_dir in args.chunk_dirs:
+                if not os.path.isdir(chunk_dir):
+                    raise ValueError(f"Chunk folder not found: {chunk_dir}")
+                # The manifest key when the pipeline prepared the folder, else the folder's own fingerprint
+                manifest_entry = chunk_cache.ChunkManifest().entries.get(chunk_dir)
+                key = manifest_entry["key"] if manifest_entry else chunk_cache.compute_key({}, {"chunks": chunk_dir})
+                registry.register(chunk_dir, args.source, key)
+            registry.save()
+        elif args.command == "remove":
+            for name in args.names:
+                registry.remove(name)
+            registry.save()
+    except (OSError, ValueError) as e:
+        print(f"Registry update failed: {e}")
+        sys.exit(1)
+
+    print(f"{registry.path}: version {registry.version}, {len(registry.datasets)} datasets")
+    for name, entry in registry.entries():
+        flag = "  (missing)" if not os.path.isdir(entry["path"]) else ""
+        print(f"  {name} [{entry['class']}, {entry['g_type'] or '-'}]: {entry['chunks']} chunks, "
+              f"added {entry['added']}{flag}")
+    for model in registry.models:
+        print(f"  model v{model['version']}: {model['path']} ({model['trained']})")
+
+if __name__ == "__main__":
+    main()
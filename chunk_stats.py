@@ -0,0 +1,136 @@
+import argparse
+import ast
+import json
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def read_npy_shape(path):
+    """Read the array shape from a .npy header without loading the data"""
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+        if magic != b"\x93NUMPY":
+            raise ValueError(f"{path} is not a .npy file")
+        major, _ = struct.unpack("<BB", f.read(2))
+        if major == 1:
+            header_len = struct.unpack("<H", f.read(2))[0]
+        else:
+            header_len = struct.unpack("<I", f.read(4))[0]
+        header = ast.literal_eval(f.read(header_len).decode("latin1"))
+    return tuple(header["shape"])
+
+def read_metadata(chunk_dir):
+    path = os.path.join(chunk_dir, "metadata.jsn")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def labels_path(chunk_dir):
+    """Label array of a chunk folder: extra_modbase_label.npy from remora 3, labels.npy before it"""
+    legacy = os.path.join(chunk_dir, "labels.npy")
+    return legacy if os.path.exists(legacy) else os.path.join(chunk_dir, "extra_modbase_label.npy")
+
+def chunk_range(chunk_dir):
+    """Return (start, end) of the filled chunks in a prepared chunk folder"""
+    metadata = read_metadata(chunk_dir)
+    if "dataset_end" in metadata:
+        return metadata.get("dataset_start", 0), metadata["dataset_end"]
+    if "size" in metadata:
+        return 0, metadata["size"]
+    # Fall back to the allocated length of the labels array
+    return 0, read_npy_shape(labels_path(chunk_dir))[0]
+
+def label_counts(chunk_dir, start, end):
+    """Count chunks per label by memory-mapping the label array; None without numpy or labels"""
+    if np is None or not os.path.exists(labels_path(chunk_dir)):
+        return None
+    labels = np.load(labels_path(chunk_dir), mmap_mode='r')
+    counts = np.bincount(np.asarray(labels[start:end], dtype=np.int64))
+    return {int(label): int(count) for label, count in enumerate(counts) if count}
+
+def chunk_class(chunk_dir):
+    """Whether a chunk folder holds canonical (control) or modified chunks, from its name"""
+    name = os.path.basename(os.path.normpath(chunk_dir))
+    return "can" if name.startswith("can") else "mod"
+
+def inspect_chunks(chunk_dirs):
+    """Chunk counts and label balance for each prepared chunk folder"""
+    stats = []
+    for chunk_dir in chunk_dirs:
+        start, end = chunk_range(chunk_dir)
+        stats.append({
+            "path": chunk_dir,
+            "class": chunk_class(chunk_dir),
+            "chunks": int(end - start),
+            "labels": label_counts(chunk_dir, start, end)
+        })
+    return stats
+
+def parse_ratio(ratio_str):
+    """Parse a canonical:modified ratio such as 1:1 or 16:1"""
+    try:
+        can, mod = (float(x) for x in ratio_str.split(':'))
+    except ValueError:
+        raise ValueError(f"Ratio must look like CAN:MOD (e.g. 1:1), got {ratio_str}")
+    if can <= 0 or mod <= 0:
+        raise ValueError("Both sides of the ratio must be positive")
+    return can, mod
+
+def balance_weights(stats, ratio=(1.0, 1.0)):
+    """
+    Dataset weights that sample canonical:modified chunks at the given ratio.
+
+    Within a class every chunk is equally likely to be drawn, so each folder's
+    weight is proportional to its chunk count. Weights are scaled so the
+    smallest non-zero weight is 1.
+    """
+    totals = {"can": 0, "mod": 0}
+    for entry in stats:
+        totals[entry["class"]] += entry["chunks"]
+    for cls, total in totals.items():
+        if total == 0:
+            raise ValueError(f"No {cls} chunks found; cannot balance weights")
+
+    share = {"can": ratio[0], "mod": ratio[1]}
+    raw = [share[e["class"]] * e["chunks"] / totals[e["class"]] for e in stats]
+    smallest = min(w for w in raw if w > 0)
+    return [round(w / smallest, 4) for w in raw]
+
+def format_weight(weight):
+    return f"{weight:g}"
+
+def print_report(stats, weights=None):
+    print("Chunk counts:")
+    for index, entry in enumerate(stats):
+        labels = ""
+        if entry["labels"] is not None:
+            labels = "  labels " + ", ".join(f"{k}:{v}" for k, v in sorted(entry["labels"].items()))
+        weight = f"  weight {format_weight(weights[index])}" if weights else ""
+        print(f"  {entry['path']} ({entry['class']}): {entry['chunks']} chunks{labels}{weight}")
+    can = sum(e["chunks"] for e in stats if e["class"] == "can")
+    mod = sum(e["chunks"] for e in stats if e["class"] == "mod")
+    print(f"  total: {can} canonical, {mod} modified")
+
+def main():
+    parser = argparse.ArgumentParser(description="Count prepared remora chunks and compute balanced dataset weights")
+    parser.add_argument("chunk_dirs", nargs='+', help="Prepared chunk folders (can_* folders are treated as canonical)")
+    parser.add_argument("--target-ratio", default="1:1", help="Canonical:modified sampling ratio (default: 1:1)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+
+    stats = inspect_chunks(args.chunk_dirs)
+    weights = balance_weights(stats, parse_ratio(args.target_ratio))
+    if args.json:
+        print(json.dumps({"datasets": stats, "weights": weights}, indent=2))
+        return
+    print_report(stats, weights)
+    print("--dataset-weights " + " ".join(format_weight(w) for w in weights))
+
+if __name__ == "__main__":
+    main()
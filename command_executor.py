@@ -0,0 +1,349 @@
+import asyncio
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import run_metrics
+
+# Seconds between console echoes of a command's output
+ECHO_INTERVAL = 1.0
+
+# Most lines echoed per interval when the full output goes to a log file
+ECHO_MAX_LINES = 20
+
+# Bytes read from a child's pipe at a time
+READ_SIZE = 64 * 1024
+
+# Seconds a cancelled or timed-out command gets to exit after SIGTERM before SIGKILL
+KILL_GRACE = 10
+
+# Serialises console output when several commands stream at once
+print_lock = threading.Lock()
+
+class CommandResult:
+    """What happened to one command (or pipeline) run by an Executor"""
+    def __init__(self, label, argvs):
+        self.label = label
+        self.argvs = argvs
+        self.return_code = None
+        self.return_codes = []
+        self.start = time.time()
+        self.end = None
+        self.usage = None
+        self.log_paths = []
+        self.timed_out = False
+        self.cancelled = False
+
+    @property
+    def argv(self):
+        return self.argvs[0]
+
+    @property
+    def command(self):
+        """The command as a shell would show it; only used for display and metrics"""
+        return " | ".join(shlex.join(argv) for argv in self.argvs)
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+    @property
+    def wall_s(self):
+        return (self.end or time.time()) - self.start
+
+def log_name(label):
+    """File-name-safe version of a command label"""
+    return re.sub(r"[^\w.@-]+", "_", label) if label else "command"
+
+class ConsoleEcho:
+    """
+    Echo a stream to the console at most once per interval.
+
+    Output arrives in large chunks rather than lines; carriage-return progress
+    updates collapse to their latest state and, when the full output is in a log
+    file, only the newest max_lines lines of each interval are shown.
+    """
+    def __init__(self, tag, interval, max_lines, log_path):
+        self.tag = tag
+        self.interval = interval
+        self.max_lines = max_lines
+        self.log_path = log_path
+        self.partial = ""
+        self.lines = []
+        self.skipped = 0
+        self.last_echo = 0.0
+        self.timer = None
+
+    def feed(self, text, loop):
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            # tqdm-style bars redraw with \r; only the last redraw is worth showing
+            line = line.rsplit("\r", 1)[-1].rstrip()
+            if line:
+                self.lines.append(line)
+        if self.max_lines is not None and len(self.lines) > self.max_lines:
+            self.skipped += len(self.lines) - self.max_lines
+            del self.lines[:-self.max_lines]
+        wait = self.last_echo + self.interval - time.monotonic()
+        if wait <= 0:
+            self.flush()
+        elif self.timer is None and self.lines:
+            self.timer = loop.call_later(wait, self.flush)
+
+    def flush(self, final=False):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if final:
+            line = self.partial.rsplit("\r", 1)[-1].rstrip()
+            if line:
+                self.lines.append(line)
+            self.partial = ""
+        self.last_echo = time.monotonic()
+        if not self.lines and not self.skipped:
+            return
+        out = []
+        if self.skipped:
+            out.append(f"{self.tag}... {self.skipped} lines not shown (full output in {self.log_path})\n")
+        out.extend(f"{self.tag}{line}\n" for line in self.lines)
+        self.lines = []
+        self.skipped = 0
+        with print_lock:
+            sys.stdout.write("".join(out))
+            sys.stdout.flush()
+
+class Executor:
+    """
+    Runs argv lists without a shell and streams their output to log files.
+
+    Each command's output is read in large chunks by asyncio pipe readers, written
+    to <log_dir>/<label>.log as it arrives and echoed to the console at most once
+    per echo_interval. Commands can be given a timeout and every running command
+    can be cancelled from any thread. run() may be called from several threads at
+    once; run_many() runs a batch of commands concurrently in one event loop.
+
+    Each command starts in its own session and is stopped by signalling its
+    process group, so the processes it starts are stopped with it. A terminal
+    Ctrl-C therefore no longer reaches commands directly: an interrupted run()
+    stops its own, and cancel_on_interrupt() covers commands run from other threads.
+
+    Args:
+        log_dir (str): Directory for per-command logs; None echoes all output instead
+        echo_interval (float): Seconds between console echoes
+        echo_lines (int): Most lines echoed per interval when logging to a file
+        timeout (float): Default seconds before a command is stopped; None waits forever
+        on_result (callable): Called with every CommandResult, e.g. to record metrics
+    """
+    def __init__(self, log_dir=None, echo_interval=ECHO_INTERVAL, echo_lines=ECHO_MAX_LINES,
+                 timeout=None, on_result=None):
+        self.log_dir = log_dir
+        self.echo_interval = echo_interval
+        self.echo_lines = echo_lines
+        self.timeout = timeout
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.running = {}
+        self.cancelled = threading.Event()
+
+    def log_path(self, label, index=None, name=None):
+        if self.log_dir is None:
+            return None
+        suffix = f".{index}_{log_name(name)}" if index is not None else ""
+        return os.path.join(self.log_dir, f"{log_name(label)}{suffix}.log")
+
+    def run(self, argv, label=None, **kwargs):
+        """Run one argv list to completion and return its CommandResult"""
+        return asyncio.run(self.run_async([argv], label, **kwargs))
+
+    def run_pipeline(self, argvs, label=None, **kwargs):
+        """Run argv lists connected stdout-to-stdin; the result holds every return code"""
+        return asyncio.run(self.run_async(argvs, label, **kwargs))
+
+    def run_many(self, jobs, max_workers=1, **kwargs):
+        """Run (label, argv) jobs with at most max_workers at once; results are in job order"""
+        async def run_all():
+            slots = asyncio.Semaphore(max(1, max_workers))
+
+            async def run_one(label, argv):
+                async with slots:
+                    return await self.run_async([argv], label, **kwargs)
+            return await asyncio.gather(*(run_one(label, argv) for label, argv in jobs))
+        return asyncio.run(run_all())
+
+    def cancel(self):
+        """Stop every running command and refuse new ones"""
+        self.cancelled.set()
+        with self.lock:
+            results = list(self.running.values())
+        for processes, result in results:
+            result.cancelled = True
+            self._stop(processes)
+
+    def cancel_on_interrupt(self):
+        """Cancel every running command on SIGINT before raising KeyboardInterrupt (main thread only)"""
+        def interrupt(signum, frame):
+            self.cancel()
+            signal.default_int_handler(signum, frame)
+        signal.signal(signal.SIGINT, interrupt)
+
+    def _stop(self, processes):
+        """SIGTERM each process group now and SIGKILL any still running after KILL_GRACE"""
+        def send(sig):
+            with self.lock:
+                # Processes of finished commands have been reaped and their PIDs may be reused
+                live = {id(p) for running, _ in self.running.values() for p in running}
+                for process in processes:
+                    # Each child leads its own group, so this also reaches the processes it started,
+                    # which would otherwise keep the pipes open; an unreaped child keeps the ID reserved
+                    if id(process) in live:
+                        try:
+                            os.killpg(process.pid, sig)
+                        except ProcessLookupError:
+                            pass
+        send(signal.SIGTERM)
+        killer = threading.Timer(KILL_GRACE, send, args=(signal.SIGKILL,))
+        killer.daemon = True
+        killer.start()
+
+    async def run_async(self, argvs, label=None, timeout=None, stdout_path=None, cwd=None, env=None, echo=True):
+        """
+        Run argv lists as a pipeline (one list is a plain command) and return a CommandResult.
+
+        Args:
+            argvs (list): Argument lists; each one's stdout feeds the next one's stdin
+            label (str): Console prefix and log file name
+            timeout (float): Seconds before the commands are stopped (default: the executor's)
+            stdout_path (str): File the last command's stdout is written to instead of the log
+        """
+        argvs = [[str(arg) for arg in argv] for argv in argvs]
+        result = CommandResult(label, argvs)
+        tag = f"[{label}] " if label else ""
+        with print_lock:
+            print(f"{tag}Running: {result.command}")
+        if self.cancelled.is_set():
+            result.cancelled = True
+            result.return_code = -1
+            result.end = time.time()
+            return self._finish(result, tag)
+
+        loop = asyncio.get_running_loop()
+        processes = []
+        log_files = []
+        readers = []
+        stdout_file = None
+        try:
+            if self.log_dir is not None:
+                os.makedirs(self.log_dir, exist_ok=True)
+            if stdout_path is not None:
+                stdout_file = open(stdout_path, 'wb')
+            previous_stdout = None
+            for index, argv in enumerate(argvs):
+                is_last = index == len(argvs) - 1
+                stage_index = index if len(argvs) > 1 else None
+                log_path = self.log_path(label, stage_index, os.path.basename(argv[0]) if argv else None)
+                log_file = open(log_path, 'ab') if log_path is not None else None
+                if log_file is not None:
+                    log_file.write(f"$ {shlex.join(argv)}\n".encode())
+                    log_files.append(log_file)
+                    result.log_paths.append(log_path)
+                try:
+                    process = subprocess.Popen(
+                        argv,
+                        stdin=previous_stdout,
+                        stdout=(stdout_file if stdout_file is not None else subprocess.PIPE) if is_last else subprocess.PIPE,
+                        # A lone command's stderr shares its stdout; pipeline stages keep stdout for data
+                        stderr=subprocess.STDOUT if is_last and stdout_file is None else subprocess.PIPE,
+                        cwd=cwd,
+                        env=env,
+                        bufsize=0,
+                        start_new_session=True
+                    )
+                finally:
+                    # Drop the parent's copy so an early exit downstream reaches the upstream process
+                    if previous_stdout is not None:
+                        previous_stdout.close()
+                processes.append(process)
+                with self.lock:
+                    self.running[id(result)] = (processes, result)
+                previous_stdout = None if is_last else process.stdout
+                stream = process.stdout if is_last and stdout_file is None else process.stderr
+                stage_tag = f"[{label}:{index}:{os.path.basename(argv[0])}] " if len(argvs) > 1 else tag
+                echo_out = ConsoleEcho(stage_tag, self.echo_interval,
+                                       self.echo_lines if log_file is not None else None, log_path) if echo else None
+                readers.append(self._pump(loop, stream, log_file, echo_out))
+        except OSError as e:
+            with print_lock:
+                print(f"{tag}Failed to start: {e}")
+            # Match the shell's codes for a missing or non-executable program
+            result.return_code = 127 if isinstance(e, FileNotFoundError) else 126
+            if processes:
+                self._stop(processes)
+
+        timeout = self.timeout if timeout is None else timeout
+        timer = None
+        if processes and timeout is not None:
+            def on_timeout():
+                result.timed_out = True
+                with print_lock:
+                    print(f"{tag}Timed out after {timeout:g}s; stopping")
+                self._stop(processes)
+            timer = loop.call_later(timeout, on_timeout)
+        try:
+            await asyncio.gather(*readers)
+            for process in processes:
+                # wait4 gives this child's own CPU time and peak RSS, even with other commands running
+                return_code, usage = await loop.run_in_executor(None, run_metrics.wait_with_usage, process)
+                result.return_codes.append(return_code)
+                if result.usage is None:
+                    result.usage = usage
+        except BaseException:
+            # Interrupted (e.g. Ctrl-C, which no longer reaches the children's own sessions)
+            self._stop(processes)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                self.running.pop(id(result), None)
+            for log_file in log_files:
+                log_file.close()
+            if stdout_file is not None:
+                stdout_file.close()
+        result.end = time.time()
+        if result.return_code is None:
+            result.return_code = next((code for code in result.return_codes if code != 0), 0)
+        return self._finish(result, tag)
+
+    async def _pump(self, loop, stream, log_file, echo_out):
+        """Copy a child's pipe to its log file and console in READ_SIZE chunks until EOF"""
+        reader = asyncio.StreamReader(limit=READ_SIZE)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream)
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                if log_file is not None:
+                    log_file.write(data)
+                if echo_out is not None:
+                    echo_out.feed(data.decode(errors="replace"), loop)
+        finally:
+            transport.close()
+            if echo_out is not None:
+                echo_out.flush(final=True)
+
+    def _finish(self, result, tag):
+        if result.return_code != 0:
+            reason = " (cancelled)" if result.cancelled else " (timed out)" if result.timed_out else ""
+            where = f"; log: {', '.join(result.log_paths)}" if result.log_paths else ""
+            with print_lock:
+                print(f"{tag}Command failed with return code {result.return_code}{reason}{where}")
+        if self.on_result is not None:
+            self.on_result(result)
+        return result
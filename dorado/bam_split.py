@@ -0,0 +1,184 @@
+import argparse
+import os
+import re
+import sys
+from collections import OrderedDict
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+# BAM flag for unmapped reads
+FLAG_UNMAPPED = 4
+
+UNCLASSIFIED = "unclassified"
+
+def barcode_name(read):
+    """Return the barcode a read was classified into, e.g. SQK-NBD114-24_barcode11"""
+    if read.has_tag("BC"):
+        barcode = str(read.get_tag("BC"))
+    elif read.has_tag("RG"):
+        # dorado read groups end in <kit>_barcodeNN when classified during basecalling
+        match = re.search(r"([^_]+_barcode\d+)$", str(read.get_tag("RG")))
+        barcode = match.group(1) if match else UNCLASSIFIED
+    else:
+        barcode = UNCLASSIFIED
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", barcode) or UNCLASSIFIED
+
+class BarcodeWriters:
+    """Per-barcode BAM writers with at most max_open files open at once
+
+    A barcode whose writer was closed to make room gets a new part file
+    when it is seen again; parts are concatenated in finish().
+
+    A new writer compresses on threads divided by the number of writers open
+    once it is added, so with only a few barcodes each gets several threads.
+    """
+    def __init__(self, output_dir, template, max_open=64, threads=1):
+        self.output_dir = output_dir
+        self.template = template
+        self.max_open = max(1, max_open)
+        self.threads = threads
+        self.open_writers = OrderedDict()
+        self.parts = {}
+        self.counts = {}
+
+    def write(self, barcode, read):
+        writer = self.open_writers.get(barcode)
+        if writer is None:
+            writer = self._open(barcode)
+        else:
+            self.open_writers.move_to_end(barcode)
+        writer.write(read)
+        self.counts[barcode] = self.counts.get(barcode, 0) + 1
+
+    def _open(self, barcode):
+        if len(self.open_writers) >= self.max_open:
+            _, oldest = self.open_writers.popitem(last=False)
+            oldest.close()
+        parts = self.parts.setdefault(barcode, [])
+        path = os.path.join(self.output_dir, f"{barcode}.part{len(parts)}.bam")
+        parts.append(path)
+        writer_threads = max(1, self.threads // (len(self.open_writers) + 1))
+        writer = pysam.AlignmentFile(path, "wb", template=self.template, threads=writer_threads)
+        self.open_writers[barcode] = writer
+        return writer
+
+    def close(self):
+        for writer in self.open_writers.values():
+            writer.close()
+        self.open_writers.clear()
+
+    def finish(self):
+        """Close all writers and return {barcode: final BAM path}"""
+        self.close()
+        outputs = {}
+        for barcode, parts in self.parts.items():
+            final_path = os.path.join(self.output_dir, f"{barcode}.bam")
+            if len(parts) == 1:
+                os.replace(parts[0], final_path)
+            else:
+                # Same header in every part, so BGZF blocks can be copied without recompressing
+                try:
+                    pysam.cat("-o", final_path, *parts)
+                except pysam.SamtoolsError as e:
+                    raise OSError(f"Failed to concatenate parts for {barcode}: {e}")
+                for part in parts:
+                    os.remove(part)
+            outputs[barcode] = final_path
+        return outputs
+
+def sort_and_index(bam_path, threads=1, memory_per_thread="256M"):
+    """Coordinate-sort a BAM into <name>.sorted.bam and index it"""
+    sorted_path = bam_path[:-len(".bam")] + ".sorted.bam"
+    try:
+        pysam.sort("-@", str(threads), "-m", memory_per_thread, "-o", sorted_path, bam_path)
+        pysam.index(sorted_path)
+    except pysam.SamtoolsError as e:
+        raise OSError(f"Failed to sort {bam_path}: {e}")
+    return sorted_path
+
+def split_bam(input_bam, output_dir, min_mapq=0, remove_unmapped=False, min_length=None,
+              sort=False, max_open=64, threads=4):
+    """
+    Split a BAM into one file per barcode in a single streaming pass.
+
+    Args:
+        input_bam (str): Path to input BAM/SAM file, or "-" for stdin
+        output_dir (str): Directory to write <barcode>.bam files to
+        min_mapq (int): Minimum mapping quality score (default: 0)
+        remove_unmapped (bool): Whether to remove unmapped reads (default: False)
+        min_length (int or None): Minimum read length to keep (default: None)
+        sort (bool): Whether to also write an indexed <barcode>.sorted.bam (default: False)
+        max_open (int): Maximum number of output files open at once (default: 64)
+        threads (int): Number of BGZF threads for reading, shared by the writers, and for sorting (default: 4)
+
+    Returns:
+        dict: barcode -> output BAM path (sorted path if sort is True)
+    """
+    if pysam is None:
+        raise ImportError("pysam is required for the native barcode splitter. Install it with 'pip install pysam'.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    total = 0
+    kept = 0
+
+    with pysam.AlignmentFile(input_bam, "r", check_sq=False, threads=threads) as bam_in:
+        writers = BarcodeWriters(output_dir, bam_in, max_open, threads)
+        try:
+            for read in bam_in:
+                total += 1
+                if remove_unmapped and read.flag & FLAG_UNMAPPED:
+                    continue
+                if min_mapq > 0 and read.mapping_quality < min_mapq:
+                    continue
+                if min_length is not None and read.query_length < min_length:
+                    continue
+                writers.write(barcode_name(read), read)
+                kept += 1
+        finally:
+            outputs = writers.finish()
+
+    print(f"Kept {kept} of {total} reads across {len(outputs)} barcodes")
+    for barcode in sorted(outputs):
+        print(f"  {barcode}: {writers.counts[barcode]} reads")
+
+    if sort:
+        for barcode in sorted(outputs):
+            outputs[barcode] = sort_and_index(outputs[barcode], threads)
+            print(f"Sorted and indexed {outputs[barcode]}")
+
+    return outputs
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a BAM into one file per barcode in a single pass")
+    parser.add_argument("input", help="Input BAM/SAM file, or - for stdin")
+    parser.add_argument("output_dir", help="Directory for the per-barcode BAM files")
+    parser.add_argument("--min-mapq", type=int, default=0, help="Minimum mapping quality score (default: 0)")
+    parser.add_argument("--remove-unmapped", action="store_true", help="Remove unmapped reads")
+    parser.add_argument("--remove-map0", action="store_true", help="Remove reads with mapping quality 0")
+    parser.add_argument("--min-length", type=int, default=None, help="Minimum read length to keep (optional)")
+    parser.add_argument("--sort", action="store_true", help="Also write a sorted, indexed <barcode>.sorted.bam")
+    parser.add_argument("--max-open", type=int, default=64, help="Maximum number of output files open at once (default: 64)")
+    parser.add_argument("--threads", type=int, default=4, help="Number of BGZF threads (default: 4)")
+
+    args = parser.parse_args()
+
+    try:
+        split_bam(
+            args.input,
+            args.output_dir,
+            min_mapq=max(args.min_mapq, 1) if args.remove_map0 else args.min_mapq,
+            remove_unmapped=args.remove_unmapped,
+            min_length=args.min_length,
+            sort=args.sort,
+            max_open=args.max_open,
+            threads=args.threads
+        )
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed to split BAM file: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
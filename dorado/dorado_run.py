@@ -1,33 +1,29 @@
-import subprocess
 import os
 import argparse
 import datetime
 import csv
+import shlex
+import sys
 from pathlib import Path
 
-def run_command(command):
-    """Execute a shell command and return the return code"""
-    print(f"Running: {command}")
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-    
-    # Print output in real-time
-    for line in iter(process.stdout.readline, ''):
-        print(line.strip())
-    
-    process.stdout.close()
-    return_code = process.wait()
-    
-    if return_code != 0:
-        print(f"Command failed with return code {return_code}")
-    
-    return return_code
+import bam_split
+
+# The command executor is shared with the remora scripts one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import command_executor
+
+DEFAULT_KIT_NAME = "SQK-NBD114-24"
+
+# Full command output goes to dorado_logs; the console gets a rate-limited echo
+executor = command_executor.Executor("dorado_logs")
+
+def run_command(cmd, label=None, stdout_path=None):
+    """Run an argument list without a shell and return the return code"""
+    return executor.run(cmd, label, stdout_path=stdout_path).return_code
+
+def run_pipeline(commands, label=None):
+    """Run argument lists connected stdout-to-stdin and return the first nonzero return code"""
+    return executor.run_pipeline(commands, label).return_code
 
 def log_parameters(args):
     """Log all parameters to a CSV file"""
@@ -65,6 +61,82 @@ def log_parameters(args):
     
     print(f"Parameters logged to {log_file}")
 
+def build_filter_command(input_bam, output_bam, remove_map0, remove_unmapped, threads, uncompressed=False):
+    """Build one samtools view call that applies every post-basecall filter"""
+    # Uncompressed BAM avoids a compress/decompress round trip when piping to another samtools
+    command = ["samtools", "view", "-u" if uncompressed else "-b", "-@", str(threads)]
+    if remove_map0:
+        command.extend(["-q", "1"])  # -q 1 excludes mapq=0 reads
+    if remove_unmapped:
+        command.extend(["-F", "4"])  # -F 4 excludes unmapped reads
+    command.extend(["-o", output_bam, input_bam])
+    return command
+
+def build_split_command(input_bam, output_dir, threads):
+    """Build a samtools split call that writes one BAM per barcode (BC tag) value"""
+    return [
+        "samtools", "split", "-@", str(threads), "-d", "BC",
+        "-u", f"{output_dir}/unclassified.bam",
+        "-f", f"{output_dir}/%!.bam", input_bam
+    ]
+
+def demuxed_dir_path(output):
+    """Directory the per-barcode files are written to, whichever splitter runs"""
+    return f"{output}_demuxed"
+
+def build_native_split_command(input_bam, output_dir, args):
+    """Build a bam_split.py call that filters, splits and optionally sorts in one pass"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bam_split.py")
+    command = [sys.executable, script, input_bam, output_dir, "--threads", str(args.threads)]
+    if args.remove_map0:
+        command.append("--remove-map0")
+    if args.remove_unmapped:
+        command.append("--remove-unmapped")
+    if args.sort_barcodes:
+        command.append("--sort")
+    return command
+
+def run_stream(args, basecaller_command):
+    """Pipe basecaller output through the filters straight into a per-barcode split"""
+    output_dir = demuxed_dir_path(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    commands = [basecaller_command]
+    if args.splitter == "native":
+        # The native splitter applies the filters itself
+        commands.append(build_native_split_command("-", output_dir, args))
+    else:
+        if args.remove_map0 or args.remove_unmapped:
+            commands.append(build_filter_command("-", "-", args.remove_map0, args.remove_unmapped, args.threads, uncompressed=True))
+        commands.append(build_split_command("-", output_dir, args.threads))
+    
+    print("=== Streaming basecall, filter and barcode split ===")
+    return_code = run_pipeline(commands, "stream")
+    if return_code == 0:
+        print(f"Streaming pipeline completed successfully! Barcode BAMs written to: {output_dir}")
+    else:
+        print("Streaming pipeline failed!")
+    return return_code
+
+def run_native_split(args, input_bam):
+    """Filter and split a basecalled BAM by barcode without a separate demux pass"""
+    output_dir = demuxed_dir_path(input_bam)
+    print("=== Splitting by barcode ===")
+    try:
+        bam_split.split_bam(
+            input_bam,
+            output_dir,
+            min_mapq=1 if args.remove_map0 else 0,
+            remove_unmapped=args.remove_unmapped,
+            sort=args.sort_barcodes,
+            threads=args.threads
+        )
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Barcode splitting failed: {e}")
+        return 1
+    print(f"Barcode splitting completed successfully! Barcode BAMs written to: {output_dir}")
+    return 0
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Dorado Basecalling and Demuxing Assistant")
@@ -79,36 +151,70 @@ def main():
     parser.add_argument("--output", type=str, required=True, help="Output file name (.bam or .fastq)")
     parser.add_argument("--remove-map0", action="store_true", help="Remove mapped reads with score of 0")
     parser.add_argument("--remove-unmapped", action="store_true", help="Remove unmapped reads")
-    parser.add_argument("--kit-name", type=str, default="SQK-NBD114-24", help="Kit name")
+    parser.add_argument("--kit-name", type=str, default=None,
+                        help=f"Kit name reads are classified with during basecalling (default: {DEFAULT_KIT_NAME})")
+    parser.add_argument("--threads", type=int, default=8, help="Number of samtools threads for filtering")
+    parser.add_argument("--stream", action="store_true",
+                        help="Pipe basecaller output through the filters into a per-barcode split without writing the full BAM")
+    parser.add_argument("--splitter", choices=["dorado", "native", "auto"], default="dorado",
+                        help="Barcode splitting: dorado demux/samtools split (default), native (pysam, single pass), "
+                             "or auto, which uses native when pysam is installed")
+    parser.add_argument("--sort-barcodes", action="store_true",
+                        help="Also write a sorted, indexed <barcode>.sorted.bam for each barcode (native splitter only)")
+    parser.add_argument("--basecaller-command", type=str, default="",
+                        help="Command to run instead of dorado basecaller; must write SAM/BAM to stdout (for testing)")
     
     args = parser.parse_args()
     
     # Add logging call right after argument parsing
     log_parameters(args)
     
-    # Set up basecaller command
-    basecaller_command = "dorado basecaller "
-    if args.emit_moves:
-        basecaller_command += "--emit-moves "
-    
-    if args.no_trim:
-        basecaller_command += "--no-trim "
+    if args.stream and args.output.endswith("fastq"):
+        parser.error("--stream requires a .bam output")
     
-    basecaller_command += f"--min-qscore {args.qscore} --device {args.device} /project/romano_shared/telomeres/models/dna_r10.4.1_e8.2_400bps_{args.accuracy}@v5.0.0 {args.pod5} "
+    if args.splitter == "auto":
+        args.splitter = "native" if bam_split.pysam is not None else "dorado"
+    if args.sort_barcodes and args.splitter != "native":
+        parser.error("--sort-barcodes requires the native splitter (pysam)")
+    if args.demux_no_trim and (args.stream or args.splitter == "native"):
+        parser.error("--demux-no-trim only applies to dorado demux; the native splitter and --stream do not trim reads")
+    if args.kit_name and args.basecaller_command:
+        parser.error("--kit-name is passed to dorado basecaller and has no effect with --basecaller-command")
+    args.kit_name = args.kit_name or DEFAULT_KIT_NAME
     
-    if args.output.endswith("fastq"):
-        basecaller_command += "--emit-fastq "
-    
-    if args.reference == "":
-        basecaller_command += f"--kit-name {args.kit_name} > {args.output}"
+    # Set up basecaller command
+    if args.basecaller_command:
+        basecaller_command = shlex.split(args.basecaller_command)
     else:
-        basecaller_command += f"--reference {args.reference} --kit-name {args.kit_name} > {args.output}"
+        basecaller_command = ["dorado", "basecaller"]
+        if args.emit_moves:
+            basecaller_command.append("--emit-moves")
+        
+        if args.no_trim:
+            basecaller_command.append("--no-trim")
+        
+        basecaller_command.extend([
+            "--min-qscore", args.qscore, "--device", args.device,
+            f"/project/romano_shared/telomeres/models/dna_r10.4.1_e8.2_400bps_{args.accuracy}@v5.0.0", args.pod5
+        ])
+        
+        if args.output.endswith("fastq"):
+            basecaller_command.append("--emit-fastq")
+        
+        if args.reference != "":
+            basecaller_command.extend(["--reference", args.reference])
+        basecaller_command.extend(["--kit-name", args.kit_name])
+    
+    if args.stream:
+        if run_stream(args, basecaller_command) != 0:
+            sys.exit(1)
+        print("All processing completed!")
+        return
     
-    print("=== Basecalling Command ===")
-    print(basecaller_command)
+    print("=== Basecalling ===")
     
-    # Run basecalling
-    return_code = run_command(basecaller_command)
+    # Run basecalling; reads go straight to the output file, progress to the log
+    return_code = run_command(basecaller_command, "basecall", stdout_path=args.output)
     if return_code == 0:
         print("Basecalling completed successfully!")
     else:
@@ -117,35 +223,33 @@ def main():
     
     output = args.output
     
-    # Process mapped reads with score of 0 if requested
-    if args.remove_map0 and not output.endswith('.fastq'):
-        print("=== Processing mapped reads ===")
-        map0_command = f"samtools view -b -q 1 {output} > {output}_map0.bam"
-        print(map0_command)
-        run_command(map0_command)
-        output = f"{output}_map0"
-    
-    # Process unmapped reads if requested
-    if args.remove_unmapped and not output.endswith('.fastq'):
-        print("=== Processing unmapped reads ===")
-        unmapped_command = f"samtools view -F 4 -b {output} > {output}_unmapped_remove.bam"
-        print(unmapped_command)
-        run_command(unmapped_command)
-        output = f"{output}_unmapped_remove"
+    # The native splitter filters and splits in one pass over the basecalled BAM
+    if args.splitter == "native" and not output.endswith('.fastq'):
+        if run_native_split(args, output) != 0:
+            return
+        print("All processing completed!")
+        return
+    
+    filter_reads = (args.remove_map0 or args.remove_unmapped) and not output.endswith('.fastq')
     
     # Run demultiplexing
-    print("=== Demultiplexing ===")
-    demux_command = ""
+    print("=== Filtering and demultiplexing ===" if filter_reads else "=== Demultiplexing ===")
     if output.endswith("fastq"):
-        demux_command = f"dorado demux --emit-fastq -o {output}_demuxed {output}"
+        demux_command = ["dorado", "demux", "--emit-fastq", "-o", demuxed_dir_path(output), output]
     else:
-        demux_command = f"dorado demux -o {output}_demuxed "
+        demux_command = ["dorado", "demux", "-o", demuxed_dir_path(output)]
         if args.demux_no_trim:
-            demux_command += "--no-trim "
-        demux_command += f"--no-classify {output}"
+            demux_command.append("--no-trim")
+        demux_command.append("--no-classify")
     
-    print(demux_command)
-    return_code = run_command(demux_command)
+    if filter_reads:
+        # One samtools pass applies every filter and streams uncompressed BAM into demux's stdin
+        filter_command = build_filter_command(output, "-", args.remove_map0, args.remove_unmapped, args.threads, uncompressed=True)
+        return_code = run_pipeline([filter_command, demux_command], "demux")
+    else:
+        if not output.endswith("fastq"):
+            demux_command.append(output)
+        return_code = run_command(demux_command, "demux")
     if return_code == 0:
         print("Demultiplexing completed successfully!")
     else:
@@ -0,0 +1,425 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import reference_index
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# CIGAR operations that consume query and/or reference bases
+CIGAR_MATCH = (0, 7, 8)          # M, =, X
+CIGAR_QUERY_ONLY = (1, 4)        # I, S
+CIGAR_REFERENCE_ONLY = (2, 3)    # D, N
+
+COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A", "N": "N"}
+
+# Output columns and their dtypes; read_index points into the read_ids table
+COLUMNS = {
+    "read_index": np.uint32,
+    "contig_index": np.uint16,
+    "ref_pos": np.int32,
+    "strand": "S1",
+    "mod_code": "S8",
+    "prob": np.float32,
+}
+
+def ml_to_prob(ml):
+    """ML values are probabilities binned into 256 intervals; return the bin midpoints"""
+    return (ml.astype(np.float32) + 0.5) / 256
+
+def parse_mm_groups(mm):
+    """Split an MM tag into (canonical base, mod strand, mod codes, skip counts) groups"""
+    groups = []
+    for group in mm.split(';'):
+        if not group:
+            continue
+        fields = group.split(',')
+        header = fields[0].rstrip("?.")
+        base, strand, codes = header[0], header[1], header[2:]
+        # A ChEBI number is one code; otherwise every letter is its own code
+        codes = [codes] if codes.isdigit() else list(codes)
+        skips = np.array(fields[1:], dtype=np.int64) if len(fields) > 1 else np.empty(0, dtype=np.int64)
+        groups.append((base, strand, codes, skips))
+    return groups
+
+def base_positions(seq, base, is_reverse):
+    """Query positions of base in the read's original orientation, in original order
+
+    For reverse-strand alignments SEQ is stored reverse complemented, so the
+    complement is searched for and the order reversed.
+    """
+    if base == "N":
+        positions = np.arange(seq.size)
+        return positions[::-1] if is_reverse else positions
+    if is_reverse:
+        return np.flatnonzero(seq == ord(COMPLEMENT[base]))[::-1]
+    return np.flatnonzero(seq == ord(base))
+
+def decode_mod_calls(seq, is_reverse, mm, ml):
+    """
+    Decode MM/ML tags into per-base calls.
+
+    Args:
+        seq (np.ndarray): Query sequence as uint8 ASCII codes, as stored in the BAM
+        is_reverse (bool): Whether the alignment is on the reverse strand
+        mm (str): MM tag value
+        ml (np.ndarray): ML tag values as uint8
+
+    Returns:
+        list: (mod code, query positions, ML values) per modification code
+    """
+    calls = []
+    offset = 0
+    for base, strand, codes, skips in parse_mm_groups(mm):
+        num_calls = skips.size * len(codes)
+        values = ml[offset:offset + num_calls]
+        offset += num_calls
+        if values.size != num_calls:
+            raise ValueError("ML tag is shorter than MM tag")
+        # Calls on the opposite strand (duplex) have no position in this read's sequence
+        if strand != "+" or skips.size == 0:
+            continue
+        candidates = base_positions(seq, base, is_reverse)
+        indices = np.cumsum(skips + 1) - 1
+        if indices[-1] >= candidates.size:
+            raise ValueError("MM tag skips past the end of the sequence")
+        positions = candidates[indices]
+        values = values.reshape(skips.size, len(codes))
+        for code_index, code in enumerate(codes):
+            calls.append((code, positions, values[:, code_index]))
+    return calls
+
+def query_to_reference(cigartuples, reference_start, query_length):
+    """Reference position of every query base, -1 for insertions and soft clips"""
+    q2r = np.full(query_length, -1, dtype=np.int32)
+    query_pos = 0
+    ref_pos = reference_start
+    for op, length in cigartuples:
+        if op in CIGAR_MATCH:
+            q2r[query_pos:query_pos + length] = np.arange(ref_pos, ref_pos + length, dtype=np.int32)
+            query_pos += length
+            ref_pos += length
+        elif op in CIGAR_QUERY_ONLY:
+            query_pos += length
+        elif op in CIGAR_REFERENCE_ONLY:
+            ref_pos += length
+    return q2r
+
+def mod_tags(read):
+    """(MM, ML) tag values of a read, or None; older files use the draft Mm/Ml names"""
+    for mm_name, ml_name in (("MM", "ML"), ("Mm", "Ml")):
+        if read.has_tag(mm_name):
+            ml = read.get_tag(ml_name) if read.has_tag(ml_name) else []
+            return read.get_tag(mm_name), bytes(np.asarray(ml, dtype=np.uint8))
+    return None
+
+def record_fields(read_index, read, tags):
+    """The parts of an alignment the workers need, as picklable values"""
+    return (
+        read_index,
+        read.reference_id,
+        read.is_reverse,
+        read.reference_start,
+        read.cigartuples,
+        read.query_sequence,
+        *tags,
+    )
+
+def decode_batch(records):
+    """Turn a batch of record_fields() tuples into columns of aligned calls"""
+    columns = {name: [] for name in COLUMNS}
+    failed = 0
+    for read_index, contig_index, is_reverse, reference_start, cigartuples, sequence, mm, ml in records:
+        seq = np.frombuffer(sequence.encode(), dtype=np.uint8)
+        try:
+            calls = decode_mod_calls(seq, is_reverse, mm, np.frombuffer(ml, dtype=np.uint8))
+        except ValueError:
+            failed += 1
+            continue
+        q2r = query_to_reference(cigartuples, reference_start, seq.size)
+        strand = b"-" if is_reverse else b"+"
+        for code, positions, values in calls:
+            ref_pos = q2r[positions]
+            aligned = ref_pos >= 0
+            count = int(aligned.sum())
+            columns["read_index"].append(np.full(count, read_index, dtype=np.uint32))
+            columns["contig_index"].append(np.full(count, contig_index, dtype=np.uint16))
+            columns["ref_pos"].append(ref_pos[aligned])
+            columns["strand"].append(np.full(count, strand, dtype="S1"))
+            columns["mod_code"].append(np.full(count, code.encode(), dtype="S8"))
+            columns["prob"].append(ml_to_prob(values[aligned]))
+    batch = {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=COLUMNS[name])
+        for name, parts in columns.items()
+    }
+    return batch, failed
+
+class NpzWriter:
+    """Appends column batches to temporary files and packs them into an .npz at the end
+
+    Columns are memory-mapped when packed, so memory use does not grow with the BAM.
+    """
+    def __init__(self, path, contigs):
+        self.path = path
+        self.contigs = contigs
+        self.tmp_dir = tempfile.mkdtemp(prefix="modcalls_", dir=os.path.dirname(os.path.abspath(path)))
+        self.files = {name: open(os.path.join(self.tmp_dir, name), 'wb') for name in COLUMNS}
+        self.read_ids = open(os.path.join(self.tmp_dir, "read_ids"), 'w')
+        self.read_id_width = 1
+        self.num_reads = 0
+        self.rows = 0
+
+    def add_read_ids(self, first, read_ids):
+        # Batches arrive in order, so the IDs are simply appended
+        for read_id in read_ids:
+            self.read_ids.write(read_id + "\n")
+            self.read_id_width = max(self.read_id_width, len(read_id))
+        self.num_reads += len(read_ids)
+
+    def write(self, batch):
+        for name, values in batch.items():
+            values.tofile(self.files[name])
+        self.rows += batch["prob"].size
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.read_ids.close()
+        arrays = {
+            name: np.memmap(os.path.join(self.tmp_dir, name), dtype=dtype, mode='r', shape=(self.rows,))
+            if self.rows else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        read_ids = np.empty(0, dtype="S1")
+        if self.num_reads:
+            read_ids = np.memmap(os.path.join(self.tmp_dir, "read_ids.fixed"), dtype=f"S{self.read_id_width}",
+                                 mode='w+', shape=(self.num_reads,))
+            with open(os.path.join(self.tmp_dir, "read_ids")) as f:
+                for index, line in enumerate(f):
+                    read_ids[index] = line.rstrip("\n").encode()
+        np.savez(self.path, read_ids=read_ids, contigs=np.array(self.contigs, dtype="S"), **arrays)
+        del arrays, read_ids
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        self.read_ids.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+class ParquetWriter:
+    """Writes each batch as a Parquet row group with read IDs and contigs as strings"""
+    def __init__(self, path, contigs):
+        if pq is None:
+            raise ImportError("pyarrow is required for Parquet output. Install it with 'pip install pyarrow' or write .npz")
+        self.contigs = pa.array(contigs, type=pa.string())
+        self.read_ids = []
+        self.first = 0
+        self.schema = pa.schema([
+            ("read_id", pa.dictionary(pa.int32(), pa.string())),
+            ("contig", pa.dictionary(pa.int16(), pa.string())),
+            ("ref_pos", pa.int32()),
+            ("strand", pa.dictionary(pa.int8(), pa.string())),
+            ("mod_code", pa.dictionary(pa.int8(), pa.string())),
+            ("prob", pa.float32()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = 0
+
+    def add_read_ids(self, first, read_ids):
+        # Only the current batch's read IDs are needed to build its dictionary column;
+        # first is the read index of read_ids[0], which need not have any calls
+        self.first = first
+        self.read_ids = read_ids
+
+    def write(self, batch):
+        read_ids = pa.array(self.read_ids, type=pa.string())
+        table = pa.table({
+            "read_id": pa.DictionaryArray.from_arrays(
+                pa.array(batch["read_index"].astype(np.int32) - self.first), read_ids),
+            "contig": pa.DictionaryArray.from_arrays(
+                pa.array(batch["contig_index"].astype(np.int16)), self.contigs),
+            "ref_pos": pa.array(batch["ref_pos"]),
+            "strand": pa.array(batch["strand"].astype(str)).dictionary_encode().cast(self.schema.field("strand").type),
+            "mod_code": pa.array(batch["mod_code"].astype(str)).dictionary_encode().cast(self.schema.field("mod_code").type),
+            "prob": pa.array(batch["prob"]),
+        }, schema=self.schema)
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.path)
+
+def open_writer(path, contigs):
+    if path.endswith(".parquet"):
+        return ParquetWriter(path, contigs)
+    if path.endswith(".npz"):
+        return NpzWriter(path, contigs)
+    raise ValueError(f"Output must end in .parquet or .npz, got {path}")
+
+def iter_record_batches(bam_in, batch_size, stats):
+    """Yield (first read index, read IDs, record tuples) batches of primary alignments with MM tags"""
+    read_ids = []
+    records = []
+    first = 0
+    for read in bam_in:
+        stats["records"] += 1
+        if read.is_unmapped or read.is_secondary or read.is_supplementary:
+            stats["skipped"] += 1
+            continue
+        tags = mod_tags(read)
+        if tags is None or read.query_sequence is None:
+            stats["no_tags"] += 1
+            continue
+        records.append(record_fields(first + len(read_ids), read, tags))
+        read_ids.append(read.query_name)
+        if len(records) >= batch_size:
+            yield first, read_ids, records
+            first += len(read_ids)
+            read_ids = []
+            records = []
+    if records:
+        yield first, read_ids, records
+
+def map_record_batches(bam_in, func, func_args=(), workers=1, batch_size=2000, stats=None):
+    """
+    Apply func(records, *func_args) to each batch of records across worker processes.
+
+    Yields (first read index, read IDs, result) in BAM order. At most two batches per worker are
+    in flight, so memory stays bounded however large the BAM is.
+    """
+    stats = stats if stats is not None else new_stats()
+    batches = iter_record_batches(bam_in, batch_size, stats)
+    if workers <= 1:
+        for first, read_ids, records in batches:
+            yield first, read_ids, func(records, *func_args)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for first, read_ids, records in batches:
+            pending.append((executor.submit(func, records, *func_args), first, read_ids))
+            if len(pending) >= 2 * workers:
+                future, oldest_first, oldest_ids = pending.popleft()
+                yield oldest_first, oldest_ids, future.result()
+        while pending:
+            future, oldest_first, oldest_ids = pending.popleft()
+            yield oldest_first, oldest_ids, future.result()
+
+def new_stats():
+    return {"records": 0, "skipped": 0, "no_tags": 0, "failed": 0, "reads": 0, "calls": 0}
+
+def focus_mask(batch, intervals, contigs):
+    """Boolean mask of the calls in a batch that fall inside a focus BED IntervalSet"""
+    mask = np.zeros(batch["ref_pos"].size, dtype=bool)
+    for contig_index in np.unique(batch["contig_index"]):
+        for strand in (b"+", b"-"):
+            rows = np.flatnonzero((batch["contig_index"] == contig_index) & (batch["strand"] == strand))
+            if rows.size:
+                mask[rows] = intervals.contains_array(contigs[contig_index], batch["ref_pos"][rows], strand.decode())
+    return mask
+
+def extract_calls(input_bam, output_path, workers=1, batch_size=2000, threads=2, focus_bed=None):
+    """
+    Stream modified-base calls from an inference BAM into a columnar file.
+
+    Args:
+        input_bam (str): BAM written by remora infer (e.g. G29_infer.bam)
+        output_path (str): Output .parquet or .npz file
+        workers (int): Decoding processes (default: 1, decode in this process)
+        batch_size (int): Reads per batch sent to a worker (default: 2000)
+        threads (int): BGZF decompression threads (default: 2)
+        focus_bed (str): Only keep calls inside this BED (default: keep every call)
+
+    Returns:
+        dict: Counts of records, reads with calls, skipped records and calls written
+    """
+    if pysam is None:
+        raise ImportError("pysam is required to read BAM files. Install it with 'pip install pysam'.")
+
+    stats = new_stats()
+    intervals = reference_index.load_bed(focus_bed) if focus_bed else None
+    with pysam.AlignmentFile(input_bam, "rb", check_sq=False, threads=threads) as bam_in:
+        contigs = list(bam_in.references)
+        writer = open_writer(output_path, contigs)
+        try:
+            for first, read_ids, (batch, failed) in map_record_batches(
+                bam_in, decode_batch, (), workers, batch_size, stats
+            ):
+                stats["failed"] += failed
+                stats["reads"] += len(read_ids)
+                writer.add_read_ids(first, read_ids)
+                if intervals is not None:
+                    keep = focus_mask(batch, intervals, contigs)
+                    batch = {name: values[keep] for name, values in batch.items()}
+                writer.write(batch)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        stats["calls"] = writer.rows
+    return stats
+
+def load_calls(path):
+    """Read an extracted call table into a dict of NumPy columns with read_id and contig resolved"""
+    if path.endswith(".parquet"):
+        table = pq.read_table(path)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with np.load(path) as data:
+        read_ids = data["read_ids"].astype(str)
+        contigs = data["contigs"].astype(str)
+        return {
+            "read_id": read_ids[data["read_index"]],
+            "contig": contigs[data["contig_index"]],
+            "ref_pos": data["ref_pos"],
+            "strand": data["strand"].astype(str),
+            "mod_code": data["mod_code"].astype(str),
+            "prob": data["prob"],
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract per-read modified-base calls from remora inference BAMs")
+    parser.add_argument("input", help="Inference BAM, e.g. G29_infer.bam")
+    parser.add_argument("output", help="Output table; .parquet (needs pyarrow) or .npz")
+    parser.add_argument("--workers", type=int, default=1, help="Decoding processes (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Reads per worker batch (default: 2000)")
+    parser.add_argument("--threads", type=int, default=2, help="BGZF decompression threads (default: 2)")
+    parser.add_argument("--focus-bed", help="Only keep calls inside this BED, e.g. stationaryfiles/focus_reference_positionsG29.bed")
+
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.batch_size < 1:
+        parser.error("--workers and --batch-size must be at least 1")
+
+    try:
+        stats = extract_calls(args.input, args.output, args.workers, args.batch_size, args.threads, args.focus_bed)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed to extract calls: {e}")
+        sys.exit(1)
+
+    print(f"Read {stats['records']} records: {stats['reads']} reads with MM/ML tags, "
+          f"{stats['skipped']} unmapped/secondary/supplementary, {stats['no_tags']} without MM/ML tags, "
+          f"{stats['failed']} with malformed tags")
+    print(f"Wrote {stats['calls']} calls to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import torch
+
+# Model files live in the repository, wherever the script is run from
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+ORIGINAL_MODEL = os.path.join(REPO_DIR, "stationaryfiles", "ConvLSTM_w_ref.py")
+FUSED_MODEL = os.path.join(REPO_DIR, "stationaryfiles", "ConvLSTM_w_ref_fused.py")
+
+def load_network_class(model_file):
+    """Import a remora model architecture file and return its network class"""
+    spec = importlib.util.spec_from_file_location(f"netmodule_{abs(hash(model_file))}", model_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.network
+
+def load_checkpoint(path):
+    ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    if ckpt.get("state_dict") is None:
+        raise ValueError(f"No model state saved in checkpoint {path}")
+    return ckpt
+
+def build_fused(state_dict, model_params, fused_file=FUSED_MODEL):
+    """Fused inference model loaded from a ConvLSTM_w_ref state_dict"""
+    model = load_network_class(fused_file)(**model_params)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model.fuse()
+
+def random_original(model_params, original_file=ORIGINAL_MODEL, seed=0):
+    """Original model with random weights and non-trivial BatchNorm statistics"""
+    torch.manual_seed(seed)
+    model = load_network_class(original_file)(**model_params)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm1d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.5, 0.5)
+    return model.eval()
+
+def random_inputs(batch_size, chunk_len, kmer_len, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    sigs = torch.randn(batch_size, 1, chunk_len, generator=generator)
+    # One-hot encoded k-mers, as remora builds them
+    bases = torch.randint(0, 4, (batch_size, kmer_len, chunk_len), generator=generator)
+    seqs = torch.nn.functional.one_hot(bases, 4).permute(0, 1, 3, 2).reshape(batch_size, kmer_len * 4, chunk_len)
+    return sigs, seqs.float()
+
+@torch.no_grad()
+def max_abs_difference(original, fused, sigs, seqs):
+    return (original(sigs, seqs) - fused(sigs, seqs)).abs().max().item()
+
+@torch.no_grad()
+def chunks_per_second(model, sigs, seqs, iterations):
+    # Warm up (the TorchScript profiling executor optimises over the first calls)
+    for _ in range(3):
+        model(sigs, seqs)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model(sigs, seqs)
+    return iterations * sigs.shape[0] / (time.perf_counter() - start)
+
+def export_fused(checkpoint_path, output_path, fused_file=FUSED_MODEL):
+    """Write a fused TorchScript model with the metadata remora infer expects"""
+    from remora.model_util import export_model_torchscript
+
+    ckpt = load_checkpoint(checkpoint_path)
+    model = build_fused(ckpt["state_dict"], ckpt["model_params"], fused_file)
+    export_model_torchscript(ckpt, model, output_path)
+    print(f"Saved fused TorchScript model to {output_path}")
+
+def check(args):
+    if args.checkpoint:
+        ckpt = load_checkpoint(args.checkpoint)
+        model_params = ckpt["model_params"]
+        chunk_len = sum(ckpt["chunk_context"])
+        original = load_network_class(args.original_model)(**model_params)
+        original.load_state_dict(ckpt["state_dict"])
+        original.eval()
+    else:
+        model_params = {"size": args.size, "kmer_len": args.kmer_len, "num_out": 2}
+        chunk_len = sum(args.chunk_context)
+        original = random_original(model_params, args.original_model)
+
+    fused = build_fused(original.state_dict(), model_params, args.fused_model)
+    scripted = torch.jit.script(fused)
+    sigs, seqs = random_inputs(args.batch_size, chunk_len, model_params["kmer_len"])
+
+    worst = 0.0
+    for name, model in (("fused", fused), ("fused TorchScript", scripted)):
+        diff = max_abs_difference(original, model, sigs, seqs)
+        worst = max(worst, diff)
+        print(f"Max |original - {name}| output difference: {diff:.2e}")
+    if worst > args.tolerance:
+        print(f"Outputs differ by more than {args.tolerance:g}")
+        return False
+
+    if args.iterations > 0:
+        torch.set_num_threads(args.threads)
+        print(f"CPU throughput, batch size {args.batch_size}, chunk length {chunk_len}, {args.threads} thread(s):")
+        baseline = None
+        for name, model in (("original", original), ("fused", fused), ("fused TorchScript", scripted)):
+            rate = chunks_per_second(model, sigs, seqs, args.iterations)
+            baseline = baseline or rate
+            print(f"  {name}: {rate:.0f} chunks/sec ({rate / baseline:.2f}x)")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused inference variant of the ConvLSTM_w_ref model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export a trained checkpoint as a fused TorchScript model")
+    export_parser.add_argument("checkpoint", help="Checkpoint written by remora model train (e.g. train_results/model_best.checkpoint)")
+    export_parser.add_argument("output", help="Output TorchScript model (e.g. train_results/model_best_fused.pt)")
+    export_parser.add_argument("--fused-model", default=FUSED_MODEL, help="Fused model architecture file")
+
+    check_parser = subparsers.add_parser("check", help="Compare fused and original outputs and CPU throughput")
+    check_parser.add_argument("--checkpoint", help="Checkpoint to take weights from (default: random weights)")
+    check_parser.add_argument("--original-model", default=ORIGINAL_MODEL, help="Original model architecture file")
+    check_parser.add_argument("--fused-model", default=FUSED_MODEL, help="Fused model architecture file")
+    check_parser.add_argument("--size", type=int, default=64, help="Model size for random weights (default: 64)")
+    check_parser.add_argument("--kmer-len", type=int, default=9, help="K-mer length for random weights (default: 9)")
+    check_parser.add_argument("--chunk-context", type=int, nargs=2, default=[50, 50],
+                              help="Chunk context for random weights (default: 50 50)")
+    check_parser.add_argument("--batch-size", type=int, default=1024, help="Chunks per batch (default: 1024)")
+    check_parser.add_argument("--iterations", type=int, default=20,
+                              help="Timed batches per model; 0 skips the benchmark (default: 20)")
+    check_parser.add_argument("--threads", type=int, default=torch.get_num_threads(),
+                              help="CPU threads for the benchmark (default: torch default)")
+    check_parser.add_argument("--tolerance", type=float, default=1e-4,
+                              help="Largest allowed output difference (default: 1e-4)")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        try:
+            export_fused(args.checkpoint, args.output, args.fused_model)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Failed to export fused model: {e}")
+            sys.exit(1)
+    elif not check(args):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
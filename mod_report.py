@@ -0,0 +1,228 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+import extract_mod_calls
+import reference_index
+
+# ML values bin probabilities into 256 intervals; histograms use the same bins
+NUM_BINS = 256
+
+def read_focus_bed(path):
+    """(contig, 0-based position, strand) for every base covered by a BED file"""
+    return reference_index.load_bed(path).sites()
+
+class SiteTable:
+    """Dense index over the focus sites so calls can be histogrammed with one bincount"""
+    def __init__(self, sites, references):
+        contig_index = {name: index for index, name in enumerate(references)}
+        unique = sorted({(contig_index[c], p) for c, p, _ in sites if c in contig_index})
+        self.sites = [(references[c], p) for c, p in unique]
+        # One sortable integer key per (contig, position)
+        self.keys = np.array([(c << 32) | p for c, p in unique], dtype=np.int64)
+        # Sites annotated on one strand only count calls from alignments on that strand
+        strands = {}
+        for c, p, strand in sites:
+            if c in contig_index:
+                strands.setdefault((contig_index[c], p), set()).add(strand)
+        self.strand = np.array([
+            0 if "." in strands[key] or len(strands[key]) > 1 else (1 if "+" in strands[key] else 2)
+            for key in unique
+        ], dtype=np.int8)
+
+    def __len__(self):
+        return len(self.sites)
+
+def histogram_batch(records, keys, site_strand, mod_code):
+    """ML histograms per focus site for one batch of records; runs in a worker"""
+    batch, failed = extract_mod_calls.decode_batch(records)
+    hist = np.zeros(keys.size * NUM_BINS, dtype=np.int64)
+    if keys.size == 0 or batch["prob"].size == 0:
+        return hist, failed
+    if mod_code is not None:
+        keep = batch["mod_code"] == mod_code.encode()
+        batch = {name: values[keep] for name, values in batch.items()}
+    call_keys = (batch["contig_index"].astype(np.int64) << 32) | batch["ref_pos"].astype(np.int64)
+    index = np.minimum(np.searchsorted(keys, call_keys), keys.size - 1)
+    on_site = keys[index] == call_keys
+    call_strand = np.where(batch["strand"] == b"+", 1, 2)
+    on_site &= (site_strand[index] == 0) | (site_strand[index] == call_strand)
+    # prob is a bin midpoint, so this recovers the ML value
+    bins = np.floor(batch["prob"][on_site] * NUM_BINS).astype(np.int64)
+    hist += np.bincount(index[on_site] * NUM_BINS + bins, minlength=keys.size * NUM_BINS)
+    return hist, failed
+
+def site_histograms(bam_path, sites, mod_code=None, workers=1, batch_size=2000, threads=2):
+    """Stream a BAM once and return (SiteTable, per-site ML histograms, stats)"""
+    if extract_mod_calls.pysam is None:
+        raise ImportError("pysam is required to read BAM files. Install it with 'pip install pysam'.")
+    stats = extract_mod_calls.new_stats()
+    with extract_mod_calls.pysam.AlignmentFile(bam_path, "rb", check_sq=False, threads=threads) as bam_in:
+        table = SiteTable(sites, list(bam_in.references))
+        hist = np.zeros(len(table) * NUM_BINS, dtype=np.int64)
+        for _, read_ids, (batch_hist, failed) in extract_mod_calls.map_record_batches(
+            bam_in, histogram_batch, (table.keys, table.strand, mod_code), workers, batch_size, stats
+        ):
+            hist += batch_hist
+            stats["failed"] += failed
+            stats["reads"] += len(read_ids)
+    return table, hist.reshape(len(table), NUM_BINS), stats
+
+def bin_probabilities():
+    return (np.arange(NUM_BINS) + 0.5) / NUM_BINS
+
+def rate_summary(hist, threshold):
+    """Calls, mean probability and fraction called modified for each histogram row"""
+    hist = np.atleast_2d(hist)
+    calls = hist.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_prob = hist @ bin_probabilities() / calls
+        mod_rate = hist[:, bin_probabilities() >= threshold].sum(axis=1) / calls
+    return calls, mean_prob, mod_rate
+
+def roc_pr(positive_hist, negative_hist):
+    """
+    ROC and precision-recall curves from ML histograms of modified (positive) and
+    canonical (negative) calls, sweeping the threshold from the top bin down.
+
+    Returns:
+        dict: fpr, tpr, precision, thresholds, auroc and average precision
+    """
+    tp = np.concatenate(([0], np.cumsum(positive_hist[::-1])))
+    fp = np.concatenate(([0], np.cumsum(negative_hist[::-1])))
+    positives, negatives = tp[-1], fp[-1]
+    if positives == 0 or negatives == 0:
+        return None
+    tpr = tp / positives
+    fpr = fp / negatives
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+    return {
+        "thresholds": np.concatenate(([1.0], np.arange(NUM_BINS)[::-1] / NUM_BINS)).tolist(),
+        "fpr": fpr.tolist(),
+        "tpr": tpr.tolist(),
+        "precision": precision.tolist(),
+        "auroc": float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)),
+        "average_precision": float(np.sum(np.diff(tpr) * precision[1:])),
+    }
+
+def finite(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 6)
+
+def build_report(canonical_bam, modified_sets, threshold=0.5, mod_code=None, workers=1, batch_size=2000, threads=2):
+    """
+    Per-position modification rates and canonical-vs-modified separation.
+
+    Args:
+        canonical_bam (str): Inference BAM of the canonical (control) reads
+        modified_sets (list): (label, modified inference BAM, focus BED) tuples
+        threshold (float): Probability at or above which a call counts as modified
+
+    Returns:
+        dict: JSON-serialisable report with one entry per label and focus position
+    """
+    sets = [(label, bam, read_focus_bed(bed)) for label, bam, bed in modified_sets]
+    all_sites = [site for _, _, sites in sets for site in sites]
+    can_table, can_hist, can_stats = site_histograms(canonical_bam, all_sites, mod_code, workers, batch_size, threads)
+    can_rows = {site: row for row, site in enumerate(can_table.sites)}
+
+    report = {"canonical_bam": canonical_bam, "threshold": threshold, "mod_code": mod_code,
+              "canonical_reads": can_stats["reads"], "sets": []}
+    for label, bam, sites in sets:
+        table, mod_hist, mod_stats = site_histograms(bam, sites, mod_code, workers, batch_size, threads)
+        neg_hist = can_hist[[can_rows[site] for site in table.sites]]
+        positions = []
+        rows = [(f"{contig}:{pos}", contig, pos, mod_hist[i], neg_hist[i]) for i, (contig, pos) in enumerate(table.sites)]
+        # Every focus position of the set pooled together
+        rows.append(("all", None, None, mod_hist.sum(axis=0), neg_hist.sum(axis=0)))
+        for name, contig, pos, pos_hist, neg in rows:
+            mod_calls, mod_mean, mod_rate = rate_summary(pos_hist, threshold)
+            can_calls, can_mean, can_rate = rate_summary(neg, threshold)
+            curves = roc_pr(pos_hist, neg)
+            positions.append({
+                "position": name,
+                "contig": contig,
+                "ref_pos": pos,
+                "mod_calls": int(mod_calls[0]),
+                "mod_mean_prob": finite(mod_mean[0]),
+                "mod_rate": finite(mod_rate[0]),
+                "can_calls": int(can_calls[0]),
+                "can_mean_prob": finite(can_mean[0]),
+                "can_rate": finite(can_rate[0]),
+                "auroc": round(curves["auroc"], 6) if curves else None,
+                "average_precision": round(curves["average_precision"], 6) if curves else None,
+                "curves": curves,
+            })
+        report["sets"].append({"label": label, "bam": bam, "reads": mod_stats["reads"], "positions": positions})
+    return report
+
+CSV_FIELDS = ["label", "position", "contig", "ref_pos", "mod_calls", "mod_mean_prob", "mod_rate",
+              "can_calls", "can_mean_prob", "can_rate", "auroc", "average_precision"]
+
+def write_report(report, output_dir, curves=True):
+    """Write summary.json and summary.csv to output_dir; returns their paths"""
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, "summary.json")
+    csv_path = os.path.join(output_dir, "summary.csv")
+    if not curves:
+        report = dict(report, sets=[
+            dict(s, positions=[{k: v for k, v in p.items() if k != "curves"} for p in s["positions"]])
+            for s in report["sets"]
+        ])
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for modified_set in report["sets"]:
+            for position in modified_set["positions"]:
+                writer.writerow({"label": modified_set["label"], **position})
+    return json_path, csv_path
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-position modification rates and canonical-vs-modified ROC/PR from inference BAMs"
+    )
+    parser.add_argument("--canonical", required=True, help="Canonical inference BAM (e.g. can_infer.bam)")
+    parser.add_argument("--modified", nargs=3, action="append", required=True, metavar=("LABEL", "BAM", "BED"),
+                        help="Modified inference BAM and its focus BED, e.g. G29 G29_infer.bam "
+                             "stationaryfiles/focus_reference_positionsG29.bed (repeatable)")
+    parser.add_argument("--output-dir", default="report", help="Directory for summary.json and summary.csv (default: report)")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Probability at or above which a call counts as modified (default: 0.5)")
+    parser.add_argument("--mod-code", default=None, help="Only count this modification code, e.g. o (default: all)")
+    parser.add_argument("--no-curves", action="store_true", help="Leave the ROC/PR curve points out of summary.json")
+    parser.add_argument("--workers", type=int, default=1, help="Decoding processes (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Reads per worker batch (default: 2000)")
+    parser.add_argument("--threads", type=int, default=2, help="BGZF decompression threads (default: 2)")
+
+    args = parser.parse_args()
+
+    if not 0 <= args.threshold <= 1:
+        parser.error("--threshold must be between 0 and 1")
+
+    try:
+        report = build_report(args.canonical, args.modified, args.threshold, args.mod_code,
+                              args.workers, args.batch_size, args.threads)
+        json_path, csv_path = write_report(report, args.output_dir, curves=not args.no_curves)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed to build report: {e}")
+        sys.exit(1)
+
+    for modified_set in report["sets"]:
+        print(f"{modified_set['label']} ({modified_set['reads']} reads vs {report['canonical_reads']} canonical):")
+        for p in modified_set["positions"]:
+            auroc = f"{p['auroc']:.4f}" if p["auroc"] is not None else "n/a"
+            mod_rate = f"{p['mod_rate']:.3f}" if p["mod_rate"] is not None else "n/a"
+            can_rate = f"{p['can_rate']:.3f}" if p["can_rate"] is not None else "n/a"
+            print(f"  {p['position']}: mod rate {mod_rate} ({p['mod_calls']} calls), "
+                  f"can rate {can_rate} ({p['can_calls']} calls), AUROC {auroc}")
+    print(f"Report written to {json_path} and {csv_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import command_executor
+
+class Stage:
+    """A pipeline step with the stages it depends on and the files it reads and writes
+
+    action takes no arguments and returns True on success.
+    kind groups stages for --from-stage/--until-stage (e.g. every infer_G* stage is "infer").
+    """
+    def __init__(self, name, action, kind=None, deps=None, inputs=None, outputs=None):
+        self.name = name
+        self.action = action
+        self.kind = kind if kind else name
+        self.deps = list(deps) if deps else []
+        self.inputs = list(inputs) if inputs else []
+        self.outputs = list(outputs) if outputs else []
+
+class PipelineError(Exception):
+    """Raised when the stage graph or the requested stage range is invalid"""
+
+class PipelineRunner:
+    """Runs stages as soon as their dependencies finish, independent branches concurrently"""
+    def __init__(self, stages, kind_order, max_workers=None):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise PipelineError(f"Duplicate stage name: {stage.name}")
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise PipelineError(f"Stage {stage.name} depends on unknown stage {dep}")
+            if stage.kind not in kind_order:
+                raise PipelineError(f"Stage {stage.name} has unknown kind {stage.kind}")
+        self.kind_order = list(kind_order)
+        self.max_workers = max_workers if max_workers else max(1, len(stages))
+        # Wall time in seconds of each stage that ran
+        self.timings = {}
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting = set()
+        done = set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in visiting:
+                raise PipelineError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name, [])
+
+    def select(self, from_stage=None, until_stage=None):
+        """Split stages into those to run and those treated as already done"""
+        for kind in (from_stage, until_stage):
+            if kind is not None and kind not in self.kind_order:
+                raise PipelineError(f"Unknown stage {kind}. Choose from: {', '.join(self.kind_order)}")
+        start = self.kind_order.index(from_stage) if from_stage else 0
+        end = self.kind_order.index(until_stage) if until_stage else len(self.kind_order) - 1
+        if start > end:
+            raise PipelineError(f"--from-stage {from_stage} comes after --until-stage {until_stage}")
+
+        to_run = []
+        assumed_done = []
+        for name, stage in self.stages.items():
+            position = self.kind_order.index(stage.kind)
+            if position < start:
+                assumed_done.append(name)
+            elif position <= end:
+                to_run.append(name)
+
+        # Skipped stages must have left their outputs behind for the stages that resume after them
+        for name in assumed_done:
+            missing = [path for path in self.stages[name].outputs if not os.path.exists(path)]
+            needed = any(name in self.stages[other].deps for other in to_run)
+            if missing and needed:
+                raise PipelineError(
+                    f"Cannot skip stage {name}: its outputs are missing ({', '.join(missing)})"
+                )
+        return to_run, assumed_done
+
+    def run(self, from_stage=None, until_stage=None):
+        """Run the selected stages and return {stage name: status}
+
+        Status is one of "done", "failed", "blocked" (a dependency failed) or "skipped".
+        """
+        to_run, assumed_done = self.select(from_stage, until_stage)
+        status = {name: "skipped" for name in self.stages}
+        finished = set(assumed_done)
+        for name in self.stages:
+            if name not in to_run and name not in assumed_done:
+                # Outside the requested range; counts as done for ordering only
+                finished.add(name)
+        pending = list(to_run)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if any(status[dep] in ("failed", "blocked") for dep in stage.deps if dep in to_run):
+                        with command_executor.print_lock:
+                            print(f"=== Stage {name} blocked by a failed dependency ===")
+                        status[name] = "blocked"
+                        pending.remove(name)
+                        continue
+                    if all(dep in finished for dep in stage.deps):
+                        pending.remove(name)
+                        running[executor.submit(self._run_stage, stage)] = name
+
+                if not running:
+                    # Everything left is blocked
+                    continue
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    name = running.pop(future)
+                    status[name] = "done" if future.result() else "failed"
+                    if status[name] == "done":
+                        finished.add(name)
+
+        return status
+
+    def _run_stage(self, stage):
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing:
+            with command_executor.print_lock:
+                print(f"=== Stage {stage.name} is missing inputs: {', '.join(missing)} ===")
+            return False
+        with command_executor.print_lock:
+            print(f"=== Stage {stage.name} started ===")
+        start = time.time()
+        try:
+            ok = stage.action()
+        except Exception as e:
+            self.timings[stage.name] = time.time() - start
+            with command_executor.print_lock:
+                print(f"=== Stage {stage.name} raised {type(e).__name__}: {e} ===")
+            return False
+        elapsed = time.time() - start
+        self.timings[stage.name] = elapsed
+        with command_executor.print_lock:
+            print(f"=== Stage {stage.name} {'finished' if ok else 'failed'} after {elapsed:.1f}s ===")
+        return bool(ok)
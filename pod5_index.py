@@ -0,0 +1,273 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import uuid
+
+import numpy as np
+
+try:
+    import pod5
+except ImportError:
+    pod5 = None
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+DEFAULT_INDEX_DIR = "pod5_index"
+
+# One row per read, sorted by read_id so lookups are a binary search.
+# read_id holds the 16 raw UUID bytes; file_index points into the files table.
+INDEX_DTYPE = np.dtype([("read_id", "S16"), ("file_index", np.uint32), ("batch", np.uint32)])
+
+def pod5_files(pod5_path):
+    """Sorted .pod5 files under a directory, or the file itself"""
+    if os.path.isfile(pod5_path):
+        return [pod5_path]
+    files = []
+    for root, dirs, names in os.walk(pod5_path, followlinks=True):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(".pod5"))
+    return files
+
+def file_listing(pod5_path):
+    """(path, size, mtime_ns) for every pod5 file; an index is current while this is unchanged"""
+    listing = []
+    for path in pod5_files(pod5_path):
+        stat = os.stat(path)
+        listing.append((path, stat.st_size, stat.st_mtime_ns))
+    return listing
+
+def index_path(pod5_path, index_dir=DEFAULT_INDEX_DIR):
+    """Where the index of a pod5 directory is kept, e.g. pod5_index/total_pod5_1a2b3c4d.npz"""
+    absolute = os.path.abspath(pod5_path)
+    name = os.path.basename(os.path.normpath(absolute)) or "pod5"
+    digest = hashlib.sha256(absolute.encode()).hexdigest()[:8]
+    return os.path.join(index_dir, f"{name}_{digest}.npz")
+
+def batch_read_ids(batch):
+    """Raw 16-byte read IDs of a pod5 record batch without converting them to strings"""
+    column = batch.read_id_column
+    if hasattr(column, "combine_chunks"):
+        column = column.combine_chunks()
+    return np.frombuffer(column.buffers()[1], dtype="S16", count=len(column), offset=column.offset * 16)
+
+def build_index(pod5_path, output_path):
+    """
+    Scan every pod5 file once and write a sorted read_id -> (file, batch) table.
+
+    Returns:
+        Pod5Index: The index that was written
+    """
+    if pod5 is None:
+        raise ImportError("pod5 is required to index pod5 files. Install it with 'pip install pod5'.")
+    listing = file_listing(pod5_path)
+    if not listing:
+        raise ValueError(f"No .pod5 files found in {pod5_path}")
+    parts = []
+    for file_index, (path, _, _) in enumerate(listing):
+        with pod5.Reader(path) as reader:
+            for batch_index in range(reader.batch_count):
+                read_ids = batch_read_ids(reader.get_batch(batch_index))
+                part = np.empty(read_ids.size, dtype=INDEX_DTYPE)
+                part["read_id"] = read_ids
+                part["file_index"] = file_index
+                part["batch"] = batch_index
+                parts.append(part)
+    table = np.concatenate(parts) if parts else np.empty(0, dtype=INDEX_DTYPE)
+    table.sort(order="read_id", kind="stable")
+    index = Pod5Index(pod5_path, table, listing)
+    index.save(output_path)
+    return index
+
+class Pod5Index:
+    """Sorted on-disk table mapping read IDs to the pod5 file and batch that hold them"""
+    def __init__(self, pod5_path, table, listing):
+        self.pod5_path = pod5_path
+        self.table = table
+        self.listing = listing
+        self.files = [path for path, _, _ in listing]
+
+    def save(self, output_path):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        tmp_path = f"{output_path}.partial.npz"
+        np.savez(
+            tmp_path,
+            table=self.table,
+            pod5_path=np.array(self.pod5_path),
+            files=np.array(self.files),
+            sizes=np.array([size for _, size, _ in self.listing], dtype=np.int64),
+            mtimes=np.array([mtime for _, _, mtime in self.listing], dtype=np.int64),
+        )
+        os.replace(tmp_path, output_path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            listing = [
+                (str(f), int(s), int(m)) for f, s, m in zip(data["files"], data["sizes"], data["mtimes"])
+            ]
+            return cls(str(data["pod5_path"]), data["table"], listing)
+
+    def is_current(self):
+        """Whether the pod5 files on disk are still the ones that were indexed"""
+        try:
+            return file_listing(self.pod5_path) == self.listing
+        except OSError:
+            return False
+
+    def lookup(self, read_ids):
+        """
+        Find raw 16-byte read IDs in the index.
+
+        Returns:
+            tuple: (found mask, file index, batch index); file and batch are only valid where found
+        """
+        read_ids = np.asarray(read_ids, dtype="S16")
+        if self.table.size == 0:
+            empty = np.zeros(read_ids.size, dtype=np.uint32)
+            return np.zeros(read_ids.size, dtype=bool), empty, empty
+        rows = np.minimum(np.searchsorted(self.table["read_id"], read_ids), self.table.size - 1)
+        found = self.table["read_id"][rows] == read_ids
+        return found, self.table["file_index"][rows], self.table["batch"][rows]
+
+def load_or_build(pod5_path, index_dir=DEFAULT_INDEX_DIR):
+    """The index for a pod5 directory, rebuilt only when its files have changed"""
+    path = index_path(pod5_path, index_dir)
+    if os.path.exists(path):
+        index = Pod5Index.load(path)
+        if index.is_current():
+            return index
+        print(f"pod5 files under {pod5_path} changed since {path} was built; rebuilding")
+    print(f"Indexing read IDs under {pod5_path} into {path}")
+    return build_index(pod5_path, path)
+
+def bam_read_ids(bam_path, threads=2):
+    """
+    Sorted unique raw read IDs referenced by a BAM.
+
+    Split reads carry their pod5 parent in the pi tag, so that ID is used when present.
+
+    Returns:
+        tuple: (read IDs, number of query names that are not UUIDs)
+    """
+    if pysam is None:
+        raise ImportError("pysam is required to read BAM files. Install it with 'pip install pysam'.")
+    read_ids = set()
+    invalid = 0
+    with pysam.AlignmentFile(bam_path, "rb", check_sq=False, threads=threads) as bam_in:
+        for read in bam_in.fetch(until_eof=True):
+            name = read.get_tag("pi") if read.has_tag("pi") else read.query_name
+            try:
+                read_ids.add(uuid.UUID(name).bytes)
+            except ValueError:
+                invalid += 1
+    return np.array(sorted(read_ids), dtype="S16"), invalid
+
+def select_reads(index, bam_path):
+    """
+    Where each read of a BAM lives in the indexed pod5 files.
+
+    Returns:
+        dict: file path -> sorted array of (read_id, batch) rows, plus counts of
+        reads found, missing and with non-UUID names
+    """
+    read_ids, invalid = bam_read_ids(bam_path)
+    found, file_index, batch = index.lookup(read_ids)
+    selection = {}
+    for f in np.unique(file_index[found]):
+        rows = found & (file_index == f)
+        selected = np.empty(int(rows.sum()), dtype=[("read_id", "S16"), ("batch", np.uint32)])
+        selected["read_id"] = read_ids[rows]
+        selected["batch"] = batch[rows]
+        selection[index.files[f]] = selected
+    return selection, {"found": int(found.sum()), "missing": int((~found).sum()), "invalid": invalid}
+
+def link_subset(selection, output_dir):
+    """Fill output_dir with symlinks to just the pod5 files that hold the selected reads"""
+    for number, path in enumerate(sorted(selection)):
+        link = os.path.join(output_dir, f"{number:05d}_{os.path.basename(path)}")
+        os.symlink(os.path.abspath(path), link)
+
+def filter_subset(selection, output_dir):
+    """Copy only the selected reads into one new pod5 file, reading only the batches that hold them"""
+    with pod5.Writer(os.path.join(output_dir, "subset.pod5")) as writer:
+        for path in sorted(selection):
+            selected = selection[path]
+            wanted = set(selected["read_id"].tolist())
+            with pod5.Reader(path) as reader:
+                for batch_index in np.unique(selected["batch"]):
+                    batch = reader.get_batch(int(batch_index))
+                    read_ids = batch_read_ids(batch)
+                    writer.add_reads([
+                        record.to_read() for row, record in enumerate(batch.reads()) if read_ids[row] in wanted
+                    ])
+
+def subset_pod5(index, bam_path, output_dir, mode="symlink"):
+    """
+    Materialise the pod5 input a BAM needs into output_dir.
+
+    Args:
+        index (Pod5Index): Index of the pod5 directory the BAM was basecalled from
+        bam_path (str): BAM whose reads are selected
+        output_dir (str): Directory to create; replaced if it exists
+        mode (str): "symlink" links the pod5 files holding any selected read,
+            "filter" writes a new pod5 with only the selected reads
+
+    Returns:
+        dict: Counts of reads found, missing and with non-UUID names, and files selected
+    """
+    selection, counts = select_reads(index, bam_path)
+    if counts["found"] == 0:
+        raise ValueError(f"None of the reads in {bam_path} are in {index.pod5_path}")
+    tmp_dir = f"{output_dir}.partial"
+    for path in (tmp_dir, output_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    if mode == "filter":
+        filter_subset(selection, tmp_dir)
+    else:
+        link_subset(selection, tmp_dir)
+    os.rename(tmp_dir, output_dir)
+    return dict(counts, files=len(selection))
+
+def main():
+    parser = argparse.ArgumentParser(description="Index pod5 read IDs and select the pod5 input a BAM needs")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR,
+                        help=f"Directory the indexes are kept in (default: {DEFAULT_INDEX_DIR})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index a pod5 directory (skipped if already current)")
+    build_parser.add_argument("pod5", help="pod5 file or directory, e.g. total_pod5")
+    build_parser.add_argument("--force", action="store_true", help="Rebuild even if the index is current")
+
+    subset_parser = subparsers.add_parser("subset", help="Select the pod5 input for a BAM")
+    subset_parser.add_argument("pod5", help="pod5 file or directory the BAM was basecalled from")
+    subset_parser.add_argument("bam", help="BAM whose reads are selected")
+    subset_parser.add_argument("output_dir", help="Directory for the selected pod5 input")
+    subset_parser.add_argument("--mode", choices=["symlink", "filter"], default="symlink",
+                               help="Symlink the pod5 files holding the reads, or copy just the reads (default: symlink)")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            if args.force:
+                index = build_index(args.pod5, index_path(args.pod5, args.index_dir))
+            else:
+                index = load_or_build(args.pod5, args.index_dir)
+            print(f"{index.table.size} reads in {len(index.files)} pod5 files: {index_path(args.pod5, args.index_dir)}")
+        else:
+            index = load_or_build(args.pod5, args.index_dir)
+            counts = subset_pod5(index, args.bam, args.output_dir, args.mode)
+            print(f"Selected {counts['found']} reads from {counts['files']} of {len(index.files)} pod5 files "
+                  f"into {args.output_dir} ({counts['missing']} not found, {counts['invalid']} non-UUID names)")
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import sys
+import time
+
+import torch
+from remora import RemoraError
+
+import fuse_model
+
+def load_torchscript(path):
+    """Load a remora TorchScript model on the CPU with its meta.txt metadata"""
+    extra_files = {"meta.txt": ""}
+    model = torch.jit.load(path, _extra_files=extra_files, map_location="cpu")
+    return model, json.loads(extra_files["meta.txt"])
+
+def quantize(model_path, fused_file=fuse_model.FUSED_MODEL):
+    """
+    Build a dynamically quantised CPU model from a trained ConvLSTM_w_ref model_best.pt.
+
+    BatchNorm is folded into the convolutions, then the LSTM and Linear weights
+    are stored as int8 and activations are quantised on the fly.
+
+    Returns:
+        tuple: (quantised model, model metadata)
+    """
+    trained, meta = load_torchscript(model_path)
+    fused = fuse_model.build_fused(trained.state_dict(), meta["model_params"], fused_file)
+    quantized = torch.ao.quantization.quantize_dynamic(fused, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    return quantized, meta
+
+def save_quantized(quantized, meta, output_path):
+    """Save as TorchScript with the original metadata so remora infer can load it"""
+    meta = dict(meta, doc_string="Nanopore Remora model (dynamic int8, CPU only)")
+    torch.jit.save(torch.jit.script(quantized), output_path,
+                   _extra_files={"meta.txt": json.dumps(meta, indent=4)})
+
+def held_out_batches(chunk_dirs, meta, batch_size, max_chunks=None):
+    """Yield (signal, encoded k-mers, labels) batches from prepared chunk folders"""
+    from remora.data_chunks import CoreRemoraDataset
+
+    override_metadata = {
+        "extra_metadata_arrays": {"modbase_label"},
+        "kmer_context_bases": tuple(meta["kmer_context_bases"]),
+        "chunk_context": tuple(meta["chunk_context"]),
+    }
+    seen = 0
+    for chunk_dir in chunk_dirs:
+        # Read each folder on its own so the final partial batch is not dropped
+        dataset = CoreRemoraDataset(
+            chunk_dir,
+            override_metadata=dict(override_metadata),
+            batch_size=batch_size,
+            infinite_iter=False,
+            return_arrays=["signal", "modbase_label", "enc_kmer"],
+        )
+        for batch in dataset.iter_batches():
+            yield (torch.from_numpy(batch["signal"]), torch.from_numpy(batch["enc_kmer"]),
+                   torch.from_numpy(batch["modbase_label"]))
+            seen += batch["signal"].shape[0]
+            if max_chunks is not None and seen >= max_chunks:
+                return
+
+@torch.no_grad()
+def compare_accuracy(models, batches):
+    """Accuracy of each named model on the same batches, plus how often each agrees with the first"""
+    names = list(models)
+    correct = dict.fromkeys(names, 0)
+    agree = dict.fromkeys(names, 0)
+    seconds = dict.fromkeys(names, 0.0)
+    total = 0
+    for sigs, enc_kmers, labels in batches:
+        reference = None
+        for name in names:
+            start = time.perf_counter()
+            calls = models[name](sigs, enc_kmers).argmax(dim=1)
+            seconds[name] += time.perf_counter() - start
+            correct[name] += int((calls == labels).sum())
+            if reference is None:
+                reference = calls
+            agree[name] += int((calls == reference).sum())
+        total += labels.shape[0]
+    if total == 0:
+        raise ValueError("No chunks found in the held-out chunk folders")
+    return {
+        name: {
+            "accuracy": correct[name] / total,
+            "agreement": agree[name] / total,
+            "chunks_per_sec": total / seconds[name] if seconds[name] else None
+        }
+        for name in names
+    }, total
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a trained ConvLSTM_w_ref model to a dynamic int8 model for CPU inference"
+    )
+    parser.add_argument("model", help="Trained TorchScript model (e.g. train_results/model_best.pt)")
+    parser.add_argument("output", help="Output quantised TorchScript model (e.g. train_results/model_best_int8.pt)")
+    parser.add_argument("--held-out", nargs='+',
+                        help="Prepared chunk folders not used for training, to report the accuracy change")
+    parser.add_argument("--max-chunks", type=int, default=None,
+                        help="Stop evaluating after this many held-out chunks (default: all)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Chunks per evaluation batch (default: 1024)")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for the evaluation (default: torch default)")
+    parser.add_argument("--fused-model", default=fuse_model.FUSED_MODEL, help="Fused model architecture file")
+
+    args = parser.parse_args()
+
+    try:
+        quantized, meta = quantize(args.model, args.fused_model)
+        save_quantized(quantized, meta, args.output)
+    except (OSError, RuntimeError, KeyError) as e:
+        print(f"Failed to quantise {args.model}: {e}")
+        sys.exit(1)
+    print(f"Saved quantised model to {args.output}")
+
+    if not args.held_out:
+        return
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    trained, _ = load_torchscript(args.model)
+    trained.eval()
+    try:
+        results, total = compare_accuracy(
+            {"float": trained, "int8": quantized},
+            held_out_batches(args.held_out, meta, args.batch_size, args.max_chunks)
+        )
+    except (OSError, ValueError, RemoraError) as e:
+        print(f"Failed to evaluate held-out chunks: {e}")
+        sys.exit(1)
+
+    print(f"Held-out accuracy over {total} chunks:")
+    for name, result in results.items():
+        print(f"  {name}: {result['accuracy']:.4%} ({result['chunks_per_sec']:.0f} chunks/sec)")
+    delta = results["int8"]["accuracy"] - results["float"]["accuracy"]
+    print(f"  delta: {delta:+.4%}; int8 calls match float calls on {results['int8']['agreement']:.4%} of chunks")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import bisect
+import os
+import re
+import sys
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_REFERENCE = "reference_files/reference.fasta"
+DEFAULT_CONTIG = "wtreference"
+
+# Focus BED line written for a generated G position: name, score, strand
+FOCUS_NAME = "8oxoG"
+FOCUS_SCORE = 1000
+
+def g_position(g_type):
+    """0-based reference position of a G label such as G29 (the 29th base)"""
+    match = re.fullmatch(r"G(\d+)", g_type)
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f"G position must look like G29, got {g_type}")
+    return int(match.group(1)) - 1
+
+class FastaIndex:
+    """Random access to a FASTA file through its .fai index"""
+    def __init__(self, fasta_path):
+        self.path = fasta_path
+        self.contigs = {}
+        fai_path = fasta_path + ".fai"
+        if os.path.exists(fai_path):
+            self._read_fai(fai_path)
+        else:
+            self._scan()
+
+    def _read_fai(self, fai_path):
+        with open(fai_path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 5:
+                    name, length, offset, line_bases, line_width = fields[:5]
+                    self.contigs[name] = (int(length), int(offset), int(line_bases), int(line_width))
+
+    def _scan(self):
+        """Build the index in one streaming pass when no .fai exists (as samtools faidx would)"""
+        name = None
+        length = offset = line_bases = line_width = 0
+        position = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if name is not None:
+                        self.contigs[name] = (length, offset, line_bases, line_width)
+                    name = line[1:].split()[0].decode()
+                    length = line_bases = line_width = 0
+                    offset = position + len(line)
+                else:
+                    bases = len(line.rstrip(b"\r\n"))
+                    if line_bases == 0:
+                        line_bases, line_width = bases, len(line)
+                    length += bases
+                position += len(line)
+        if name is not None:
+            self.contigs[name] = (length, offset, line_bases, line_width)
+
+    def length(self, contig):
+        return self.contigs[contig][0]
+
+    def fetch(self, contig, start=0, end=None):
+        """Uppercase sequence of contig[start:end], reading only the lines that hold it"""
+        if contig not in self.contigs:
+            raise KeyError(f"Contig {contig} not found in {self.path}")
+        length, offset, line_bases, line_width = self.contigs[contig]
+        end = length if end is None else min(end, length)
+        start = max(0, start)
+        if start >= end:
+            return ""
+        first = offset + (start // line_bases) * line_width + start % line_bases
+        last = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+        with open(self.path, 'rb') as f:
+            f.seek(first)
+            raw = f.read(last - first + 1)
+        return raw.replace(b"\r", b"").replace(b"\n", b"").decode().upper()
+
+class IntervalSet:
+    """Sorted, merged intervals per contig and strand with O(log n) membership queries"""
+    def __init__(self):
+        self.raw = {}
+        self.starts = {}
+        self.ends = {}
+
+    def add(self, contig, start, end, strand="."):
+        self.raw.setdefault((contig, strand), []).append((start, end))
+        self.starts.pop((contig, strand), None)
+
+    def _merged(self, key):
+        if key not in self.starts:
+            merged = []
+            for start, end in sorted(self.raw.get(key, [])):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[key] = [s for s, _ in merged]
+            self.ends[key] = [e for _, e in merged]
+        return self.starts[key], self.ends[key]
+
+    def _strands(self, strand):
+        # Unstranded intervals match either strand; an unstranded query matches any interval
+        return ("+", "-", ".") if strand in (None, ".") else (strand, ".")
+
+    def contains(self, contig, pos, strand=None):
+        for s in self._strands(strand):
+            starts, ends = self._merged((contig, s))
+            index = bisect.bisect_right(starts, pos) - 1
+            if index >= 0 and pos < ends[index]:
+                return True
+        return False
+
+    def contains_array(self, contig, positions, strand=None):
+        """Vectorised contains() for many positions on one contig"""
+        positions = np.asarray(positions)
+        inside = np.zeros(positions.shape, dtype=bool)
+        for s in self._strands(strand):
+            starts, ends = self._merged((contig, s))
+            if not starts:
+                continue
+            index = np.searchsorted(np.asarray(starts), positions, side="right") - 1
+            inside |= (index >= 0) & (positions < np.asarray(ends)[np.maximum(index, 0)])
+        return inside
+
+    def sites(self):
+        """(contig, position, strand) for every base covered, in sorted order"""
+        sites = []
+        for contig, strand in sorted(self.raw):
+            starts, ends = self._merged((contig, strand))
+            for start, end in zip(starts, ends):
+                sites.extend((contig, pos, strand) for pos in range(start, end))
+        return sites
+
+    def contigs(self):
+        return sorted({contig for contig, _ in self.raw})
+
+@lru_cache(maxsize=None)
+def load_bed(path):
+    """Parse a BED file once into an IntervalSet (strand from column 6 when present)"""
+    intervals = IntervalSet()
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith(("#", "track", "browser")):
+                continue
+            strand = fields[5] if len(fields) > 5 else "."
+            intervals.add(fields[0], int(fields[1]), int(fields[2]), strand)
+    return intervals
+
+class ReferenceIndex:
+    """Motif occurrences and G-position checks over a FASTA reference, cached per contig and motif"""
+    def __init__(self, fasta_path):
+        self.fasta = FastaIndex(fasta_path)
+        self.sequences = {}
+        self.motif_starts = {}
+
+    def sequence(self, contig):
+        if contig not in self.sequences:
+            self.sequences[contig] = self.fasta.fetch(contig)
+        return self.sequences[contig]
+
+    def motif_sites(self, contig, motif):
+        """Sorted start positions of every (possibly overlapping) occurrence of motif on contig"""
+        key = (contig, motif.upper())
+        if key not in self.motif_starts:
+            seq = self.sequence(contig)
+            pattern = re.compile(f"(?={re.escape(motif.upper())})")
+            self.motif_starts[key] = [m.start() for m in pattern.finditer(seq)]
+        return self.motif_starts[key]
+
+    def motifs_in(self, contig, motif, start, end):
+        """Occurrences of motif starting within [start, end)"""
+        sites = self.motif_sites(contig, motif)
+        return sites[bisect.bisect_left(sites, start):bisect.bisect_left(sites, end)]
+
+    def motif_offsets(self, contig, pos, motif):
+        """Offsets within motif at which pos falls, for every occurrence covering pos"""
+        return [pos - start for start in self.motifs_in(contig, motif, pos - len(motif) + 1, pos + 1)]
+
+    def check_g_position(self, g_type, motif, mod_num, contig=DEFAULT_CONTIG):
+        """Return an error message if g_type is not base mod_num of a motif occurrence, else None"""
+        pos = g_position(g_type)
+        if contig not in self.fasta.contigs:
+            return f"Contig {contig} not found in {self.fasta.path}"
+        if pos >= self.fasta.length(contig):
+            return f"{g_type} is beyond the end of {contig} ({self.fasta.length(contig)} bases)"
+        if mod_num not in self.motif_offsets(contig, pos, motif):
+            found = self.motif_offsets(contig, pos, motif)
+            hint = f"; {motif} covers it at offset {', '.join(map(str, found))}" if found else f"; no {motif} covers it"
+            return f"{g_type} ({contig}:{pos}, base {self.sequence(contig)[pos]}) is not {motif} offset {mod_num}{hint}"
+        return None
+
+    def focus_bed_lines(self, g_type, contig=DEFAULT_CONTIG, name=FOCUS_NAME):
+        pos = g_position(g_type)
+        return [f"{contig}\t{pos}\t{pos + 1}\t{name}\t{FOCUS_SCORE}\t+"]
+
+    def write_focus_bed(self, g_type, path, contig=DEFAULT_CONTIG):
+        """Write a focus BED for one G position"""
+        if self.check_g_position(g_type, "G", 0, contig) is not None:
+            raise ValueError(f"{g_type} is not a G on {contig}")
+        with open(path, 'w') as f:
+            f.write("\n".join(self.focus_bed_lines(g_type, contig)) + "\n")
+        load_bed.cache_clear()
+        return path
+
+    def check_focus_bed(self, bed_path, motif, mod_num):
+        """Error messages for focus BED bases that are not base mod_num of a motif occurrence"""
+        errors = []
+        for contig, pos, _ in load_bed(bed_path).sites():
+            if contig not in self.fasta.contigs:
+                errors.append(f"{bed_path}: contig {contig} not in {self.fasta.path}")
+            elif mod_num not in self.motif_offsets(contig, pos, motif):
+                errors.append(f"{bed_path}: {contig}:{pos} is not {motif} offset {mod_num}")
+        return errors
+
+@lru_cache(maxsize=None)
+def load_reference(fasta_path=DEFAULT_REFERENCE):
+    """ReferenceIndex for a FASTA, built once per process"""
+    return ReferenceIndex(fasta_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and generate focus BEDs against the telomere reference")
+    parser.add_argument("--reference", default=DEFAULT_REFERENCE, help=f"Reference FASTA (default: {DEFAULT_REFERENCE})")
+    parser.add_argument("--contig", default=DEFAULT_CONTIG, help=f"Reference contig (default: {DEFAULT_CONTIG})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = subparsers.add_parser("check", help="Check that G positions are the given motif base")
+    check_parser.add_argument("positions", nargs='+',
+                              help="G_TYPE:MOTIF:MOD_NUM[:BED], e.g. G29:TTAGGG:3:stationaryfiles/focus_reference_positionsG29.bed")
+
+    generate_parser = subparsers.add_parser("generate", help="Write focus BEDs for G positions")
+    generate_parser.add_argument("g_types", nargs='+', help="G positions, e.g. G29 G33")
+    generate_parser.add_argument("--output-dir", default="stationaryfiles",
+                                 help="Directory for focus_reference_positions<G>.bed (default: stationaryfiles)")
+
+    motifs_parser = subparsers.add_parser("motifs", help="List motif occurrences and the G positions they contain")
+    motifs_parser.add_argument("motif", help="Motif sequence, e.g. TTAGGG")
+
+    args = parser.parse_args()
+
+    try:
+        reference = load_reference(args.reference)
+    except OSError as e:
+        print(f"Failed to read reference: {e}")
+        sys.exit(1)
+
+    if args.command == "check":
+        failed = False
+        for position in args.positions:
+            parts = position.split(':')
+            if len(parts) < 3:
+                parser.error(f"Expected G_TYPE:MOTIF:MOD_NUM[:BED], got {position}")
+            g_type, motif, mod_num = parts[0], parts[1], int(parts[2])
+            try:
+                errors = [reference.check_g_position(g_type, motif, mod_num, args.contig)]
+                if len(parts) > 3:
+                    errors.extend(reference.check_focus_bed(parts[3], motif, mod_num))
+            except (OSError, ValueError) as e:
+                errors = [str(e)]
+            errors = [e for e in errors if e]
+            failed = failed or bool(errors)
+            print(f"{position}: {'OK' if not errors else 'FAILED'}")
+            for error in errors:
+                print(f"  {error}")
+        if failed:
+            sys.exit(1)
+    elif args.command == "generate":
+        os.makedirs(args.output_dir, exist_ok=True)
+        for g_type in args.g_types:
+            path = os.path.join(args.output_dir, f"focus_reference_positions{g_type}.bed")
+            try:
+                reference.write_focus_bed(g_type, path, args.contig)
+            except ValueError as e:
+                print(f"Failed to generate {path}: {e}")
+                sys.exit(1)
+            print(f"Wrote {path}")
+    else:
+        for start in reference.motif_sites(args.contig, args.motif):
+            g_types = [f"G{start + i + 1}:{i}" for i, base in enumerate(args.motif.upper()) if base == "G"]
+            print(f"{args.contig}:{start}-{start + len(args.motif)}  {' '.join(g_types)}")
+
+if __name__ == "__main__":
+    main()
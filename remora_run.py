@@ -1,33 +1,17 @@
-import subprocess
 import os
 import argparse
 import datetime
 import csv
 from pathlib import Path
 
-def run_command(command):
-    """Execute a shell command and return the return code"""
-    print(f"Running: {command}")
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-    
-    # Print output in real-time
-    for line in iter(process.stdout.readline, ''):
-        print(line.strip())
-    
-    process.stdout.close()
-    return_code = process.wait()
-    
-    if return_code != 0:
-        print(f"Command failed with return code {return_code}")
-    
-    return return_code
+import command_executor
+
+# Full command output goes to remora_logs/commands; the console gets a rate-limited echo
+executor = command_executor.Executor(os.path.join("remora_logs", "commands"))
+
+def run_command(cmd, label=None):
+    """Run an argument list without a shell and return the return code"""
+    return executor.run(cmd, label).return_code
 
 def log_parameters(args):
     """Log all parameters to a CSV file"""
@@ -114,7 +98,7 @@ def dataset_prepare(args):
         "--mod-base-control",
         "--focus-reference-positions", "stationaryfiles/focus_reference_positionscan.bed"
     ]
-    run_command(" ".join(can_cmd))
+    run_command(can_cmd, "can_all")
     
     # Modified dataset preparation
     mod_cmd = [
@@ -127,7 +111,7 @@ def dataset_prepare(args):
         "--mod-base", "o", "8oxoG",
         "--focus-reference-positions", f"stationaryfiles/focus_reference_positions{args.g_type}.bed"
     ]
-    run_command(" ".join(mod_cmd))
+    run_command(mod_cmd, f"8oxo{args.g_type}")
 
 def dataset_configure(g_type):
     cmd = [
@@ -138,7 +122,7 @@ def dataset_configure(g_type):
         "--dataset-weights", "1", "1",
         "--log-filename", "train_dataset.log"
     ]
-    run_command(" ".join(cmd))
+    run_command(cmd, "configure")
 
 def dataset_train(args):
     cmd = [
@@ -149,7 +133,7 @@ def dataset_train(args):
         "--chunk-context", str(args.chunk_context), str(args.chunk_context),
         "--output-path", "train_results"
     ]
-    run_command(" ".join(cmd))
+    run_command(cmd, "train")
     print("Training completed!")
 
 def dataset_infer(args):
@@ -163,7 +147,7 @@ def dataset_infer(args):
         "--log-filename", "can_infer.log", 
         "--device", "0"
     ]
-    run_command(" ".join(can_cmd))
+    run_command(can_cmd, "can_infer")
     
     # Modified inference
     mod_cmd = [
@@ -175,7 +159,7 @@ def dataset_infer(args):
         "--log-filename", "mod_infer.log", 
         "--device", "0"
     ]
-    run_command(" ".join(mod_cmd))
+    run_command(mod_cmd, "mod_infer")
 
 def dataset_plotting(args):
     cmd = [
@@ -188,7 +172,7 @@ def dataset_plotting(args):
         "--refine-rough-rescale",
         "--log-filename", "plot.log"
     ]
-    run_command(" ".join(cmd))
+    run_command(cmd, "plot")
     print("Plotting completed!")
 
 def main():
@@ -1,34 +1,86 @@
-import subprocess
 import os
+import sys
 import argparse
 import datetime
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
+import queue
+import re
+import shutil
+import time
+import zlib
 
-def run_command(command):
-    """Execute a shell command and return the return code"""
-    print(f"Running: {command}")
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-    
-    # Print output in real-time
-    for line in iter(process.stdout.readline, ''):
-        print(line.strip())
-    
-    process.stdout.close()
-    return_code = process.wait()
+import chunk_cache
+import chunk_registry
+import chunk_stats
+import command_executor
+import pod5_index
+import reference_index
+import run_metrics
+import train_resume
+from pipeline_dag import Stage, PipelineRunner, PipelineError
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+# Serialises console output when several commands stream at once
+print_lock = command_executor.print_lock
+
+# Per-job metrics file; set up in main()
+metrics = None
+
+# When this job started; a resumable training's wall limit counts from here
+JOB_START = time.time()
+
+# Runs every external command; main() points its logs at the job's log directory
+executor = command_executor.Executor()
+
+def record_result(result):
+    """Record a finished command's resource usage in the job's metrics file"""
+    if metrics is not None and result.usage is not None:
+        metrics.record_command(result.label, result.command, result.return_code, result.start, result.end, result.usage)
+
+def run_command(cmd, prefix=None):
+    """Run an argument list without a shell and return the return code"""
+    return executor.run(cmd, prefix).return_code
+
+def run_jobs_parallel(jobs, max_workers=1):
+    """Run (label, callable) jobs on a bounded worker pool and return the failed ones
+
+    Each callable takes no arguments and returns a return code.
+    """
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [(label, executor.submit(job)) for label, job in jobs]
+        for label, future in futures:
+            try:
+                return_code = future.result()
+            except Exception as e:
+                with print_lock:
+                    print(f"[{label}] Failed to run job: {e}")
+                return_code = -1
+            if return_code != 0:
+                failures.append((label, return_code))
     
-    if return_code != 0:
-        print(f"Command failed with return code {return_code}")
+    for label, return_code in failures:
+        print(f"Job {label} failed with return code {return_code}")
     
-    return return_code
+    return failures
+
+def run_commands_parallel(jobs, max_workers=1):
+    """Run (label, argument list) jobs at most max_workers at a time and return the failed ones"""
+    failures = [
+        (result.label, result.return_code)
+        for result in executor.run_many(jobs, max_workers) if not result.ok
+    ]
+    for label, return_code in failures:
+        print(f"Job {label} failed with return code {return_code}")
+    return failures
 
 def log_parameters(args):
     """Log all parameters to a CSV file"""
@@ -39,8 +91,8 @@ def log_parameters(args):
     job_id = os.environ.get('LSB_JOBID', 'local')
     
     # Create log entry for multi-G setup
-    g_positions_str = ",".join([g.g_type for g in args.g_positions]) if hasattr(args, 'g_positions') else str(args.g_type)
-    motifs_str = ",".join([f"{g.motif}:{g.mod_num}" for g in args.g_positions]) if hasattr(args, 'g_positions') else f"{args.motif}:{args.mod_num}"
+    g_positions_str = ",".join([g.g_type for g in args.g_positions]) if args.mode == "multi" else str(args.g_type)
+    motifs_str = ",".join([f"{g.motif}:{g.mod_num}" for g in args.g_positions]) if args.mode == "multi" else f"{args.motif}:{args.mod_num}"
     
     log_entry = [
         job_id,
@@ -49,7 +101,7 @@ def log_parameters(args):
         str(args.can_bam),
         motifs_str,
         g_positions_str,
-        "multi_g" if hasattr(args, 'g_positions') else "single_g",
+        "multi_g" if args.mode == "multi" else "single_g",
         "plot" if args.plot else "no_plot",
         "train" if args.train else "no_train",
         "infer" if args.infer else "no_infer",
@@ -76,6 +128,7 @@ def log_parameters(args):
         writer.writerow(log_entry)
     
     print(f"Parameters logged to {log_file}")
+    return job_id, timestamp
 
 def sanitize_path(path):
     if not path:
@@ -111,79 +164,289 @@ class GPosition:
         self.pod5 = pod5
         self.focus_bed = focus_bed
 
+def script_path(name):
+    """Helper scripts are found next to this file, so runs can use any working directory"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+LEVEL_TABLE = "stationaryfiles/levels.txt"
+
+def default_focus_bed(g_type):
+    return f"stationaryfiles/focus_reference_positions{g_type}.bed"
+
+def focus_bed_path(g_pos):
+    """Focus BED for a G position: its override if given, else the stationaryfiles default"""
+    return g_pos.focus_bed if g_pos.focus_bed else default_focus_bed(g_pos.g_type)
+
+def check_reference_positions(g_positions, reference_path, contig=reference_index.DEFAULT_CONTIG):
+    """
+    Check each G position against the reference and write any missing default focus BED.
+
+    Returns:
+        list: Error messages; empty if every G position is the stated motif base
+    """
+    if not os.path.exists(reference_path):
+        print(f"Reference {reference_path} not found; skipping the G position check")
+        return []
+    reference = reference_index.load_reference(reference_path)
+    errors = []
+    for g_pos in g_positions:
+        error = reference.check_g_position(g_pos.g_type, g_pos.motif, g_pos.mod_num, contig)
+        if error:
+            errors.append(error)
+        elif g_pos.focus_bed:
+            if not os.path.exists(g_pos.focus_bed):
+                errors.append(f"Focus BED not found: {g_pos.focus_bed}")
+            else:
+                errors.extend(reference.check_focus_bed(g_pos.focus_bed, g_pos.motif, g_pos.mod_num))
+        elif not os.path.exists(default_focus_bed(g_pos.g_type)):
+            reference.write_focus_bed(g_pos.g_type, default_focus_bed(g_pos.g_type), contig)
+            print(f"Generated {default_focus_bed(g_pos.g_type)}")
+    return errors
+
+# Serialises pod5 subsetting; stages running side by side may share a BAM or index
+pod5_subset_lock = threading.Lock()
+
+def pod5_input(args, pod5, bam):
+    """
+    pod5 input passed to remora for a BAM: the whole --pod5 path, or with --pod5-subset
+    a directory holding only the pod5 data of the BAM's reads, reused while unchanged.
+    """
+    if not args.pod5_subset:
+        return pod5
+    with pod5_subset_lock:
+        index = pod5_index.load_or_build(pod5, args.pod5_index_dir)
+        name = os.path.basename(bam).rsplit(".", 1)[0]
+        digest = zlib.crc32(os.path.abspath(bam).encode())
+        subset_dir = os.path.join("pod5_subsets", f"{name}_{digest:08x}")
+        key = chunk_cache.compute_key({"mode": args.pod5_subset}, {
+            "bam": bam,
+            "index": pod5_index.index_path(pod5, args.pod5_index_dir)
+        })
+        key_path = f"{subset_dir}.key"
+        if os.path.isdir(subset_dir) and os.path.exists(key_path):
+            with open(key_path) as f:
+                if f.read().strip() == key:
+                    return subset_dir
+        counts = pod5_index.subset_pod5(index, bam, subset_dir, args.pod5_subset)
+        with open(key_path, 'w') as f:
+            f.write(key + "\n")
+        with print_lock:
+            print(f"Selected {counts['found']} reads of {bam} from {counts['files']} of {len(index.files)} "
+                  f"pod5 files into {subset_dir}")
+            if counts["missing"] or counts["invalid"]:
+                print(f"Warning: {counts['missing']} reads of {bam} are not in {pod5} "
+                      f"and {counts['invalid']} have non-UUID names")
+        return subset_dir
+
+class PrepareJob:
+    """A single remora dataset prepare invocation and the inputs that determine its output"""
+    def __init__(self, label, pod5, bam, output_path, motif, mod_num, focus_bed, control):
+        self.label = label
+        self.pod5 = pod5
+        self.bam = bam
+        self.output_path = output_path
+        self.motif = motif
+        self.mod_num = mod_num
+        self.focus_bed = focus_bed
+        self.control = control
+
+    def command(self, output_path):
+        cmd = [
+            "remora", "dataset", "prepare",
+            str(self.pod5), str(self.bam),
+            "--output-path", output_path,
+            "--refine-kmer-level-table", LEVEL_TABLE,
+            "--refine-rough-rescale",
+            "--motif", str(self.motif), str(self.mod_num)
+        ]
+        if self.control:
+            cmd.append("--mod-base-control")
+        else:
+            cmd.extend(["--mod-base", "o", "8oxoG"])
+        cmd.extend(["--focus-reference-positions", self.focus_bed])
+        return cmd
+
+    def cache_params(self):
+        return {
+            "motif": str(self.motif),
+            "mod_num": int(self.mod_num),
+            "control": self.control,
+            "command": self.command("<output>")
+        }
+
+    def cache_key(self):
+        return chunk_cache.compute_key(self.cache_params(), {
+            "pod5": self.pod5,
+            "bam": self.bam,
+            "focus_bed": self.focus_bed,
+            "level_table": LEVEL_TABLE
+        })
+
+def run_prepare_job(job, key, manifest):
+    """Prepare into a partial directory and rename it into place once remora succeeds"""
+    tmp_path = chunk_cache.partial_path(job.output_path)
+    # Leftovers from a killed run are never reused
+    chunk_cache.remove_path(tmp_path)
+    return_code = run_command(job.command(tmp_path), job.label)
+    if return_code != 0:
+        chunk_cache.remove_path(tmp_path)
+        return return_code
+    chunk_cache.promote_partial(job.output_path)
+    manifest.record(job.output_path, key, job.cache_params())
+    return 0
+
+def prepare_shard_dir(job):
+    return os.path.join("prepare_shards", job.label)
+
+def shard_prepare_job(job, num_shards):
+    """
+    Split a prepare job into one job per read-ID shard of its BAM.
+
+    Every record of a read lands in the same shard and remora prepares each read
+    on its own, so the shards together hold exactly the chunks of an unsharded run.
+    """
+    shard_dir = prepare_shard_dir(job)
+    chunk_cache.remove_path(shard_dir)
+    shard_bams = shard_bam(job.bam, num_shards, shard_dir, job.label)
+    return [
+        PrepareJob(
+            f"{job.label}.shard{index}", job.pod5, shard, os.path.join(shard_dir, f"shard{index}_chunks"),
+            job.motif, job.mod_num, job.focus_bed, job.control
+        )
+        for index, shard in enumerate(shard_bams)
+    ]
+
+def merge_prepare_shards(job, key, manifest, shard_jobs):
+    """Merge shard chunk folders into the job's output folder and check no chunk was lost"""
+    tmp_path = chunk_cache.partial_path(job.output_path)
+    chunk_cache.remove_path(tmp_path)
+    shard_paths = [shard.output_path for shard in shard_jobs]
+    cmd = ["remora", "dataset", "merge", tmp_path, *shard_paths]
+    if run_command(cmd, f"{job.label}.merge") != 0:
+        chunk_cache.remove_path(tmp_path)
+        return False
+    expected = sum(end - start for start, end in map(chunk_stats.chunk_range, shard_paths))
+    start, end = chunk_stats.chunk_range(tmp_path)
+    if end - start != expected:
+        print(f"[{job.label}] Merged {end - start} chunks but the shards hold {expected}")
+        chunk_cache.remove_path(tmp_path)
+        return False
+    chunk_cache.promote_partial(job.output_path)
+    manifest.record(job.output_path, key, job.cache_params())
+    shutil.rmtree(prepare_shard_dir(job), ignore_errors=True)
+    print(f"[{job.label}] Merged {len(shard_jobs)} shards ({expected} chunks) into {job.output_path}")
+    return True
+
+def run_prepare_jobs(prepare_jobs, max_workers=1, trust_existing=False, num_shards=1, registry=None, source=None):
+    """Run the prepare jobs whose inputs changed since their chunks were last written
+
+    With num_shards > 1 each job's BAM is split by read ID, the shards of every job
+    share the max_workers pool, and each job's shards are merged once they finish.
+    With a registry, every folder that is up to date afterwards is registered under source.
+    """
+    manifest = chunk_cache.ChunkManifest()
+    jobs = []
+    merges = []
+    keys = {}
+    for job in prepare_jobs:
+        key = keys[job.label] = job.cache_key()
+        if os.path.dirname(job.output_path):
+            os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        if manifest.is_current(job.output_path, key):
+            print(f"[{job.label}] {job.output_path} is up to date. Skipping dataset preparation.")
+            continue
+        if os.path.isdir(job.output_path) and job.output_path not in manifest.entries and trust_existing:
+            print(f"[{job.label}] Adopting existing {job.output_path} into the chunk manifest.")
+            manifest.record(job.output_path, key, job.cache_params())
+            continue
+        if os.path.exists(job.output_path):
+            print(f"[{job.label}] {job.output_path} is stale or incomplete. Re-preparing.")
+        if num_shards > 1:
+            print(f"[{job.label}] Splitting {job.bam} into {num_shards} read-ID shards")
+            shard_jobs = shard_prepare_job(job, num_shards)
+            jobs.extend(
+                (shard.label, lambda shard=shard: run_command(shard.command(shard.output_path), shard.label))
+                for shard in shard_jobs
+            )
+            merges.append((job, key, shard_jobs))
+        else:
+            jobs.append((job.label, lambda job=job, key=key: run_prepare_job(job, key, manifest)))
+    
+    failures = run_jobs_parallel(jobs, max_workers)
+    failed_labels = {label for label, _ in failures}
+    for job, key, shard_jobs in merges:
+        if any(shard.label in failed_labels for shard in shard_jobs):
+            shutil.rmtree(prepare_shard_dir(job), ignore_errors=True)
+            continue
+        if not merge_prepare_shards(job, key, manifest, shard_jobs):
+            failures.append((job.label, -1))
+    if merges and os.path.isdir("prepare_shards") and not os.listdir("prepare_shards"):
+        os.rmdir("prepare_shards")
+    if registry is not None:
+        # Unchanged folders keep their entries, so only new chunks are counted
+        for job in prepare_jobs:
+            if manifest.is_current(job.output_path, keys[job.label]):
+                if registry.register(job.output_path, source, keys[job.label]):
+                    print(f"[{job.label}] Registered {job.output_path} as {chunk_registry.dataset_name(source, job.output_path)}")
+        registry.save()
+    return not failures
+
+def open_registry(args):
+    """The chunk registry when --registry is set, else None"""
+    return chunk_registry.ChunkRegistry(args.registry) if args.registry else None
+
+def chunk_folder(args, name):
+    """Where a chunk folder is prepared: under chunk_sets/<source> with --registry, else the working directory"""
+    return os.path.join(chunk_registry.CHUNK_SETS_DIR, args.source, name) if args.registry else name
+
 def dataset_prepare_multi_g(args):
     """Prepare datasets for multiple G positions"""
-    # Check if chunk folders already exist
-    existing_chunks = []
-    for g_pos in args.g_positions:
-        if os.path.exists(f"can_{g_pos.g_type}_chunks") and os.path.exists(f"8oxo{g_pos.g_type}_chunks"):
-            existing_chunks.append(g_pos.g_type)
-    
-    if existing_chunks:
-        print(f"Chunk folders already exist for: {', '.join(existing_chunks)}. Skipping dataset preparation.")
-        return
+    jobs = []
 
     # Canonical dataset preparation for each G position
     for g_pos in args.g_positions:
-        can_cmd = [
-            "remora", "dataset", "prepare",
-            str(args.pod5), str(args.can_bam),
-            "--output-path", f"can_{g_pos.g_type}_chunks",
-            "--refine-kmer-level-table", "stationaryfiles/levels.txt",
-            "--refine-rough-rescale",
-            "--motif", str(g_pos.motif), str(g_pos.mod_num),
-            "--mod-base-control",
-            "--focus-reference-positions", f"stationaryfiles/focus_reference_positions{g_pos.g_type}.bed"
-        ]
-        run_command(" ".join(can_cmd))
+        focus_bed = focus_bed_path(g_pos)
+        jobs.append(PrepareJob(
+            f"can_{g_pos.g_type}", pod5_input(args, args.pod5, args.can_bam), args.can_bam, chunk_folder(args, f"can_{g_pos.g_type}_chunks"),
+            g_pos.motif, g_pos.mod_num, focus_bed, control=True
+        ))
     
     # Modified dataset preparation for each G position
     for g_pos in args.g_positions:
         pod5_path = g_pos.pod5 if g_pos.pod5 else args.pod5
-        mod_cmd = [
-            "remora", "dataset", "prepare",
-            str(pod5_path), str(g_pos.mod_bam),
-            "--output-path", f"8oxo{g_pos.g_type}_chunks",
-            "--refine-kmer-level-table", "stationaryfiles/levels.txt",
-            "--refine-rough-rescale",
-            "--motif", str(g_pos.motif), str(g_pos.mod_num),
-            "--mod-base", "o", "8oxoG",
-            "--focus-reference-positions", f"stationaryfiles/focus_reference_positions{g_pos.g_type}.bed"
-        ]
-        run_command(" ".join(mod_cmd))
+        focus_bed = focus_bed_path(g_pos)
+        jobs.append(PrepareJob(
+            f"8oxo{g_pos.g_type}", pod5_input(args, pod5_path, g_pos.mod_bam), g_pos.mod_bam, chunk_folder(args, f"8oxo{g_pos.g_type}_chunks"),
+            g_pos.motif, g_pos.mod_num, focus_bed, control=False
+        ))
+
+    # Every prepare invocation is independent, so run them side by side
+    return run_prepare_jobs(jobs, args.prepare_jobs, args.trust_existing_chunks, args.prepare_shards,
+                            open_registry(args), args.source)
 
 def dataset_prepare_single_g(args):
     """Prepare datasets for single G position (original functionality)"""
-    # Check if chunk folders already exist
-    if os.path.exists("can_all_chunks") and os.path.exists(f"8oxo{args.g_type}_chunks"):
-        print("Chunk folders already exist. Skipping dataset preparation.")
-        return
-
-    # Canonical dataset preparation
-    can_cmd = [
-        "remora", "dataset", "prepare",
-        str(args.pod5), str(args.can_bam),
-        "--output-path", "can_all_chunks",
-        "--refine-kmer-level-table", "stationaryfiles/levels.txt",
-        "--refine-rough-rescale",
-        "--motif", str(args.motif), str(args.mod_num),
-        "--mod-base-control",
-        "--focus-reference-positions", "stationaryfiles/focus_reference_positionscan.bed"
+    jobs = [
+        # Canonical dataset preparation
+        PrepareJob(
+            "can_all", pod5_input(args, args.pod5, args.can_bam), args.can_bam, chunk_folder(args, "can_all_chunks"),
+            args.motif, args.mod_num, "stationaryfiles/focus_reference_positionscan.bed", control=True
+        ),
+        # Modified dataset preparation
+        PrepareJob(
+            f"8oxo{args.g_type}", pod5_input(args, args.pod5, args.mod_bam), args.mod_bam, chunk_folder(args, f"8oxo{args.g_type}_chunks"),
+            args.motif, args.mod_num, default_focus_bed(args.g_type), control=False
+        )
     ]
-    run_command(" ".join(can_cmd))
-    
-    # Modified dataset preparation
-    mod_cmd = [
-        "remora", "dataset", "prepare",
-        str(args.pod5), str(args.mod_bam),
-        "--output-path", f"8oxo{args.g_type}_chunks",
-        "--refine-kmer-level-table", "stationaryfiles/levels.txt",
-        "--refine-rough-rescale",
-        "--motif", str(args.motif), str(args.mod_num),
-        "--mod-base", "o", "8oxoG",
-        "--focus-reference-positions", f"stationaryfiles/focus_reference_positions{args.g_type}.bed"
-    ]
-    run_command(" ".join(mod_cmd))
+    return run_prepare_jobs(jobs, args.prepare_jobs, args.trust_existing_chunks, args.prepare_shards,
+                            open_registry(args), args.source)
+
+def auto_dataset_weights(chunk_folders, target_ratio):
+    """Weights that sample the prepared chunks at the requested canonical:modified ratio"""
+    stats = chunk_stats.inspect_chunks(chunk_folders)
+    weights = chunk_stats.balance_weights(stats, chunk_stats.parse_ratio(target_ratio))
+    chunk_stats.print_report(stats, weights)
+    return [chunk_stats.format_weight(w) for w in weights]
 
 def dataset_configure_multi_g(args):
     """Configure dataset for multiple G positions"""
@@ -198,7 +461,9 @@ def dataset_configure_multi_g(args):
         cmd.append(f"8oxo{g_pos.g_type}_chunks")
     
     # Add dataset weights
-    if hasattr(args, 'dataset_weights') and args.dataset_weights:
+    if args.auto_weights:
+        cmd.extend(["--dataset-weights"] + auto_dataset_weights(chunk_dirs(args), args.target_ratio))
+    elif hasattr(args, 'dataset_weights') and args.dataset_weights:
         cmd.extend(["--dataset-weights"] + [str(w) for w in args.dataset_weights])
     else:
         # Default weights: 16 for canonical, 1 for modified (as in model141)
@@ -206,72 +471,329 @@ def dataset_configure_multi_g(args):
         cmd.extend(["--dataset-weights"] + [str(w) for w in default_weights])
     
     cmd.extend(["--log-filename", "train_dataset.log"])
-    run_command(" ".join(cmd))
+    return run_command(cmd, "configure") == 0
 
-def dataset_configure_single_g(g_type):
+def dataset_configure_single_g(args):
     """Configure dataset for single G position (original functionality)"""
+    chunk_folders = ["can_all_chunks", f"8oxo{args.g_type}_chunks"]
+    weights = auto_dataset_weights(chunk_folders, args.target_ratio) if args.auto_weights else ["1", "1"]
     cmd = [
         "remora", "dataset", "make_config",
         "train_dataset.jsn",
-        "can_all_chunks",
-        f"8oxo{g_type}_chunks",
-        "--dataset-weights", "1", "1",
+        *chunk_folders,
+        "--dataset-weights", *weights,
         "--log-filename", "train_dataset.log"
     ]
-    run_command(" ".join(cmd))
+    return run_command(cmd, "configure") == 0
 
-def dataset_train(args):
+def dataset_configure_registry(args):
+    """Configure the dataset from every registered chunk folder, weighted by the recorded chunk counts"""
+    registry = chunk_registry.ChunkRegistry(args.registry)
+    missing = registry.missing()
+    if missing:
+        print(f"Registered chunk folders are missing: {', '.join(missing)}")
+        print(f"Restore them or drop them with: python chunk_registry.py --registry {args.registry} remove NAME")
+        return False
+    stats = registry.stats()
+    try:
+        weights = chunk_stats.balance_weights(stats, chunk_stats.parse_ratio(args.target_ratio))
+    except ValueError as e:
+        print(f"Cannot weight the registered datasets: {e}")
+        return False
+    print(f"Training set: {args.registry} version {registry.version}")
+    chunk_stats.print_report(stats, weights)
     cmd = [
-        "remora", "model", "train",
+        "remora", "dataset", "make_config",
         "train_dataset.jsn",
-        "--model", "stationaryfiles/ConvLSTM_w_ref.py",
-        "--device", "cuda:0",
-        "--chunk-context", str(args.chunk_context), str(args.chunk_context),
-        "--output-path", "train_results"
+        *[entry["path"] for entry in stats],
+        "--dataset-weights", *[chunk_stats.format_weight(w) for w in weights],
+        "--log-filename", "train_dataset.log"
     ]
-    run_command(" ".join(cmd))
-    print("Training completed!")
+    return run_command(cmd, "configure") == 0
 
-def dataset_infer_multi_g(args):
-    """Perform inference for multiple G positions"""
-    for g_pos in args.g_positions:
-        pod5_path = g_pos.pod5 if g_pos.pod5 else args.pod5
-        mod_cmd = [
-            "remora", "infer", "from_pod5_and_bam", 
-            "--reference-anchored",
-            str(pod5_path), str(g_pos.mod_bam), 
-            "--model", str(args.model), 
-            "--out-bam", f"{g_pos.g_type}_infer.bam",
-            "--log-filename", f"{g_pos.g_type}_infer.log", 
-            "--device", "0"
+def training_chunk_dirs(args):
+    """Chunk folders the model is trained on: every registered folder with --registry, else this run's"""
+    if args.registry:
+        return [entry["path"] for entry in chunk_registry.ChunkRegistry(args.registry).stats()]
+    return chunk_dirs(args)
+
+def unfinished_training(path):
+    """Whether path holds a resumable training that has not completed"""
+    state_path = os.path.join(path, train_resume.STATE_FILE)
+    if not os.path.exists(state_path):
+        return False
+    with open(state_path) as f:
+        return json.load(f)["status"] != "done"
+
+def train_output_path(registry, resumable=False):
+    """
+    train_results, or with --registry a new train_runs/v<version> folder per training.
+    With --resumable an unfinished training of the same version is continued instead.
+    """
+    if registry is None:
+        return "train_results"
+    base = os.path.join("train_runs", f"v{registry.version:03d}")
+    path = base
+    attempt = 1
+    while os.path.exists(path) and not (resumable and unfinished_training(path)):
+        attempt += 1
+        path = f"{base}_{attempt}"
+    return path
+
+def previous_model(registry):
+    """Model the last training produced: the registry's latest, else train_results/model_best.pt"""
+    model = registry.latest_model()
+    if model is None and os.path.exists(os.path.join("train_results", "model_best.pt")):
+        model = os.path.join("train_results", "model_best.pt")
+    return model
+
+def dataset_train(args):
+    registry = open_registry(args)
+    output_path = train_output_path(registry, args.resumable)
+    if args.resumable:
+        # Trains in checkpointed segments that a follow-up job can resume (see train_resume.py)
+        cmd = [
+            sys.executable, script_path("train_resume.py"),
+            "--dataset", "train_dataset.jsn",
+            "--chunk-context", str(args.chunk_context),
+            "--output-path", output_path,
+            "--started", str(JOB_START)
+        ]
+        if args.wall_time:
+            cmd.extend(["--wall-time", args.wall_time])
+        if args.chain_script:
+            cmd.extend(["--chain-script", args.chain_script])
+    else:
+        cmd = [
+            "remora", "model", "train",
+            "train_dataset.jsn",
+            "--model", "stationaryfiles/ConvLSTM_w_ref.py",
+            "--device", "cuda:0",
+            "--chunk-context", str(args.chunk_context), str(args.chunk_context),
+            "--output-path", output_path
         ]
-        run_command(" ".join(mod_cmd))
+    if args.finetune_previous:
+        finetune_path = previous_model(registry)
+        if finetune_path is None:
+            print("No previous model found; training from scratch")
+        else:
+            print(f"Fine-tuning from {finetune_path}")
+            cmd.extend(["--finetune-path", finetune_path])
+    return_code = run_command(cmd, "train")
+    if return_code == train_resume.EXIT_RESUMABLE:
+        print(f"Training paused before the wall limit; rerun this job (or let the follow-up job run) "
+              f"to resume it from {output_path}")
+        return False
+    if return_code != 0:
+        print("Training failed!")
+        return False
+    if registry is not None:
+        registry.record_model(os.path.join(output_path, "model_best.pt"))
+    print(f"Training completed! Results in {output_path}")
+    return True
 
-def dataset_infer_single_g(args):
-    """Perform inference for single G position (original functionality)"""
-    # Canonical inference
-    can_cmd = [
-        "remora", "infer", "from_pod5_and_bam", 
-        "--reference-anchored", 
-        str(args.pod5), str(args.can_bam), 
-        "--model", str(args.model), 
-        "--out-bam", "can_infer.bam",
-        "--log-filename", "can_infer.log", 
-        "--device", "0"
+def dataset_sweep(args):
+    """Train one model per point of the --sweep search space over the shared chunk folders"""
+    cmd = [
+        sys.executable, script_path("sweep_train.py"),
+        "--space", str(args.sweep),
+        "--name", args.sweep_name,
+        "--chunk-dirs", *training_chunk_dirs(args),
+        "--base-config", "train_dataset.jsn",
+        "--devices", args.devices,
+        "--jobs-per-device", str(args.jobs_per_device)
     ]
-    run_command(" ".join(can_cmd))
-    
-    # Modified inference
-    mod_cmd = [
+    # Parameters the space leaves out follow this run's settings
+    with open(args.sweep) as f:
+        if "chunk_context" not in json.load(f):
+            cmd.extend(["--chunk-contexts", str(args.chunk_context)])
+    if run_command(cmd, "sweep") != 0:
+        print("Sweep failed!")
+        return False
+    print(f"Sweep completed! Leaderboard: sweeps/{args.sweep_name}/leaderboard.csv")
+    return True
+
+def parse_devices(devices_str):
+    """Parse a device list such as "0,1" or "cpu" into remora device names"""
+    devices = [d.strip() for d in devices_str.split(',') if d.strip()]
+    return devices if devices else ["0"]
+
+class DevicePool:
+    """Hands out device slots so each device runs at most jobs_per_device jobs at once"""
+    def __init__(self, devices, jobs_per_device=1):
+        self.slots = queue.Queue()
+        for _ in range(max(1, jobs_per_device)):
+            for device in devices:
+                self.slots.put(device)
+        self.size = self.slots.qsize()
+
+    def run(self, job):
+        """Run job(device) on the next free device and return its result"""
+        device = self.slots.get()
+        try:
+            return job(device)
+        finally:
+            self.slots.put(device)
+
+class InferJob:
+    """One remora inference run over a pod5/BAM pair"""
+    def __init__(self, label, pod5, bam, out_bam, log_filename):
+        self.label = label
+        self.pod5 = pod5
+        self.bam = bam
+        self.out_bam = out_bam
+        self.log_filename = log_filename
+
+def infer_command(pod5, bam, model, out_bam, log_filename, device):
+    cmd = [
         "remora", "infer", "from_pod5_and_bam", 
         "--reference-anchored",
-        str(args.pod5), str(args.mod_bam), 
-        "--model", str(args.model), 
-        "--out-bam", "mod_infer.bam",
-        "--log-filename", "mod_infer.log", 
-        "--device", "0"
+        str(pod5), str(bam), 
+        "--model", str(model), 
+        "--out-bam", out_bam,
+        "--log-filename", log_filename
+    ]
+    # remora runs on the CPU when no device is given
+    if device != "cpu":
+        cmd.extend(["--device", device])
+    return cmd
+
+def quantized_model_path(model):
+    """Where the int8 CPU build of a model is written, e.g. model_best.pt -> model_best_int8.pt"""
+    root, ext = os.path.splitext(model)
+    return f"{root}_int8{ext if ext else '.pt'}"
+
+def inference_model(args):
+    """Model passed to remora infer: the quantised build when --quantized is set"""
+    return quantized_model_path(args.model) if args.quantized else args.model
+
+def quantize_model(args):
+    """Convert the trained model to a dynamic int8 model for CPU inference"""
+    cmd = [
+        sys.executable, script_path("quantize_model.py"),
+        str(args.model), quantized_model_path(args.model)
+    ]
+    if run_command(cmd, "quantize") != 0:
+        print("Quantisation failed!")
+        return False
+    return True
+
+def shard_bam(bam, num_shards, shard_dir, label):
+    """Split a BAM into read-ID shards; every record of a read lands in the same shard"""
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = [os.path.join(shard_dir, f"{label}.shard{i}.bam") for i in range(num_shards)]
+    with pysam.AlignmentFile(bam, "rb", check_sq=False) as bam_in:
+        writers = [pysam.AlignmentFile(path, "wb", template=bam_in) for path in shard_paths]
+        try:
+            for read in bam_in:
+                writers[zlib.crc32(read.query_name.encode()) % num_shards].write(read)
+        finally:
+            for writer in writers:
+                writer.close()
+    return shard_paths
+
+# Working directory for the read-ID shards of sharded inference
+INFER_SHARD_DIR = "infer_shards"
+
+def run_infer_jobs(infer_jobs, args, pool=None):
+    """Run inference jobs across the requested devices, sharding each BAM if asked"""
+    if pool is None:
+        pool = DevicePool(parse_devices(args.devices), args.jobs_per_device)
+    jobs = []
+    merges = []
+    # Shard BAMs are a second copy of the inputs; they are removed however the run ends
+    shard_inputs = []
+    try:
+        for infer_job in infer_jobs:
+            pod5 = pod5_input(args, infer_job.pod5, infer_job.bam)
+            if args.infer_shards > 1:
+                shard_dir = os.path.join(INFER_SHARD_DIR, infer_job.label)
+                print(f"[{infer_job.label}] Splitting {infer_job.bam} into {args.infer_shards} read-ID shards")
+                shard_bams = shard_bam(infer_job.bam, args.infer_shards, shard_dir, infer_job.label)
+                shard_inputs.extend(shard_bams)
+                shard_outs = []
+                shard_logs = []
+                for index, shard in enumerate(shard_bams):
+                    out_bam = os.path.join(shard_dir, f"{infer_job.label}.shard{index}_infer.bam")
+                    log_filename = os.path.join(shard_dir, f"{infer_job.label}.shard{index}_infer.log")
+                    shard_outs.append(out_bam)
+                    shard_logs.append(log_filename)
+                    jobs.append((f"{infer_job.label}.shard{index}", InferJob(
+                        f"{infer_job.label}.shard{index}", pod5, shard, out_bam, log_filename
+                    )))
+                merges.append((infer_job, shard_dir, shard_outs, shard_logs))
+            else:
+                jobs.append((infer_job.label, InferJob(
+                    infer_job.label, pod5, infer_job.bam, infer_job.out_bam, infer_job.log_filename
+                )))
+        
+        def make_runner(job):
+            def run_on_device(device):
+                cmd = infer_command(job.pod5, job.bam, inference_model(args), job.out_bam, job.log_filename, device)
+                return run_command(cmd, f"{job.label}@{device}")
+            return lambda: pool.run(run_on_device)
+        
+        failures = run_jobs_parallel([(label, make_runner(job)) for label, job in jobs], pool.size)
+        if failures:
+            return False
+        
+        # Shards of one BAM share a header, so their outputs can be concatenated directly
+        for infer_job, shard_dir, shard_outs, shard_logs in merges:
+            try:
+                pysam.cat("-o", infer_job.out_bam, *shard_outs)
+            except pysam.SamtoolsError as e:
+                print(f"Failed to merge shards into {infer_job.out_bam}: {e}")
+                return False
+            with open(infer_job.log_filename, 'w') as log_out:
+                for shard_log in shard_logs:
+                    if os.path.exists(shard_log):
+                        log_out.write(f"==> {os.path.basename(shard_log)} <==\n")
+                        with open(shard_log) as log_in:
+                            shutil.copyfileobj(log_in, log_out)
+            print(f"Merged {len(shard_outs)} shards into {infer_job.out_bam}")
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        
+        return True
+    finally:
+        # A failed run keeps its shard logs and outputs for inspection, but not the input copies
+        for path in shard_inputs:
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(INFER_SHARD_DIR)
+        except OSError:
+            pass
+
+def infer_jobs_multi_g(args):
+    """Inference jobs for multiple G positions"""
+    infer_jobs = []
+    if args.report:
+        # Canonical inference gives the report its negative set
+        infer_jobs.append(InferJob("can", args.pod5, args.can_bam, "can_infer.bam", "can_infer.log"))
+    for g_pos in args.g_positions:
+        pod5_path = g_pos.pod5 if g_pos.pod5 else args.pod5
+        infer_jobs.append(InferJob(
+            g_pos.g_type, pod5_path, g_pos.mod_bam,
+            f"{g_pos.g_type}_infer.bam", f"{g_pos.g_type}_infer.log"
+        ))
+    return infer_jobs
+
+def infer_jobs_single_g(args):
+    """Inference jobs for single G position (original functionality)"""
+    return [
+        # Canonical inference
+        InferJob("can", args.pod5, args.can_bam, "can_infer.bam", "can_infer.log"),
+        # Modified inference
+        InferJob("mod", args.pod5, args.mod_bam, "mod_infer.bam", "mod_infer.log")
     ]
-    run_command(" ".join(mod_cmd))
+
+def dataset_infer_multi_g(args):
+    """Perform inference for multiple G positions"""
+    return run_infer_jobs(infer_jobs_multi_g(args), args)
+
+def dataset_infer_single_g(args):
+    """Perform inference for single G position (original functionality)"""
+    return run_infer_jobs(infer_jobs_single_g(args), args)
 
 def dataset_plotting(args):
     cmd = [
@@ -279,13 +801,111 @@ def dataset_plotting(args):
         "--pod5-and-bam", str(args.can_pod5), str(args.can_sort_bam),
         "--pod5-and-bam", str(args.mod_pod5), str(args.mod_sort_bam),
         "--ref-regions", "stationaryfiles/focus_reference_positionscan.bed",
-        "--highlight-ranges", f"stationaryfiles/focus_reference_positions{args.g_type}.bed",
+        "--highlight-ranges", default_focus_bed(args.g_type),
         "--refine-kmer-level-table", "stationaryfiles/levels.txt",
         "--refine-rough-rescale",
         "--log-filename", "plot.log"
     ]
-    run_command(" ".join(cmd))
+    if run_command(cmd, "plot") != 0:
+        print("Plotting failed!")
+        return False
     print("Plotting completed!")
+    return True
+
+def report_sets(args):
+    """(label, modified inference BAM, focus BED) for each set compared against can_infer.bam"""
+    if args.mode == "single":
+        return [(args.g_type, "mod_infer.bam", default_focus_bed(args.g_type))]
+    return [(g.g_type, f"{g.g_type}_infer.bam", focus_bed_path(g)) for g in args.g_positions]
+
+def dataset_report(args):
+    """Per-position modification rates and canonical-vs-modified ROC/PR"""
+    cmd = [
+        sys.executable, script_path("mod_report.py"),
+        "--canonical", "can_infer.bam",
+        "--output-dir", args.report_dir,
+        "--workers", str(args.report_workers)
+    ]
+    for label, bam, bed in report_sets(args):
+        cmd.extend(["--modified", label, bam, bed])
+    if run_command(cmd, "report") != 0:
+        print("Report failed!")
+        return False
+    print("Report completed!")
+    return True
+
+STAGE_KINDS = ["prepare", "plot", "configure", "train", "infer", "report"]
+
+def chunk_dirs(args):
+    """Chunk folders written by the prepare stage"""
+    if args.mode == "single":
+        return [chunk_folder(args, "can_all_chunks"), chunk_folder(args, f"8oxo{args.g_type}_chunks")]
+    return ([chunk_folder(args, f"can_{g.g_type}_chunks") for g in args.g_positions]
+            + [chunk_folder(args, f"8oxo{g.g_type}_chunks") for g in args.g_positions])
+
+def build_stages(args):
+    """Express the requested pipeline as stages with their dependencies, inputs and outputs"""
+    stages = []
+    
+    prepare = dataset_prepare_single_g if args.mode == "single" else dataset_prepare_multi_g
+    stages.append(Stage("prepare", lambda: prepare(args), outputs=chunk_dirs(args)))
+    
+    # Plotting reads the sorted BAMs directly, so it can overlap dataset preparation
+    if args.plot:
+        stages.append(Stage(
+            "plot", lambda: dataset_plotting(args),
+            inputs=[args.can_sort_bam, args.mod_sort_bam]
+        ))
+    
+    if args.train:
+        if args.registry:
+            configure = lambda: dataset_configure_registry(args)
+        elif args.mode == "single":
+            configure = lambda: dataset_configure_single_g(args)
+        else:
+            configure = lambda: dataset_configure_multi_g(args)
+        stages.append(Stage(
+            "configure", configure, deps=["prepare"],
+            inputs=chunk_dirs(args), outputs=["train_dataset.jsn"]
+        ))
+        stages.append(Stage(
+            "train", (lambda: dataset_sweep(args)) if args.sweep else (lambda: dataset_train(args)), deps=["configure"],
+            inputs=["train_dataset.jsn"],
+            outputs=[os.path.join("sweeps", args.sweep_name, "leaderboard.csv")] if args.sweep
+            else ["train_runs" if args.registry else "train_results"]
+        ))
+    
+    # Each inference job only needs its own BAM and the model
+    if args.infer:
+        infer_deps = ["train"] if args.train else []
+        # Quantise once before any inference job starts; it counts as part of the infer stage
+        if args.quantized:
+            stages.append(Stage(
+                "quantize", lambda: quantize_model(args), kind="infer", deps=infer_deps,
+                inputs=[args.model], outputs=[quantized_model_path(args.model)]
+            ))
+            infer_deps = ["quantize"]
+        pool = DevicePool(parse_devices(args.devices), args.jobs_per_device)
+        infer_jobs = infer_jobs_single_g(args) if args.mode == "single" else infer_jobs_multi_g(args)
+        for infer_job in infer_jobs:
+            stages.append(Stage(
+                f"infer_{infer_job.label}",
+                lambda infer_job=infer_job: run_infer_jobs([infer_job], args, pool),
+                kind="infer",
+                deps=infer_deps,
+                inputs=[infer_job.bam],
+                outputs=[infer_job.out_bam]
+            ))
+    
+    if args.report:
+        infer_stages = [stage.name for stage in stages if stage.kind == "infer"]
+        stages.append(Stage(
+            "report", lambda: dataset_report(args), deps=infer_stages,
+            inputs=["can_infer.bam"] + [bam for _, bam, _ in report_sets(args)],
+            outputs=[os.path.join(args.report_dir, "summary.json")]
+        ))
+    
+    return stages
 
 def parse_g_positions(g_positions_str):
     """Parse G positions from string format"""
@@ -315,12 +935,39 @@ def main():
     parser.add_argument("--motif", help="Motif sequence (e.g., TTAGGG)")
     parser.add_argument("--mod-num", type=int, help="Which base is modified (0 represents the first letter)")
     parser.add_argument("--mod-bam", help="Path to modified BAM file")
-    parser.add_argument("--g-type", choices=["G29", "G30", "G31", "G35"], help="Which G is modified")
+    parser.add_argument("--g-type", help="Which G is modified (e.g., G29, the 29th reference base)")
     
     # Required arguments for multi mode
     parser.add_argument("--g-positions", help="Comma-separated G positions with format: G29:TTAGGG:3:/path/to/bam,G30:TTAGGG:4:/path/to/bam")
     parser.add_argument("--dataset-weights", nargs='+', type=int, 
                        help="Dataset weights for canonical and modified chunks (e.g., 16 16 16 1 1 1 1)")
+    parser.add_argument("--auto-weights", action="store_true",
+                       help="Compute dataset weights from the prepared chunk counts instead of using --dataset-weights")
+    parser.add_argument("--target-ratio", default="1:1",
+                       help="Canonical:modified sampling ratio used by --auto-weights (default: 1:1)")
+    parser.add_argument("--prepare-jobs", type=int, default=1,
+                       help="Number of remora dataset prepare jobs to run concurrently")
+    parser.add_argument("--prepare-shards", type=int, default=1,
+                       help="Split each prepare BAM into this many read-ID shards, prepare them in parallel and merge the chunks")
+    parser.add_argument("--pod5-subset", choices=["symlink", "filter"],
+                       help="Give remora only the pod5 data of each BAM's reads: symlink the pod5 files that hold them, "
+                            "or filter the reads into a new pod5 (default: pass the whole --pod5 path)")
+    parser.add_argument("--pod5-index-dir", default=pod5_index.DEFAULT_INDEX_DIR,
+                       help=f"Where read-ID indexes of pod5 directories are kept (default: {pod5_index.DEFAULT_INDEX_DIR})")
+    parser.add_argument("--trust-existing-chunks", action="store_true",
+                       help="Adopt chunk folders prepared before the chunk manifest existed instead of re-preparing them")
+    parser.add_argument("--registry", nargs='?', const=chunk_registry.DEFAULT_REGISTRY,
+                       help="Grow the training set incrementally: register this run's chunk folders under --source "
+                            f"and train on every registered folder (default file: {chunk_registry.DEFAULT_REGISTRY})")
+    parser.add_argument("--source", help="With --registry, the flowcell/run this run's BAMs come from, e.g. Flongle_68")
+    parser.add_argument("--finetune-previous", action="store_true",
+                       help="With --registry, start training from the last registered model instead of from scratch")
+    parser.add_argument("--resumable", action="store_true",
+                       help="Train in checkpointed segments that resume where an interrupted job stopped (see train_resume.py)")
+    parser.add_argument("--wall-time", help="With --resumable, this job's wall limit as in #BSUB -W, e.g. 24:00; "
+                                            "training stops cleanly before it")
+    parser.add_argument("--chain-script",
+                       help="With --resumable and --wall-time, job script submitted to continue training after this job ends")
     
     # Optional arguments
     parser.add_argument("--plot", action="store_true", help="Generate plots")
@@ -329,9 +976,39 @@ def main():
     parser.add_argument("--can-sort-bam", help="Path to canonical sorted BAM file for plotting")
     parser.add_argument("--mod-sort-bam", help="Path to modified sorted BAM file for plotting")
     parser.add_argument("--train", action="store_true", help="Train a model")
+    parser.add_argument("--sweep", help="With --train, sweep training over this JSON search space (see sweep_train.py)")
+    parser.add_argument("--sweep-name", default="sweep", help="Sweep name; trials go in sweeps/<name> (default: sweep)")
     parser.add_argument("--infer", action="store_true", help="Perform inference")
     parser.add_argument("--model", help="Path to model for inference")
     parser.add_argument("--chunk-context", type=int, default=50, help="Chunk context for training")
+    parser.add_argument("--devices", "--device", default="0",
+                       help="Comma-separated inference devices, e.g. 0,1 for two GPUs or cpu")
+    parser.add_argument("--quantized", action="store_true",
+                       help="Infer with a dynamic int8 build of --model (requires --device cpu)")
+    parser.add_argument("--jobs-per-device", type=int, default=1,
+                       help="Number of inference jobs to run on each device at once")
+    parser.add_argument("--from-stage", choices=STAGE_KINDS,
+                       help="Resume from this stage; earlier stages are treated as done")
+    parser.add_argument("--until-stage", choices=STAGE_KINDS,
+                       help="Stop after this stage")
+    parser.add_argument("--report", action="store_true",
+                       help="Summarise per-position modification rates and canonical-vs-modified ROC/PR")
+    parser.add_argument("--report-dir", default="report", help="Directory for the report (default: report)")
+    parser.add_argument("--report-workers", type=int, default=1,
+                       help="Processes used to decode inference BAMs for the report")
+    parser.add_argument("--reference", default=reference_index.DEFAULT_REFERENCE,
+                       help=f"Reference FASTA used to check G positions (default: {reference_index.DEFAULT_REFERENCE})")
+    parser.add_argument("--contig", default=reference_index.DEFAULT_CONTIG,
+                       help=f"Reference contig the G positions are on (default: {reference_index.DEFAULT_CONTIG})")
+    parser.add_argument("--skip-reference-check", action="store_true",
+                       help="Do not check G positions against the reference or generate missing focus BEDs")
+    parser.add_argument("--infer-shards", type=int, default=1,
+                       help="Split each inference BAM into this many read-ID shards and run them in parallel")
+    parser.add_argument("--command-timeout", type=float, default=None,
+                       help="Stop any remora or helper command still running after this many seconds (default: no limit)")
+    parser.add_argument("--echo-interval", type=float, default=command_executor.ECHO_INTERVAL,
+                       help="Seconds between console echoes of command output; the full output is in "
+                            f"remora_logs/commands (default: {command_executor.ECHO_INTERVAL:g})")
     
     args = parser.parse_args()
     
@@ -346,6 +1023,31 @@ def main():
         if not args.g_positions:
             parser.error("Failed to parse G positions. Use format: G29:TTAGGG:3:/path/to/bam,G30:TTAGGG:4:/path/to/bam")
     
+    # Catch a G position that is not the stated motif base before any chunks are prepared
+    if not args.skip_reference_check:
+        g_positions = args.g_positions if args.mode == "multi" else [GPosition(args.g_type, args.motif, args.mod_num, args.mod_bam)]
+        try:
+            reference_errors = check_reference_positions(g_positions, args.reference, args.contig)
+        except ValueError as e:
+            parser.error(str(e))
+        if reference_errors:
+            parser.error("G positions do not match the reference:\n  " + "\n  ".join(reference_errors))
+    
+    if args.prepare_jobs < 1 or args.prepare_shards < 1:
+        parser.error("--prepare-jobs and --prepare-shards must be at least 1")
+    
+    if args.prepare_shards > 1 and pysam is None:
+        parser.error("--prepare-shards requires pysam")
+    
+    if args.pod5_subset and (pysam is None or pod5_index.pod5 is None):
+        parser.error("--pod5-subset requires pysam and pod5")
+    
+    if args.auto_weights:
+        try:
+            chunk_stats.parse_ratio(args.target_ratio)
+        except ValueError as e:
+            parser.error(str(e))
+    
     # Sanitize paths
     if args.mode == "single":
         args.pod5 = sanitize_path(args.pod5)
@@ -367,39 +1069,96 @@ def main():
         args.can_sort_bam = sanitize_path(args.can_sort_bam)
         args.mod_sort_bam = sanitize_path(args.mod_sort_bam)
     
+    if args.registry:
+        if not args.source or not re.fullmatch(r"[\w.-]+", args.source):
+            parser.error("--registry requires --source NAME (letters, digits, '.', '_' or '-')")
+        if args.dataset_weights or args.auto_weights:
+            parser.error("--registry weights the registered datasets itself; set the balance with --target-ratio")
+    
+    if args.finetune_previous and not (args.registry and args.train):
+        parser.error("--finetune-previous requires --registry and --train")
+    
+    if (args.wall_time or args.chain_script) and not args.resumable:
+        parser.error("--wall-time and --chain-script require --resumable")
+    
+    if args.resumable and not args.train:
+        parser.error("--resumable requires --train")
+    
+    if args.resumable and args.sweep:
+        parser.error("--resumable trains one model; it cannot be combined with --sweep")
+    
+    if args.wall_time:
+        try:
+            train_resume.parse_wall_time(args.wall_time)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    if args.chain_script and not os.path.exists(args.chain_script):
+        parser.error(f"Chain script not found: {args.chain_script}")
+    
+    if args.sweep and not args.train:
+        parser.error("--sweep requires --train")
+    
+    if args.sweep and not os.path.exists(args.sweep):
+        parser.error(f"Search space file not found: {args.sweep}")
+    
     if args.infer and not args.model:
         parser.error("--infer requires --model")
     
+    if args.report_workers < 1:
+        parser.error("--report-workers must be at least 1")
+    
+    if args.infer_shards < 1 or args.jobs_per_device < 1:
+        parser.error("--infer-shards and --jobs-per-device must be at least 1")
+    
+    if args.infer and args.infer_shards > 1 and pysam is None:
+        parser.error("--infer-shards requires pysam")
+    
+    if args.quantized and any(d != "cpu" for d in parse_devices(args.devices)):
+        parser.error("--quantized models only run on the CPU; use --device cpu")
+    
+    if args.command_timeout is not None and args.command_timeout <= 0:
+        parser.error("--command-timeout must be positive")
+    
     if args.model:
         args.model = sanitize_path(args.model)
     
     # Log parameters
-    log_parameters(args)
+    job_id, timestamp = log_parameters(args)
     
-    # Dataset preparation
-    if args.mode == "single":
-        dataset_prepare_single_g(args)
-    else:
-        dataset_prepare_multi_g(args)
+    # Record per-command resource usage alongside the remora_runs.csv row
+    global metrics
+    metrics_file = run_metrics.metrics_path("remora_logs", job_id, timestamp)
+    metrics = run_metrics.RunMetrics(metrics_file, job_id, timestamp)
     
-    # Plotting
-    if args.plot:
-        dataset_plotting(args)
+    # Full command output goes to one log per command; the console gets a rate-limited echo
+    global executor
+    command_log_dir = os.path.join("remora_logs", "commands", f"{job_id}_{timestamp}")
+    executor = command_executor.Executor(command_log_dir, args.echo_interval, timeout=args.command_timeout,
+                                         on_result=record_result)
+    # Stages run commands from worker threads, which a Ctrl-C does not interrupt
+    executor.cancel_on_interrupt()
     
-    # Training
-    if args.train:
-        if args.mode == "single":
-            dataset_configure_single_g(args.g_type)
-        else:
-            dataset_configure_multi_g(args)
-        dataset_train(args)
+    # Run the pipeline stages, independent branches in parallel
+    try:
+        runner = PipelineRunner(build_stages(args), STAGE_KINDS)
+        status = runner.run(args.from_stage, args.until_stage)
+    except PipelineError as e:
+        print(f"Pipeline error: {e}")
+        metrics.close("error")
+        sys.exit(1)
     
-    # Inference
-    if args.infer:
-        if args.mode == "single":
-            dataset_infer_single_g(args)
-        else:
-            dataset_infer_multi_g(args)
+    print("=== Pipeline summary ===")
+    for name, state in status.items():
+        print(f"{name}: {state}")
+        metrics.record_stage(name, state, runner.timings.get(name, 0.0))
+    
+    failed = any(state in ("failed", "blocked") for state in status.values())
+    metrics.close("failed" if failed else "done")
+    print(f"Metrics written to {metrics_file}")
+    print(f"Command logs written to {command_log_dir}")
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
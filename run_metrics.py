@@ -0,0 +1,243 @@
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+# Seconds between nvidia-smi samples
+GPU_SAMPLE_INTERVAL = 10
+
+# Headroom added on top of the largest observed usage when recommending resources
+SAFETY_MARGIN = 1.25
+
+def wait_with_usage(process):
+    """Wait for a Popen child and return (return code, resource usage of the child)"""
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+class GpuSampler:
+    """Polls nvidia-smi in the background; does nothing on nodes without it"""
+    def __init__(self, interval=GPU_SAMPLE_INTERVAL, on_sample=None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.samples = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.available = shutil.which("nvidia-smi") is not None
+
+    def start(self):
+        if self.available:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            sample = self._sample()
+            if sample is not None:
+                with self.lock:
+                    self.samples.append(sample)
+                if self.on_sample is not None:
+                    self.on_sample(sample)
+            self.stop_event.wait(self.interval)
+
+    def _sample(self):
+        try:
+            output = subprocess.run(
+                ["nvidia-smi", "--query-gpu=index,utilization.gpu,memory.used",
+                 "--format=csv,noheader,nounits"],
+                capture_output=True, text=True, timeout=30
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            return None
+        gpus = []
+        for line in output.strip().splitlines():
+            fields = [f.strip() for f in line.split(',')]
+            if len(fields) == 3 and all(f.isdigit() for f in fields):
+                gpus.append({"index": int(fields[0]), "util_pct": int(fields[1]), "mem_mib": int(fields[2])})
+        return {"time": time.time(), "gpus": gpus} if gpus else None
+
+    def summarise(self, start, end):
+        """Mean/max utilisation and peak memory per GPU between two timestamps"""
+        with self.lock:
+            window = [s for s in self.samples if start <= s["time"] <= end]
+        if not window:
+            return None
+        per_gpu = {}
+        for sample in window:
+            for gpu in sample["gpus"]:
+                per_gpu.setdefault(gpu["index"], []).append(gpu)
+        return {
+            str(index): {
+                "mean_util_pct": round(sum(g["util_pct"] for g in gpus) / len(gpus), 1),
+                "max_util_pct": max(g["util_pct"] for g in gpus),
+                "max_mem_mib": max(g["mem_mib"] for g in gpus)
+            }
+            for index, gpus in per_gpu.items()
+        }
+
+class RunMetrics:
+    """Appends per-command and per-stage measurements to a JSON-lines metrics file"""
+    def __init__(self, path, job_id, timestamp, sample_gpus=True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.job_id = job_id
+        self.timestamp = timestamp
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.gpu_sampler = GpuSampler(on_sample=lambda s: self.write({"type": "gpu_sample", **s}))
+        if sample_gpus:
+            self.gpu_sampler.start()
+
+    def write(self, entry):
+        entry = {"job_id": self.job_id, "timestamp": self.timestamp, "pid": self.pid, **entry}
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def record_command(self, label, command, return_code, start, end, usage):
+        self.write({
+            "type": "command",
+            "label": label,
+            "step": " ".join(command.split()[:3]),
+            "command": command,
+            "return_code": return_code,
+            "start": start,
+            "end": end,
+            "wall_s": round(end - start, 3),
+            "user_cpu_s": round(usage.ru_utime, 3),
+            "sys_cpu_s": round(usage.ru_stime, 3),
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            "gpu": self.gpu_sampler.summarise(start, end)
+        })
+
+    def record_stage(self, name, status, wall_s):
+        self.write({"type": "stage", "name": name, "status": status, "wall_s": round(wall_s, 3)})
+
+    def close(self, status):
+        self.gpu_sampler.stop()
+        self.write({"type": "job", "status": status, "wall_s": round(time.time() - self.start_time, 3)})
+
+def metrics_path(log_dir, job_id, timestamp, pid=None):
+    """Metrics file for the remora_runs.csv row with this JobID and Timestamp"""
+    # Timestamps have one-second resolution and local runs share the "local" JobID,
+    # so the PID keeps runs started together out of each other's files
+    pid = os.getpid() if pid is None else pid
+    return Path(log_dir) / "metrics" / f"{job_id}_{timestamp}_{pid}.jsonl"
+
+def load_metrics(paths):
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    return entries
+
+def peak_concurrent_rss(commands):
+    """Largest sum of peak RSS over commands whose run times overlap (an upper bound)"""
+    events = []
+    for c in commands:
+        events.append((c["start"], 1, c["max_rss_mb"]))
+        events.append((c["end"], 0, c["max_rss_mb"]))
+    # Ends sort before starts at the same instant
+    events.sort()
+    current = 0
+    peak = 0
+    for _, is_start, rss in events:
+        current = current + rss if is_start else current - rss
+        peak = max(peak, current)
+    return peak
+
+def summarise(entries):
+    """Per-step statistics plus walltime/memory recommendations for the next submission"""
+    jobs = {}
+    for entry in entries:
+        key = (entry.get("job_id"), entry.get("timestamp"), entry.get("pid"))
+        jobs.setdefault(key, []).append(entry)
+
+    steps = {}
+    job_walls = []
+    job_memory = []
+    for job_entries in jobs.values():
+        commands = [e for e in job_entries if e["type"] == "command"]
+        for c in commands:
+            steps.setdefault(c["step"], []).append(c)
+        job_records = [e for e in job_entries if e["type"] == "job"]
+        if job_records:
+            job_walls.append(max(e["wall_s"] for e in job_records))
+        elif commands:
+            job_walls.append(max(c["end"] for c in commands) - min(c["start"] for c in commands))
+        if commands:
+            job_memory.append(peak_concurrent_rss(commands))
+
+    step_summary = {}
+    for step, commands in sorted(steps.items()):
+        gpu_peaks = [g["max_mem_mib"] for c in commands if c.get("gpu") for g in c["gpu"].values()]
+        step_summary[step] = {
+            "runs": len(commands),
+            "max_wall_s": max(c["wall_s"] for c in commands),
+            "mean_wall_s": round(sum(c["wall_s"] for c in commands) / len(commands), 1),
+            "max_cpu_s": max(c["user_cpu_s"] + c["sys_cpu_s"] for c in commands),
+            "max_rss_mb": max(c["max_rss_mb"] for c in commands),
+            "max_gpu_mem_mib": max(gpu_peaks) if gpu_peaks else None
+        }
+
+    recommendation = None
+    if job_walls:
+        # Round walltime up to the next half hour and memory up to the next GB
+        wall_minutes = math.ceil(max(job_walls) * SAFETY_MARGIN / 1800) * 30
+        memory_gb = max(1, math.ceil(max(job_memory, default=0) * SAFETY_MARGIN / 1024))
+        recommendation = {
+            "walltime": f"{wall_minutes // 60:02d}:{wall_minutes % 60:02d}",
+            "memory": f"{memory_gb}GB"
+        }
+
+    return {"jobs": len(jobs), "steps": step_summary, "recommendation": recommendation}
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise remora run metrics and recommend LSF resources")
+    parser.add_argument("metrics", nargs="*",
+                        help="Metrics files to summarise (default: every file in remora_logs/metrics)")
+    parser.add_argument("--log-dir", default="remora_logs", help="Directory containing the metrics folder")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    args = parser.parse_args()
+
+    paths = args.metrics if args.metrics else sorted(glob.glob(os.path.join(args.log_dir, "metrics", "*.jsonl")))
+    if not paths:
+        print("No metrics files found.")
+        return
+
+    summary = summarise(load_metrics(paths))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"Summarised {summary['jobs']} job(s)")
+    for step, stats in summary["steps"].items():
+        gpu = f", GPU mem {stats['max_gpu_mem_mib']} MiB" if stats["max_gpu_mem_mib"] is not None else ""
+        print(f"  {step}: {stats['runs']} run(s), max wall {stats['max_wall_s']:.0f}s, "
+              f"max CPU {stats['max_cpu_s']:.0f}s, max RSS {stats['max_rss_mb']:.0f} MB{gpu}")
+    if summary["recommendation"]:
+        print("Recommended for the next submission:")
+        print(f"#BSUB -W {summary['recommendation']['walltime']}")
+        print(f"#BSUB -M {summary['recommendation']['memory']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,49 @@
-import subprocess
 import os
 import argparse
+import shlex
 import shutil
+import sys
 from pathlib import Path
 
-def run_command(command):
-    """Execute a shell command and return the return code"""
-    print(f"Running: {command}")
-    
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+# The command executor is shared with the remora scripts one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import command_executor
+
+# CIGAR operation codes for insertions and deletions
+CIGAR_INS = 1
+CIGAR_DEL = 2
+
+# BAM flag for unmapped reads
+FLAG_UNMAPPED = 4
+
+# samtools output is short, so it is echoed in full rather than logged
+executor = command_executor.Executor()
+
+def run_command(cmd):
+    """Run an argument list without a shell and return the return code"""
     # Check if samtools is available in the environment
-    if command.startswith("samtools") and shutil.which("samtools") is None:
+    if cmd[0] == "samtools" and shutil.which("samtools") is None:
+        print(f"Running: {shlex.join(cmd)}")
         print("Error: samtools is not available in the PATH. Make sure it's installed and loaded.")
         return 127
     
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-        env=os.environ.copy()  # Use current environment variables
-    )
-    
-    # Print output in real-time
-    for line in iter(process.stdout.readline, ''):
-        print(line.strip())
-    
-    process.stdout.close()
-    return_code = process.wait()
+    return_code = executor.run(cmd).return_code
     
-    if return_code != 0:
-        print(f"Command failed with return code {return_code}")
-        
-        # Check for common errors
-        if return_code == 127:
-            print("This error typically indicates missing libraries or executables.")
-            print("Try loading required modules with 'module load samtools' and 'module load openssl'")
+    # Check for common errors
+    if return_code == 127:
+        print("This error typically indicates missing libraries or executables.")
+        print("Try loading required modules with 'module load samtools' and 'module load openssl'")
     
     return return_code
 
-def filter_bam(input_bam, output_bam, min_mapq=0, remove_unmapped=False, remove_map0=False, min_length=None, remove_indels=False):
+def filter_bam(input_bam, output_bam, min_mapq=0, remove_unmapped=False, remove_map0=False, min_length=None, remove_indels=False, threads=4, engine="auto"):
     """
-    Filter BAM file based on mapping quality, mapping status, and read length.
+    Filter BAM file based on mapping quality, mapping status, read length and indels.
     
     Args:
         input_bam (str): Path to input BAM file
@@ -52,6 +53,8 @@ def filter_bam(input_bam, output_bam, min_mapq=0, remove_unmapped=False, remove_
         remove_map0 (bool): Whether to remove reads with mapping quality 0 (default: False)
         min_length (int or None): Minimum read length to keep (default: None)
         remove_indels (bool): Whether to remove reads with insertions or deletions (default: False)
+        threads (int): Number of BGZF compression/decompression threads (default: 4)
+        engine (str): "pysam", "samtools", or "auto" to use pysam when it is installed (default: "auto")
     """
     # Validate input file exists
     if not os.path.exists(input_bam):
@@ -62,46 +65,80 @@ def filter_bam(input_bam, output_bam, min_mapq=0, remove_unmapped=False, remove_
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # If removing indels, use the special awk-based command
-    if remove_indels:
-        cmd = f"samtools view -h {input_bam} | awk 'BEGIN{{OFS=\"\\t\"}} /^@/ {{print $0}} !/^@/ && $6 !~ /[ID]/ {{print $0}}' | samtools view -b -o {output_bam}"
-        return_code = run_command(cmd)
-        
-        if return_code == 0:
-            print(f"Successfully filtered BAM file (removed indels). Output written to: {output_bam}")
-            return True
-        else:
-            print(f"Failed to filter BAM file. Return code: {return_code}")
+    # mapq=0 removal is the same as requiring mapq >= 1
+    if remove_map0:
+        min_mapq = max(min_mapq, 1)
+    
+    if engine == "auto":
+        engine = "pysam" if pysam is not None else "samtools"
+    
+    if engine == "pysam":
+        if pysam is None:
+            print("Error: pysam is not installed. Install it with 'pip install pysam' or use --engine samtools.")
             return False
+        return filter_bam_pysam(input_bam, output_bam, min_mapq, remove_unmapped, min_length, remove_indels, threads)
+    
+    return filter_bam_samtools(input_bam, output_bam, min_mapq, remove_unmapped, min_length, remove_indels, threads)
+
+def filter_bam_pysam(input_bam, output_bam, min_mapq, remove_unmapped, min_length, remove_indels, threads):
+    """Apply every filter in a single pass over the binary BAM records"""
+    print(f"Filtering {input_bam} with pysam ({threads} threads)")
+    total = 0
+    kept = 0
+    
+    try:
+        with pysam.AlignmentFile(input_bam, "rb", check_sq=False, threads=threads) as bam_in, \
+                pysam.AlignmentFile(output_bam, "wb", template=bam_in, threads=threads) as bam_out:
+            for read in bam_in:
+                total += 1
+                
+                # Cheapest checks first: flag and mapping quality are fixed-width fields
+                if remove_unmapped and read.flag & FLAG_UNMAPPED:
+                    continue
+                if min_mapq > 0 and read.mapping_quality < min_mapq:
+                    continue
+                if min_length is not None and read.query_length < min_length:
+                    continue
+                if remove_indels and read.cigartuples and any(op == CIGAR_INS or op == CIGAR_DEL for op, _ in read.cigartuples):
+                    continue
+                
+                bam_out.write(read)
+                kept += 1
+    except (OSError, ValueError) as e:
+        print(f"Failed to filter BAM file: {e}")
+        return False
     
-    # Build samtools view command for other filters
-    cmd = ["samtools view -b"]
+    print(f"Kept {kept} of {total} reads")
+    print(f"Successfully filtered BAM file. Output written to: {output_bam}")
+    return True
+
+def filter_bam_samtools(input_bam, output_bam, min_mapq, remove_unmapped, min_length, remove_indels, threads):
+    """Apply every filter in a single samtools view call"""
+    cmd = ["samtools", "view", "-b", "-@", str(threads)]
     
     # Add mapping quality filter
     if min_mapq > 0:
-        cmd.append(f"-q {min_mapq}")
+        cmd.extend(["-q", str(min_mapq)])
     
     # Add unmapped filter
     if remove_unmapped:
-        cmd.append("-F 4")  # -F 4 excludes unmapped reads
-    
-    # Add mapq=0 filter
-    if remove_map0:
-        cmd.append("-q 1")  # -q 1 excludes mapq=0 reads
+        cmd.extend(["-F", "4"])  # -F 4 excludes unmapped reads
     
-    # Add minimum read length filter
+    # Read length and indel filters share one filter expression
+    expressions = []
     if min_length is not None:
-        cmd.append(f"-e 'rlen > {min_length}'")
+        # Stored SEQ length, like pysam's query_length; qlen counts CIGAR query bases
+        expressions.append(f"length(seq) >= {min_length}")
+    if remove_indels:
+        expressions.append('!(cigar =~ "[ID]")')
+    if expressions:
+        cmd.extend(["-e", " && ".join(expressions)])
     
     # Add input and output files
-    cmd.append(input_bam)
-    cmd.append(f"> {output_bam}")
-    
-    # Join command parts
-    full_cmd = " ".join(cmd)
+    cmd.extend(["-o", output_bam, input_bam])
     
     # Run the command
-    return_code = run_command(full_cmd)
+    return_code = run_command(cmd)
     
     if return_code == 0:
         print(f"Successfully filtered BAM file. Output written to: {output_bam}")
@@ -111,7 +148,7 @@ def filter_bam(input_bam, output_bam, min_mapq=0, remove_unmapped=False, remove_
         return False
 
 def main():
-    parser = argparse.ArgumentParser(description="Filter BAM files using samtools")
+    parser = argparse.ArgumentParser(description="Filter BAM files using pysam or samtools")
     parser.add_argument("--input", required=True, help="Input BAM file path")
     parser.add_argument("--output", required=True, help="Output BAM file path")
     parser.add_argument("--min-mapq", type=int, default=0, help="Minimum mapping quality score (default: 0)")
@@ -119,6 +156,9 @@ def main():
     parser.add_argument("--remove-map0", action="store_true", help="Remove reads with mapping quality 0")
     parser.add_argument("--min-length", type=int, default=None, help="Minimum read length to keep (optional)")
     parser.add_argument("--remove-indels", action="store_true", help="Remove reads with insertions or deletions")
+    parser.add_argument("--threads", type=int, default=4, help="Number of BGZF compression/decompression threads (default: 4)")
+    parser.add_argument("--engine", choices=["auto", "pysam", "samtools"], default="auto",
+                        help="Filtering engine: pysam streams records in one pass, samtools shells out to samtools view (default: auto)")
     
     args = parser.parse_args()
     
@@ -130,7 +170,9 @@ def main():
         remove_unmapped=args.remove_unmapped,
         remove_map0=args.remove_map0,
         min_length=args.min_length,
-        remove_indels=args.remove_indels
+        remove_indels=args.remove_indels,
+        threads=args.threads,
+        engine=args.engine
     )
     
     if not success:
@@ -0,0 +1,99 @@
+import torch
+from torch import nn
+
+from remora import constants
+
+
+def swish(x):
+    # Same as remora.activations.swish, written out so torch.jit.script can inline it
+    return x * torch.sigmoid(x)
+
+
+def fold_batchnorm(conv, bn):
+    """Fold an eval-mode BatchNorm1d into the Conv1d that feeds it (in place)"""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    conv.weight.mul_(scale.reshape(-1, 1, 1))
+    conv.bias.copy_((conv.bias - bn.running_mean) * scale + bn.bias)
+
+
+class network(nn.Module):
+    """Inference variant of ConvLSTM_w_ref.network
+
+    Takes the same constructor arguments and state_dict, so a checkpoint trained
+    with ConvLSTM_w_ref.py loads directly. Call fuse() after loading to fold each
+    BatchNorm into its convolution.
+
+    The original runs lstm2 over the time-reversed sequence and keeps the last
+    step of the re-flipped output, which is the reverse LSTM's state after its
+    first step. That only depends on the final lstm1 output, so lstm2 is run on
+    that single step instead of the whole flipped sequence.
+    """
+    _variable_width_possible = False
+
+    def __init__(
+        self,
+        size=constants.DEFAULT_NN_SIZE,
+        kmer_len=constants.DEFAULT_KMER_LEN,
+        num_out=2,
+    ):
+        super().__init__()
+        self.sig_conv1 = nn.Conv1d(1, 4, 5)
+        self.sig_bn1 = nn.BatchNorm1d(4)
+        self.sig_conv2 = nn.Conv1d(4, 16, 5)
+        self.sig_bn2 = nn.BatchNorm1d(16)
+        self.sig_conv3 = nn.Conv1d(16, size, 9, 3)
+        self.sig_bn3 = nn.BatchNorm1d(size)
+
+        self.seq_conv1 = nn.Conv1d(kmer_len * 4, 16, 5)
+        self.seq_bn1 = nn.BatchNorm1d(16)
+        self.seq_conv2 = nn.Conv1d(16, size, 13, 3)
+        self.seq_bn2 = nn.BatchNorm1d(size)
+
+        self.merge_conv1 = nn.Conv1d(size * 2, size, 5)
+        self.merge_bn = nn.BatchNorm1d(size)
+        self.lstm1 = nn.LSTM(size, size, 1)
+        self.lstm2 = nn.LSTM(size, size, 1)
+
+        self.fc = nn.Linear(size, num_out)
+
+        self.dropout = nn.Dropout(p=0.3)
+
+    @torch.no_grad()
+    def fuse(self):
+        """Fold every BatchNorm into its convolution; the model must be in eval mode"""
+        pairs = (
+            ("sig_conv1", "sig_bn1"),
+            ("sig_conv2", "sig_bn2"),
+            ("sig_conv3", "sig_bn3"),
+            ("seq_conv1", "seq_bn1"),
+            ("seq_conv2", "seq_bn2"),
+            ("merge_conv1", "merge_bn"),
+        )
+        for conv_name, bn_name in pairs:
+            bn = getattr(self, bn_name)
+            if isinstance(bn, nn.BatchNorm1d):
+                fold_batchnorm(getattr(self, conv_name), bn)
+                setattr(self, bn_name, nn.Identity())
+        self.eval()
+        return self
+
+    def forward(self, sigs, seqs):
+        # inputs are BFT (batch, feature, time)
+        sigs_x = swish(self.sig_bn1(self.sig_conv1(sigs)))
+        sigs_x = swish(self.sig_bn2(self.sig_conv2(sigs_x)))
+        sigs_x = swish(self.sig_bn3(self.sig_conv3(sigs_x)))
+
+        seqs_x = swish(self.seq_bn1(self.seq_conv1(seqs)))
+        seqs_x = swish(self.seq_bn2(self.seq_conv2(seqs_x)))
+
+        z = torch.cat((sigs_x, seqs_x), 1)
+
+        z = swish(self.merge_bn(self.merge_conv1(z)))
+        z = z.permute(2, 0, 1)
+        z = swish(self.lstm1(z)[0])
+        # Reverse-direction lstm2 output at the last time step: one step from a zero state
+        z = swish(self.lstm2(z[-1:])[0][0])
+
+        z = self.fc(z)
+
+        return z
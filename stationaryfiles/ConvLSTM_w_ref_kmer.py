@@ -0,0 +1,116 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from remora import constants
+from remora.activations import swish
+
+# Bases per k-mer position in the one-hot encoding
+ENCODING_LEN = 4
+
+
+def kmer_bases_to_one_hot(kmers):
+    """The kmer_len * 4 channel encoding remora builds, from (batch, kmer_len, time) base codes"""
+    batch, kmer_len, width = kmers.shape
+    codes = kmers.long()
+    one_hot = F.one_hot(codes.clamp(min=0), ENCODING_LEN) * (codes >= 0).unsqueeze(-1)
+    return one_hot.permute(0, 1, 3, 2).reshape(batch, kmer_len * ENCODING_LEN, width).float()
+
+
+class network(nn.Module):
+    """ConvLSTM_w_ref.network that also takes compact k-mer input
+
+    seqs may be the usual float (batch, kmer_len * 4, time) one-hot encoding or
+    integer base codes of shape (batch, kmer_len, time): 0-3 for A, C, G, T and
+    -1 where a k-mer position has no base (the all-zero columns of the one-hot
+    encoding). Integer input is never expanded: seq_conv1 is applied as a sum of
+    embedding lookups into its own weights, so the parameters, state_dict and
+    outputs are those of ConvLSTM_w_ref.py and its checkpoints load unchanged.
+    """
+    _variable_width_possible = False
+    _compact_kmers_possible = True
+
+    def __init__(
+        self,
+        size=constants.DEFAULT_NN_SIZE,
+        kmer_len=constants.DEFAULT_KMER_LEN,
+        num_out=2,
+    ):
+        super().__init__()
+        self.kmer_len = kmer_len
+        self.encoding_len = ENCODING_LEN
+        self.sig_conv1 = nn.Conv1d(1, 4, 5)
+        self.sig_bn1 = nn.BatchNorm1d(4)
+        self.sig_conv2 = nn.Conv1d(4, 16, 5)
+        self.sig_bn2 = nn.BatchNorm1d(16)
+        self.sig_conv3 = nn.Conv1d(16, size, 9, 3)
+        self.sig_bn3 = nn.BatchNorm1d(size)
+
+        self.seq_conv1 = nn.Conv1d(kmer_len * 4, 16, 5)
+        self.seq_bn1 = nn.BatchNorm1d(16)
+        self.seq_conv2 = nn.Conv1d(16, size, 13, 3)
+        self.seq_bn2 = nn.BatchNorm1d(size)
+
+        self.merge_conv1 = nn.Conv1d(size * 2, size, 5)
+        self.merge_bn = nn.BatchNorm1d(size)
+        self.lstm1 = nn.LSTM(size, size, 1)
+        self.lstm2 = nn.LSTM(size, size, 1)
+
+        self.fc = nn.Linear(size, num_out)
+
+        self.dropout = nn.Dropout(p=0.3)
+
+    def kmer_conv1(self, kmers):
+        """seq_conv1 of the one-hot encoding of integer k-mer base codes, without building it"""
+        batch, kmer_len, width = kmers.shape
+        out_channels = self.seq_conv1.out_channels
+        kernel = self.seq_conv1.kernel_size[0]
+        out_width = width - kernel + 1
+        # Row 5 * position + base holds that input channel's weight for one kernel tap;
+        # row 5 * position + 4 stays zero for positions without a base
+        weight = self.seq_conv1.weight.reshape(out_channels, kmer_len, self.encoding_len, kernel)
+        tables = F.pad(weight.permute(3, 1, 2, 0), (0, 0, 0, 1))
+
+        # Index of each (time, position) row; the int8 codes are transposed before widening
+        codes = kmers.permute(0, 2, 1).contiguous()
+        codes = codes.masked_fill(codes < 0, self.encoding_len).int()
+        offsets = torch.arange(kmer_len, device=kmers.device, dtype=torch.int32) * (self.encoding_len + 1)
+        codes += offsets
+
+        # One gather per tap over the time steps it reads, accumulated in place, so the
+        # largest temporaries are one tap's term and window of indices
+        out = torch.zeros(batch * out_width, out_channels, dtype=weight.dtype, device=kmers.device)
+        for tap in range(kernel):
+            table = tables[tap].reshape(kmer_len * (self.encoding_len + 1), out_channels)
+            window = codes[:, tap:tap + out_width].reshape(batch * out_width, kmer_len)
+            out += F.embedding_bag(window, table, mode="sum")
+        out = out.reshape(batch, out_width, out_channels)
+        bias = self.seq_conv1.bias
+        if bias is not None:
+            out = out + bias
+        return out.permute(0, 2, 1)
+
+    def forward(self, sigs, seqs):
+        # inputs are BFT (batch, feature, time)
+        sigs_x = swish(self.sig_bn1(self.sig_conv1(sigs)))
+        sigs_x = swish(self.sig_bn2(self.sig_conv2(sigs_x)))
+        sigs_x = swish(self.sig_bn3(self.sig_conv3(sigs_x)))
+
+        if seqs.is_floating_point():
+            seqs_x = self.seq_conv1(seqs)
+        else:
+            seqs_x = self.kmer_conv1(seqs)
+        seqs_x = swish(self.seq_bn1(seqs_x))
+        seqs_x = swish(self.seq_bn2(self.seq_conv2(seqs_x)))
+
+        z = torch.cat((sigs_x, seqs_x), 1)
+
+        z = swish(self.merge_bn(self.merge_conv1(z)))
+        z = z.permute(2, 0, 1)
+        z = swish(self.lstm1(z)[0])
+        z = torch.flip(swish(self.lstm2(torch.flip(z, (0,)))[0]), (0,))
+        z = z[-1].permute(0, 1)
+
+        z = self.fc(z)
+
+        return z
@@ -107,3 +107,6 @@ remora -v
 
 
 
+
+# To process many flowcells/barcodes in this one allocation (see instructions/README_multi_g.md)
+# python batch_runs.py runs.tsv
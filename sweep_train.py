@@ -0,0 +1,468 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import re
+import shlex
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MODEL = "stationaryfiles/ConvLSTM_w_ref.py"
+
+# Values tried when the search space leaves a parameter out; None keeps remora's default
+DEFAULT_SPACE = {
+    "chunk_context": [50],
+    "size": [64],
+    "lr": [None],
+    "dataset_weights": [None],
+}
+
+LEADERBOARD_FIELDS = ["rank", "trial", "status", "best_val_acc", "best_epoch", "val_loss_at_best", "epochs",
+                      "chunk_context", "size", "lr", "dataset_weights", "model"]
+
+print_lock = threading.Lock()
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+def parse_list(value, cast):
+    return [cast(x) for x in value.split(',') if x.strip()]
+
+def load_space(path=None, overrides=None):
+    """
+    Search space from a JSON file plus command-line overrides.
+
+    Each parameter is a list of values, or for random search a
+    {"uniform": [low, high]} or {"log_uniform": [low, high]} range.
+    dataset_weights values are lists with one weight per chunk folder.
+    """
+    space = dict(DEFAULT_SPACE)
+    if path:
+        with open(path) as f:
+            loaded = json.load(f)
+        unknown = set(loaded) - set(DEFAULT_SPACE)
+        if unknown:
+            raise ValueError(f"Unknown search space parameters: {', '.join(sorted(unknown))}")
+        space.update(loaded)
+    space.update({k: v for k, v in (overrides or {}).items() if v is not None})
+    return space
+
+def sample_value(values, rng):
+    if isinstance(values, dict):
+        if "uniform" in values:
+            low, high = values["uniform"]
+            return float(f"{rng.uniform(low, high):.3g}")
+        if "log_uniform" in values:
+            low, high = values["log_uniform"]
+            return float(f"{math.exp(rng.uniform(math.log(low), math.log(high))):.3g}")
+        raise ValueError(f"Unknown range {values}; use uniform or log_uniform")
+    return rng.choice(values)
+
+def grid_trials(space):
+    """Every combination of the listed values"""
+    for name, values in space.items():
+        if isinstance(values, dict):
+            raise ValueError(f"Grid search needs a list of values for {name}, not a range")
+    names = list(space)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(space[n] for n in names))]
+
+def random_trials(space, num_trials, seed=0):
+    """num_trials distinct random draws; the same seed always gives the same trials"""
+    rng = random.Random(seed)
+    trials = []
+    seen = set()
+    # Stop when the space has no unseen combinations left
+    for _ in range(num_trials * 100):
+        if len(trials) == num_trials:
+            break
+        params = {name: sample_value(values, rng) for name, values in space.items()}
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            trials.append(params)
+    return trials
+
+def read_validation_log(path):
+    """(epoch, accuracy, loss) for each validation-set row of a remora validation.log"""
+    history = []
+    if not os.path.exists(path):
+        return history
+    with open(path) as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        for row in reader:
+            try:
+                if row["Val_Type"] == "val":
+                    history.append((int(row["Epoch"]), float(row["Accuracy"]), float(row["Loss"])))
+            except (KeyError, TypeError, ValueError):
+                # The last line may still be being written
+                continue
+    return history
+
+def best_by_epoch(history):
+    """Best validation accuracy reached by each epoch"""
+    best = {}
+    running = -math.inf
+    for epoch, acc, _ in history:
+        running = max(running, acc)
+        best[epoch] = running
+    return best
+
+class Trial:
+    """One training run of the sweep and where its outputs live"""
+    def __init__(self, index, params, sweep_dir):
+        self.index = index
+        self.params = params
+        self.name = f"trial_{index:03d}"
+        self.dir = os.path.join(sweep_dir, self.name)
+        self.output_path = os.path.join(self.dir, "train_results")
+        self.status = "pending"
+        self.process = None
+        self.stop_requested = False
+        # Status recorded for a trial stopped before it finished
+        self.stop_status = "pruned"
+
+    @property
+    def validation_log(self):
+        return os.path.join(self.output_path, "validation.log")
+
+    @property
+    def status_path(self):
+        return os.path.join(self.dir, "status.json")
+
+    def history(self):
+        return read_validation_log(self.validation_log)
+
+    def load_status(self):
+        """Finished status from an earlier run of the same sweep, or None"""
+        if not os.path.exists(self.status_path):
+            return None
+        with open(self.status_path) as f:
+            saved = json.load(f)
+        if saved.get("params") != self.params:
+            raise ValueError(f"{self.dir} was run with different parameters; use a new --name")
+        return saved.get("status")
+
+    def save_status(self):
+        with open(self.status_path, 'w') as f:
+            json.dump({"trial": self.name, "status": self.status, "params": self.params}, f, indent=2)
+
+    def summary(self):
+        history = self.history()
+        result = {
+            "trial": self.name,
+            "status": self.status,
+            "epochs": history[-1][0] if history else 0,
+            "best_val_acc": None,
+            "best_epoch": None,
+            "val_loss_at_best": None,
+            **{k: (" ".join(map(str, v)) if isinstance(v, list) else v) for k, v in self.params.items()},
+            "model": None,
+        }
+        if history:
+            epoch, acc, loss = max(history, key=lambda h: (h[1], -h[0]))
+            result.update(best_val_acc=round(acc, 6), best_epoch=epoch, val_loss_at_best=round(loss, 6))
+            model = os.path.join(self.output_path, "model_best.pt")
+            result["model"] = model if os.path.exists(model) else None
+        return result
+
+def make_config(trial, chunk_dirs, base_config):
+    """Dataset config for a trial: its own weights over the shared chunk folders, or the base config"""
+    weights = trial.params.get("dataset_weights")
+    if weights is None:
+        return base_config
+    if len(weights) != len(chunk_dirs):
+        raise ValueError(f"{trial.name}: {len(weights)} dataset weights for {len(chunk_dirs)} chunk folders")
+    config = os.path.join(trial.dir, "train_dataset.jsn")
+    cmd = ["remora", "dataset", "make_config", config, *chunk_dirs,
+           "--dataset-weights", *[str(w) for w in weights],
+           "--log-filename", os.path.join(trial.dir, "train_dataset.log")]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{trial.name}: make_config failed: {result.stdout}{result.stderr}")
+    return config
+
+def train_command(trial, config, model_file, device, epochs=None, extra_args=()):
+    cmd = [
+        "remora", "model", "train", config,
+        "--model", model_file,
+        "--chunk-context", str(trial.params["chunk_context"]), str(trial.params["chunk_context"]),
+        "--size", str(trial.params["size"]),
+        "--output-path", trial.output_path,
+        "--overwrite",
+    ]
+    if trial.params.get("lr") is not None:
+        cmd.extend(["--lr", str(trial.params["lr"])])
+    if epochs is not None:
+        cmd.extend(["--epochs", str(epochs)])
+    if device is not None:
+        cmd.extend(["--device", f"cuda:{device}" if device.isdigit() else device])
+    return cmd + list(extra_args)
+
+def lsf_command(trial, cmd, queue_name, cores, gpus, memory):
+    """Wrap a training command in a blocking bsub so the slot stays taken until the job ends"""
+    bsub = ["bsub", "-K", "-J", f"sweep_{trial.name}", "-n", str(cores),
+            "-o", os.path.join(trial.dir, "lsf.out"), "-e", os.path.join(trial.dir, "lsf.err")]
+    if queue_name:
+        bsub.extend(["-q", queue_name])
+    if gpus:
+        bsub.extend(["-gpu", f"num={gpus}"])
+    if memory:
+        bsub.extend(["-M", memory])
+    return bsub + cmd
+
+class Sweep:
+    """Run trials on a fixed number of slots and stop the ones clearly behind their peers"""
+    def __init__(self, trials, args, chunk_dirs):
+        self.trials = trials
+        self.args = args
+        self.chunk_dirs = chunk_dirs
+        self.lock = threading.Lock()
+        self.slots = queue.Queue()
+        if args.lsf:
+            for _ in range(args.max_concurrent):
+                self.slots.put(None)
+        else:
+            devices = [d.strip() for d in args.devices.split(',') if d.strip()] or ["0"]
+            for _ in range(args.jobs_per_device):
+                for device in devices:
+                    self.slots.put(device)
+            if args.max_concurrent:
+                while self.slots.qsize() > args.max_concurrent:
+                    self.slots.get()
+        self.size = self.slots.qsize()
+        self.done = threading.Event()
+
+    def run_trial(self, trial):
+        device = self.slots.get()
+        try:
+            if self.done.is_set():
+                return
+            os.makedirs(trial.dir, exist_ok=True)
+            config = make_config(trial, self.chunk_dirs, self.args.base_config)
+            extra = shlex.split(self.args.train_args) if self.args.train_args else []
+            cmd = train_command(trial, config, self.args.model, "cuda:0" if self.args.lsf else device,
+                                self.args.epochs, extra)
+            if self.args.lsf:
+                cmd = lsf_command(trial, cmd, self.args.queue, self.args.lsf_cores, self.args.lsf_gpus, self.args.lsf_memory)
+            log(f"[{trial.name}] Starting on {'LSF' if self.args.lsf else device}: {trial.params}")
+            with open(os.path.join(trial.dir, "train.out"), 'w') as out:
+                # Own process group, so stopping a trial also stops its data loader workers
+                process = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT, start_new_session=True)
+                with self.lock:
+                    trial.process = process
+                    trial.status = "running"
+                if self.done.is_set():
+                    # Started just as the sweep was interrupted
+                    self.stop(trial, "interrupted", "interrupted")
+                return_code = process.wait()
+            with self.lock:
+                if trial.stop_requested:
+                    trial.status = trial.stop_status
+                else:
+                    trial.status = "done" if return_code == 0 else "failed"
+                trial.process = None
+            trial.save_status()
+            best = trial.summary()["best_val_acc"]
+            log(f"[{trial.name}] {trial.status} (best val acc {best if best is not None else 'n/a'})")
+        except (OSError, RuntimeError, ValueError) as e:
+            trial.status = "failed"
+            trial.save_status()
+            log(f"[{trial.name}] failed: {e}")
+        finally:
+            self.slots.put(device)
+            self.write_leaderboard()
+
+    def stop(self, trial, reason, status="pruned"):
+        with self.lock:
+            if trial.process is None or trial.stop_requested:
+                return
+            trial.stop_requested = True
+            trial.stop_status = status
+            process = trial.process
+        log(f"[{trial.name}] Stopping early: {reason}")
+        if self.args.lsf:
+            job_id = lsf_job_id(os.path.join(trial.dir, "train.out"))
+            if job_id:
+                subprocess.run(["bkill", job_id], capture_output=True)
+                return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def prune(self):
+        """
+        Median stopping rule: once a trial has run --prune-after epochs, stop it if its best
+        validation accuracy is more than --prune-margin below the median of its peers at the
+        same epoch. Peers are the other trials that have reached that epoch.
+        """
+        curves = {t.name: best_by_epoch(t.history()) for t in self.trials if t.status in ("running", "done", "pruned")}
+        for trial in self.trials:
+            if trial.status != "running" or trial.stop_requested:
+                continue
+            curve = curves.get(trial.name)
+            if not curve:
+                continue
+            epoch = max(curve)
+            if epoch < self.args.prune_after:
+                continue
+            peers = [c[epoch] for name, c in curves.items() if name != trial.name and epoch in c]
+            if len(peers) < self.args.prune_min_peers:
+                continue
+            median = statistics.median(peers)
+            if curve[epoch] < median - self.args.prune_margin:
+                self.stop(trial, f"best val acc {curve[epoch]:.4f} at epoch {epoch} vs peer median {median:.4f}")
+
+    def monitor(self):
+        while not self.done.wait(self.args.poll_interval):
+            try:
+                self.prune()
+            except OSError as e:
+                log(f"Early-stopping check failed: {e}")
+
+    def write_leaderboard(self):
+        rows = [t.summary() for t in self.trials if t.status != "pending"]
+        # Finished trials first, then by best validation accuracy
+        rows.sort(key=lambda r: (r["best_val_acc"] is None, -(r["best_val_acc"] or 0), r["trial"]))
+        path = os.path.join(self.args.sweep_dir, "leaderboard.csv")
+        with self.lock:
+            with open(f"{path}.tmp", 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=LEADERBOARD_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                for rank, row in enumerate(rows, 1):
+                    writer.writerow({"rank": rank, **row})
+            os.replace(f"{path}.tmp", path)
+        return path, rows
+
+    def run(self):
+        pending = []
+        for trial in self.trials:
+            status = trial.load_status()
+            if status in ("done", "pruned"):
+                trial.status = status
+                log(f"[{trial.name}] Already {status}; skipping")
+            else:
+                pending.append(trial)
+        monitor = None
+        if self.args.prune_after > 0:
+            monitor = threading.Thread(target=self.monitor, daemon=True)
+            monitor.start()
+        executor = ThreadPoolExecutor(max_workers=self.size)
+        try:
+            list(executor.map(self.run_trial, pending))
+        except KeyboardInterrupt:
+            # Trials run in their own sessions, so Ctrl-C reaches them only through stop();
+            # this has to happen before waiting for their threads
+            self.done.set()
+            for trial in self.trials:
+                self.stop(trial, "interrupted", "interrupted")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown()
+            self.done.set()
+            if monitor is not None:
+                monitor.join()
+        return self.write_leaderboard()
+
+def lsf_job_id(path):
+    """Job ID from the 'Job <123> is submitted' line bsub prints"""
+    try:
+        with open(path) as f:
+            match = re.search(r"Job <(\d+)> is submitted", f.read())
+    except OSError:
+        return None
+    return match.group(1) if match else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep remora training over chunk context, dataset weights, model size and learning rate")
+    parser.add_argument("--chunk-dirs", nargs='+', required=True,
+                        help="Prepared chunk folders shared by every trial, in --dataset-weights order")
+    parser.add_argument("--space", help="JSON search space, e.g. {\"chunk_context\": [25, 50], \"lr\": {\"log_uniform\": [1e-4, 1e-2]}}")
+    parser.add_argument("--chunk-contexts", type=lambda v: parse_list(v, int), help="Comma-separated chunk contexts (overrides --space)")
+    parser.add_argument("--sizes", type=lambda v: parse_list(v, int), help="Comma-separated model sizes (overrides --space)")
+    parser.add_argument("--lrs", type=lambda v: parse_list(v, float), help="Comma-separated learning rates (overrides --space)")
+    parser.add_argument("--dataset-weights", nargs='+', type=lambda v: [int(w) for w in v.split()],
+                        help="Weight sets to try, each quoted, e.g. \"16 16 16 1 1 1 1\" \"8 8 8 1 1 1 1\" (overrides --space)")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid", help="Search strategy (default: grid)")
+    parser.add_argument("--num-trials", type=int, default=8, help="Trials for random search (default: 8)")
+    parser.add_argument("--seed", type=int, default=0, help="Random search seed (default: 0)")
+    parser.add_argument("--name", default="sweep", help="Sweep name; trials go in sweeps/<name> (default: sweep)")
+    parser.add_argument("--base-config", default="train_dataset.jsn",
+                        help="Dataset config for trials without their own weights (default: train_dataset.jsn)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"Model architecture file (default: {DEFAULT_MODEL})")
+    parser.add_argument("--epochs", type=int, help="Epochs per trial (default: remora's default)")
+    parser.add_argument("--train-args", help="Extra arguments for remora model train, e.g. \"--batch-size 512\"")
+    parser.add_argument("--devices", "--device", default="0", help="Comma-separated devices for local trials (default: 0)")
+    parser.add_argument("--jobs-per-device", type=int, default=1, help="Trials to run on each device at once (default: 1)")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="Trials running at once (default: one per device slot; required with --lsf)")
+    parser.add_argument("--lsf", action="store_true", help="Submit each trial as its own LSF job with bsub")
+    parser.add_argument("--queue", help="LSF queue for --lsf")
+    parser.add_argument("--lsf-cores", type=int, default=8, help="Cores per LSF trial (default: 8)")
+    parser.add_argument("--lsf-gpus", type=int, default=1, help="GPUs per LSF trial (default: 1)")
+    parser.add_argument("--lsf-memory", default="32GB", help="Memory limit per LSF trial (default: 32GB)")
+    parser.add_argument("--prune-after", type=int, default=5,
+                        help="Epochs before a trial can be stopped early; 0 disables early stopping (default: 5)")
+    parser.add_argument("--prune-margin", type=float, default=0.01,
+                        help="Accuracy below the peer median at which a trial is stopped (default: 0.01)")
+    parser.add_argument("--prune-min-peers", type=int, default=2,
+                        help="Other trials that must have reached the same epoch before stopping one (default: 2)")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between early-stopping checks (default: 60)")
+
+    args = parser.parse_args()
+
+    if args.lsf and not args.max_concurrent:
+        parser.error("--lsf requires --max-concurrent")
+    if args.jobs_per_device < 1 or (args.max_concurrent is not None and args.max_concurrent < 1):
+        parser.error("--jobs-per-device and --max-concurrent must be at least 1")
+    if not os.path.exists(args.model):
+        parser.error(f"Model file not found: {args.model}")
+
+    try:
+        space = load_space(args.space, {
+            "chunk_context": args.chunk_contexts,
+            "size": args.sizes,
+            "lr": args.lrs,
+            "dataset_weights": args.dataset_weights,
+        })
+        params = grid_trials(space) if args.search == "grid" else random_trials(space, args.num_trials, args.seed)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if None in space["dataset_weights"] and not os.path.exists(args.base_config):
+        parser.error(f"Trials without dataset weights use {args.base_config}, which does not exist")
+
+    args.sweep_dir = os.path.join("sweeps", args.name)
+    os.makedirs(args.sweep_dir, exist_ok=True)
+    with open(os.path.join(args.sweep_dir, "sweep.json"), 'w') as f:
+        json.dump({"space": space, "search": args.search, "seed": args.seed,
+                   "chunk_dirs": args.chunk_dirs, "trials": params}, f, indent=2)
+
+    trials = [Trial(index, p, args.sweep_dir) for index, p in enumerate(params)]
+    sweep = Sweep(trials, args, args.chunk_dirs)
+    log(f"Running {len(trials)} trials, {sweep.size} at a time")
+    try:
+        path, rows = sweep.run()
+    except ValueError as e:
+        print(f"Sweep failed: {e}")
+        sys.exit(1)
+
+    print(f"Leaderboard written to {path}")
+    for rank, row in enumerate(rows[:5], 1):
+        acc = f"{row['best_val_acc']:.4f}" if row["best_val_acc"] is not None else "n/a"
+        print(f"  {rank}. {row['trial']} ({row['status']}): val acc {acc}, chunk_context {row['chunk_context']}, "
+              f"size {row['size']}, lr {row['lr']}, weights {row['dataset_weights']}")
+    if any(t.status == "failed" for t in trials):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_runs
+
+def write_manifest(path, rows):
+    with open(path, 'w') as f:
+        f.write("name\tstep\targs\tdepends\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+@pytest.mark.parametrize("rows", [
+    [("a", "shell", "true", "b"), ("b", "shell", "true", "a")],
+    [("a", "shell", "true", "a")],
+])
+def test_dependency_cycle_is_rejected(tmp_path, rows):
+    path = str(tmp_path / "manifest.tsv")
+    write_manifest(path, rows)
+    with pytest.raises(batch_runs.ManifestError, match="cycle"):
+        batch_runs.load_manifest(path)
+
+def test_rows_that_can_never_start_are_blocked(tmp_path):
+    # A cycle that slips past load_manifest must not leave the scheduler waiting forever
+    runs = [batch_runs.Run("a", "shell", "true", depends="b"), batch_runs.Run("b", "shell", "true", depends="a")]
+    status = batch_runs.StatusFile(str(tmp_path / "status.json"))
+    runner = batch_runs.BatchRunner(runs, batch_runs.ResourcePool(1, []), status, str(tmp_path / "logs"))
+    assert runner.run() == {"a": "blocked", "b": "blocked"}
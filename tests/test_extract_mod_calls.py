@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pysam = pytest.importorskip("pysam")
+pytest.importorskip("pyarrow")
+
+import extract_mod_calls
+
+def write_bam(path, reads):
+    """Write (name, cigar) reads that each call one C at query position 0 (ML 200)"""
+    header = {"HD": {"VN": "1.6"}, "SQ": [{"SN": "wtreference", "LN": 1000}]}
+    with pysam.AlignmentFile(path, "wb", header=header) as bam:
+        for index, (name, cigar) in enumerate(reads):
+            read = pysam.AlignedSegment(bam.header)
+            read.query_name = name
+            read.query_sequence = "C" + "A" * 39
+            read.flag = 0
+            read.reference_id = 0
+            read.reference_start = 10 * index
+            read.mapping_quality = 60
+            read.cigarstring = cigar
+            read.set_tag("MM", "C+m?,0;")
+            read.set_tag("ML", [200])
+            bam.write(read)
+
+@pytest.mark.parametrize("output", ["calls.parquet", "calls.npz"])
+def test_first_read_without_calls_keeps_read_ids(tmp_path, output):
+    # read0's only call is on a soft-clipped base, so the batch's first call is read1's
+    bam_path = str(tmp_path / "infer.bam")
+    write_bam(bam_path, [("read0", "1S39M"), ("read1", "40M"), ("read2", "40M")])
+    output_path = str(tmp_path / output)
+
+    stats = extract_mod_calls.extract_calls(bam_path, output_path, batch_size=10)
+    calls = extract_mod_calls.load_calls(output_path)
+
+    assert stats["reads"] == 3
+    assert list(calls["read_id"]) == ["read1", "read2"]
+    assert list(calls["ref_pos"]) == [10, 20]
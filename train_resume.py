@@ -0,0 +1,370 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import command_executor
+import sweep_train
+
+STATE_FILE = "resume_state.json"
+
+# remora model train defaults the segment schedule is derived from
+DEFAULT_EPOCHS = 100
+DEFAULT_LR = 0.001
+ETA_MIN = 1e-6
+DEFAULT_EARLY_STOPPING = 10
+
+# Exit code when training stopped for the wall limit and a follow-up job will resume it (EX_TEMPFAIL)
+EXIT_RESUMABLE = 75
+
+CHECKPOINT_PATTERN = re.compile(r"model_(\d{6})\.(checkpoint|pt)$")
+
+def now():
+    return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def parse_wall_time(value):
+    """Seconds in an LSF -W limit: [HH:]MM, e.g. 24:00 or 90"""
+    parts = value.split(':')
+    if len(parts) > 2 or not all(p.isdigit() for p in parts):
+        raise ValueError(f"Wall time must look like HH:MM or MM, got {value}")
+    hours, minutes = (int(parts[0]), int(parts[1])) if len(parts) == 2 else (0, int(parts[0]))
+    return (hours * 60 + minutes) * 60
+
+def segment_checkpoints(segment_dir):
+    """{epochs completed: [files]} for the per-epoch model_NNNNNN.* files of a segment"""
+    checkpoints = {}
+    if os.path.isdir(segment_dir):
+        for name in os.listdir(segment_dir):
+            match = CHECKPOINT_PATTERN.match(name)
+            if match:
+                checkpoints.setdefault(int(match.group(1)), []).append(os.path.join(segment_dir, name))
+    return checkpoints
+
+def latest_checkpoint(segment_dir):
+    """(epochs completed, checkpoint path) of the newest per-epoch checkpoint, or (0, None)"""
+    checkpoints = segment_checkpoints(segment_dir)
+    for epoch in sorted(checkpoints, reverse=True):
+        path = os.path.join(segment_dir, f"model_{epoch:06d}.checkpoint")
+        if path in checkpoints[epoch]:
+            return epoch, path
+    return 0, None
+
+def prune_checkpoints(segment_dir, keep):
+    """Delete per-epoch checkpoints other than the one a later segment resumes from"""
+    for epoch, paths in segment_checkpoints(segment_dir).items():
+        if epoch != keep:
+            for path in paths:
+                os.remove(path)
+
+def cosine_lr(lr, epoch, total, eta_min=ETA_MIN):
+    """Learning rate of remora's default CosineAnnealingLR schedule after epoch of total epochs"""
+    return eta_min + (lr - eta_min) * (1 + math.cos(math.pi * min(epoch, total) / total)) / 2
+
+def lsf_submit_after(job_id, script):
+    """Submit script with bsub to start once job_id has ended; returns the new job ID or None"""
+    with open(script) as f:
+        result = subprocess.run(["bsub", "-w", f"ended({job_id})"], stdin=f, capture_output=True, text=True)
+    match = re.search(r"Job <(\d+)> is submitted", result.stdout)
+    return match.group(1) if match else None
+
+class ResumeState:
+    """
+    What a resumable training has done so far, kept in <output>/resume_state.json.
+
+    Each segment is one remora model train run in <output>/segment_NNN; its epochs
+    count from the global epoch it started at.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.config = None
+        self.segments = []
+        self.best = None
+        self.status = "new"
+        self.chained_job = None
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.config = data["config"]
+            self.segments = data["segments"]
+            self.best = data["best"]
+            self.status = data["status"]
+            self.chained_job = data.get("chained_job")
+
+    @property
+    def epochs_done(self):
+        return sum(segment["epochs"] for segment in self.segments)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"config": self.config, "segments": self.segments, "best": self.best,
+                       "status": self.status, "chained_job": self.chained_job}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+class ResumableTraining:
+    """
+    Train in segments that each resume from the previous segment's last checkpoint.
+
+    remora restores model weights from --finetune-path but not the optimiser or
+    epoch, so each segment trains only the remaining epochs and starts its cosine
+    schedule from the learning rate the full run would have reached. The best model
+    by validation accuracy across all segments is kept as <output>/model_best.pt.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.output_path = args.output_path
+        self.state = ResumeState(os.path.join(self.output_path, STATE_FILE))
+        self.executor = command_executor.Executor(self.output_path)
+        self.chain_timer = None
+
+    def config(self):
+        """Settings that must not change between segments of one training"""
+        return {
+            "dataset": os.path.abspath(self.args.dataset),
+            "model": os.path.abspath(self.args.model),
+            "chunk_context": self.args.chunk_context,
+            "epochs": self.args.epochs,
+            "lr": self.args.lr,
+            "size": self.args.size,
+        }
+
+    def segment_dir(self, index):
+        if index < len(self.state.segments):
+            return self.state.segments[index]["path"]
+        return os.path.join(self.output_path, f"segment_{index:03d}")
+
+    def reconcile(self):
+        """Account for a segment whose job was killed before it could record how far it got"""
+        if not self.state.segments:
+            # A plain remora run killed in this folder before resuming was set up
+            epochs, path = latest_checkpoint(self.output_path)
+            if path is not None:
+                self.state.segments.append({"path": self.output_path, "start_epoch": 0, "epochs": epochs,
+                                            "init_path": self.args.finetune_path, "status": "running"})
+                print(f"Found checkpoints of an earlier run in {self.output_path}; resuming after epoch {epochs}")
+        for index, segment in enumerate(self.state.segments):
+            if segment["status"] == "running":
+                segment["epochs"], _ = latest_checkpoint(self.segment_dir(index))
+                segment["status"] = "interrupted"
+                self.update_best(index)
+                prune_checkpoints(self.segment_dir(index), segment["epochs"])
+                print(f"Segment {index} was interrupted after {segment['epochs']} checkpointed epochs")
+
+    def update_best(self, index):
+        """Copy a segment's best model to the output folder if it beats every earlier segment"""
+        segment = self.state.segments[index]
+        history = sweep_train.read_validation_log(os.path.join(self.segment_dir(index), "validation.log"))
+        if not history:
+            return
+        epoch, acc, loss = max(history, key=lambda row: row[1])
+        best_pt = os.path.join(self.segment_dir(index), "model_best.pt")
+        if not os.path.exists(best_pt):
+            return
+        if self.state.best is not None and acc <= self.state.best["val_acc"]:
+            return
+        for name in ("model_best.pt", "model_best.checkpoint"):
+            source = os.path.join(self.segment_dir(index), name)
+            if os.path.exists(source) and self.segment_dir(index) != self.output_path:
+                shutil.copyfile(source, os.path.join(self.output_path, f"{name}.tmp"))
+                os.replace(os.path.join(self.output_path, f"{name}.tmp"), os.path.join(self.output_path, name))
+        self.state.best = {"val_acc": acc, "val_loss": loss, "epoch": segment["start_epoch"] + epoch, "segment": index}
+        print(f"New best model: val acc {acc:.4f} at epoch {self.state.best['epoch']} (segment {index})")
+
+    def segment_command(self, index, start_epoch, init_path):
+        args = self.args
+        remaining = args.epochs - start_epoch
+        cmd = [
+            *shlex.split(args.trainer), "model", "train",
+            args.dataset,
+            "--model", args.model,
+            "--device", args.device,
+            "--chunk-context", str(args.chunk_context), str(args.chunk_context),
+            "--output-path", self.segment_dir(index),
+            "--epochs", str(remaining),
+            "--save-freq", "1",
+            "--seed", str(self.state.config["seed"]),
+            "--lr", f"{cosine_lr(args.lr, start_epoch, args.epochs):.6g}",
+            "--lr-scheduler-kwargs", "T_max", str(remaining), "int",
+            "--lr-scheduler-kwargs", "eta_min", f"{ETA_MIN:g}", "float",
+        ]
+        if args.size is not None:
+            cmd.extend(["--size", str(args.size)])
+        if args.early_stopping:
+            # Patience carries over: epochs already spent without improvement count against it
+            since_best = start_epoch - (self.state.best["epoch"] if self.state.best else 0)
+            cmd.extend(["--early-stopping", str(max(1, args.early_stopping - since_best))])
+        if init_path:
+            cmd.extend(["--finetune-path", init_path])
+        return cmd + (shlex.split(args.train_args) if args.train_args else [])
+
+    def start_chain_timer(self, remaining):
+        """Submit the follow-up job chain_margin before the wall limit, unless one is queued"""
+        job_id = os.environ.get("LSB_JOBID")
+        if not (self.args.chain_script and job_id and remaining is not None) or self.state.chained_job:
+            return
+
+        def chain():
+            new_job = lsf_submit_after(job_id, self.args.chain_script)
+            if new_job is None:
+                print(f"Failed to submit a follow-up job from {self.args.chain_script}")
+                return
+            self.state.chained_job = new_job
+            self.state.save()
+            print(f"Submitted follow-up job {new_job} to resume training after job {job_id}")
+        self.chain_timer = threading.Timer(max(0, remaining - self.args.chain_margin * 60), chain)
+        self.chain_timer.daemon = True
+        self.chain_timer.start()
+
+    def finish(self, status):
+        self.state.status = status
+        self.state.save()
+        if self.chain_timer is not None:
+            self.chain_timer.cancel()
+        if status == "done" and self.state.chained_job:
+            # The follow-up job has nothing left to do
+            subprocess.run(["bkill", self.state.chained_job], capture_output=True)
+            self.state.chained_job = None
+            self.state.save()
+
+    def run(self):
+        """Train until done, the wall limit nears or remora fails; returns an exit code"""
+        args = self.args
+        os.makedirs(self.output_path, exist_ok=True)
+        config = self.config()
+        if self.state.config is not None and {k: v for k, v in self.state.config.items() if k != "seed"} != config:
+            print(f"{self.output_path} holds a training with different settings; use another --output-path")
+            return 1
+        if self.state.config is None:
+            self.state.config = dict(config, seed=args.seed if args.seed is not None else random.randrange(2 ** 31))
+        if self.state.status == "done":
+            print(f"Training in {self.output_path} is already complete (best val acc {self.state.best['val_acc']:.4f})")
+            return 0
+        # A job that starts from the chain is the follow-up, so nothing is queued any more
+        if self.state.chained_job == os.environ.get("LSB_JOBID"):
+            self.state.chained_job = None
+        self.reconcile()
+        self.state.save()
+
+        deadline = args.started + parse_wall_time(args.wall_time) if args.wall_time else None
+        remaining = deadline - time.time() if deadline is not None else None
+        self.start_chain_timer(remaining)
+
+        start_epoch = self.state.epochs_done
+        since_best = start_epoch - (self.state.best["epoch"] if self.state.best else 0)
+        if start_epoch >= args.epochs or (args.early_stopping and self.state.best and since_best >= args.early_stopping):
+            self.finish("done")
+            print(f"Training complete after {start_epoch} epochs")
+            return 0
+
+        index = len(self.state.segments)
+        if index > 0:
+            previous = self.segment_dir(index - 1)
+            _, init_path = latest_checkpoint(previous)
+            if init_path is None:
+                # Nothing was checkpointed since the previous resume point; go back to it
+                init_path = self.state.segments[-1].get("init_path")
+        else:
+            init_path = args.finetune_path
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time() - args.stop_margin * 60
+            if timeout <= 0:
+                print("Too little wall time left to train; leaving it to the follow-up job")
+                self.finish("paused")
+                return EXIT_RESUMABLE
+        self.state.segments.append({"path": self.segment_dir(index), "start_epoch": start_epoch, "epochs": 0, "init_path": init_path,
+                                    "status": "running", "started": now()})
+        self.state.save()
+        print(f"Segment {index}: epochs {start_epoch + 1}-{args.epochs}"
+              f"{' from ' + init_path if init_path else ''}")
+
+        result = self.executor.run(self.segment_command(index, start_epoch, init_path), f"train.segment{index:03d}",
+                                   timeout=timeout)
+        segment = self.state.segments[index]
+        if result.ok:
+            history = sweep_train.read_validation_log(os.path.join(self.segment_dir(index), "validation.log"))
+            segment["epochs"] = max((epoch for epoch, _, _ in history), default=0)
+            segment["status"] = "done"
+        else:
+            segment["epochs"], _ = latest_checkpoint(self.segment_dir(index))
+            segment["status"] = "paused" if result.timed_out else "failed"
+        segment["finished"] = now()
+        self.update_best(index)
+        prune_checkpoints(self.segment_dir(index), segment["epochs"])
+        if result.ok:
+            if os.path.exists(os.path.join(self.segment_dir(index), "model_final.pt")):
+                shutil.copyfile(os.path.join(self.segment_dir(index), "model_final.pt"),
+                                os.path.join(self.output_path, "model_final.pt"))
+            self.finish("done")
+            print(f"Training complete after {self.state.epochs_done} epochs; "
+                  f"best val acc {self.state.best['val_acc']:.4f} at epoch {self.state.best['epoch']}"
+                  if self.state.best else f"Training complete after {self.state.epochs_done} epochs")
+            return 0
+        if result.timed_out:
+            self.finish("paused")
+            follow_up = f"; job {self.state.chained_job} resumes it" if self.state.chained_job else ""
+            print(f"Stopped before the wall limit after {self.state.epochs_done} epochs{follow_up}")
+            return EXIT_RESUMABLE
+        self.finish("failed")
+        return result.return_code
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable remora training in checkpointed segments that chain across LSF jobs")
+    parser.add_argument("--dataset", default="train_dataset.jsn", help="Dataset config (default: train_dataset.jsn)")
+    parser.add_argument("--output-path", default="train_results", help="Training folder; rerun with the same path to resume (default: train_results)")
+    parser.add_argument("--model", default=sweep_train.DEFAULT_MODEL, help=f"Model definition (default: {sweep_train.DEFAULT_MODEL})")
+    parser.add_argument("--chunk-context", type=int, default=50, help="Chunk context on each side (default: 50)")
+    parser.add_argument("--device", default="cuda:0", help="Training device (default: cuda:0)")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS, help=f"Total epochs over all segments (default: {DEFAULT_EPOCHS})")
+    parser.add_argument("--lr", type=float, default=DEFAULT_LR, help=f"Initial learning rate (default: {DEFAULT_LR})")
+    parser.add_argument("--size", type=int, default=None, help="Model size (default: remora's)")
+    parser.add_argument("--early-stopping", type=int, default=DEFAULT_EARLY_STOPPING,
+                        help=f"Stop after this many epochs without improvement, counted across segments; 0 disables "
+                             f"(default: {DEFAULT_EARLY_STOPPING})")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed shared by every segment so they validate on the same chunks (default: random, then kept)")
+    parser.add_argument("--finetune-path", default=None, help="Checkpoint the first segment starts from")
+    parser.add_argument("--wall-time", default=None, help="Job wall limit as in #BSUB -W, e.g. 24:00 (default: none)")
+    parser.add_argument("--started", type=float, default=time.time(),
+                        help="Unix time the job started; the wall limit counts from here (default: now)")
+    parser.add_argument("--stop-margin", type=float, default=10,
+                        help="Minutes before the wall limit to stop training cleanly (default: 10)")
+    parser.add_argument("--chain-script", default=None,
+                        help="Job script submitted with bsub -w 'ended(<this job>)' to resume training (requires LSF)")
+    parser.add_argument("--chain-margin", type=float, default=30,
+                        help="Minutes before the wall limit to submit the follow-up job (default: 30)")
+    parser.add_argument("--trainer", default="remora",
+                        help="Command run as '<trainer> model train ...'; a stand-in such as "
+                             "'python train_standin.py' exercises resuming on the CPU (default: remora)")
+    parser.add_argument("--train-args", default=None, help="Extra arguments passed to every segment, e.g. \"--batch-size 512\"")
+
+    args = parser.parse_args()
+
+    try:
+        if args.wall_time:
+            parse_wall_time(args.wall_time)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.chain_script and not os.path.exists(args.chain_script):
+        parser.error(f"Chain script not found: {args.chain_script}")
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+
+    try:
+        return_code = ResumableTraining(args).run()
+    except (OSError, ValueError) as e:
+        print(f"Training failed: {e}")
+        sys.exit(1)
+    sys.exit(return_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+VALIDATION_HEADER = ("Val_Type\tEpoch\tIteration\tAccuracy\tConfusion_Matrix\tLoss\tNum_Calls\t"
+                     "Filtered_Fraction\tFiltered_Accuracy\tFiltered_Confusion_Matrix\tFiltered_Threshold\n")
+
+def accuracy_at(total_epoch, seed):
+    """Validation accuracy after total_epoch epochs: rises towards a plateau with a little noise"""
+    noise = random.Random(seed * 100003 + total_epoch).uniform(-0.004, 0.004)
+    return 0.97 - 0.2 * math.exp(-total_epoch / 8) + noise
+
+def write_checkpoint(path, state):
+    with open(path, 'w') as f:
+        json.dump(state, f)
+
+def main():
+    """
+    Stand in for 'remora model train' on the CPU.
+
+    Writes the same files (validation.log, model_NNNNNN.checkpoint/.pt every
+    --save-freq epochs, model_best.*, model_final.*) at --epoch-seconds per epoch.
+    Checkpoints are JSON and record the total epochs trained, so a run started
+    with --finetune-path continues the accuracy curve where the checkpoint left it.
+    Used to exercise train_resume.py without a GPU: python train_standin.py model train ...
+    """
+    if sys.argv[1:3] != ["model", "train"]:
+        print("Usage: train_standin.py model train DATASET [options]")
+        sys.exit(2)
+    parser = argparse.ArgumentParser(prog="train_standin.py model train")
+    parser.add_argument("dataset")
+    parser.add_argument("--output-path", default="remora_train_results")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--save-freq", type=int, default=10)
+    parser.add_argument("--early-stopping", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--finetune-path", default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--epoch-seconds", type=float, default=0.2, help="Time each epoch takes (default: 0.2)")
+    # Accepted for command-line compatibility with remora and otherwise ignored
+    parser.add_argument("--model")
+    parser.add_argument("--device")
+    parser.add_argument("--lr", type=float)
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--chunk-context", type=int, nargs=2)
+    parser.add_argument("--lr-scheduler-kwargs", nargs=3, action="append")
+    args = parser.parse_args(sys.argv[3:])
+
+    if os.path.exists(args.output_path) and not args.overwrite:
+        print(f"Refusing to overwrite {args.output_path}")
+        sys.exit(1)
+    os.makedirs(args.output_path, exist_ok=True)
+    trained = 0
+    if args.finetune_path:
+        with open(args.finetune_path) as f:
+            trained = json.load(f)["total_epochs"]
+        print(f"Loaded checkpoint after {trained} epochs from {args.finetune_path}")
+
+    best_acc = -1.0
+    since_best = 0
+    with open(os.path.join(args.output_path, "validation.log"), 'w') as val_log:
+        val_log.write(VALIDATION_HEADER)
+        for epoch in range(1, args.epochs + 1):
+            time.sleep(args.epoch_seconds)
+            acc = accuracy_at(trained + epoch, args.seed)
+            val_log.write(f"val\t{epoch}\t{epoch * 100}\t{acc:.6f}\t[]\t{1 - acc:.6f}\t1000\t0\t0\t[]\t0\n")
+            val_log.flush()
+            print(f"Epoch {epoch}/{args.epochs}: val acc {acc:.4f}", flush=True)
+            state = {"epoch": epoch, "total_epochs": trained + epoch, "val_acc": acc}
+            if epoch % args.save_freq == 0:
+                for ext in ("checkpoint", "pt"):
+                    write_checkpoint(os.path.join(args.output_path, f"model_{epoch:06d}.{ext}"), state)
+            if acc > best_acc:
+                best_acc, since_best = acc, 0
+                for ext in ("checkpoint", "pt"):
+                    write_checkpoint(os.path.join(args.output_path, f"model_best.{ext}"), state)
+            else:
+                since_best += 1
+                if args.early_stopping and since_best >= args.early_stopping:
+                    print(f"No improvement for {since_best} epochs; stopping early")
+                    break
+    for ext in ("checkpoint", "pt"):
+        write_checkpoint(os.path.join(args.output_path, f"model_final.{ext}"), state)
+
+if __name__ == "__main__":
+    main()